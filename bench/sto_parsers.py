@@ -0,0 +1,226 @@
+"""
+sto_parsers.py
+
+Benchmark of the unified Stockholm parser (cgk.iosto.read_sto, used by jps.util.iosto.sto_read)
+against the two parsers it replaced. Run from the root directory:
+
+    python3 -m bench.sto_parsers --rows 10000 --rows 1000000
+"""
+
+from collections import deque
+import os
+import random
+import tempfile
+import time
+
+import click
+
+from cgk.iosto import StockholmError, read_sto
+from jps.util.iosto import StoSequence, StoFeature, sto_read, sto_iter
+
+
+# -----------------------------------------------------------------------------
+# Replaced parsers, kept here for comparison
+
+class LegacyStockholmLine:
+    """ cgk.iosto.StockholmLine before the unified parser. """
+    __slots__ = "i fmt seqname field text".split()
+
+    def __init__(self, i, fmt, seqname, field, text):
+        self.i = i
+        self.fmt = fmt
+        self.seqname = seqname
+        self.field = field
+        self.text = text
+
+    @property
+    def descr(self):
+        return self.fmt, self.seqname, self.field
+
+    @classmethod
+    def parse(cls, i, line):
+        if len(line) == 0:
+            return cls(i, None, None, None, None)
+        elif line[:4] == '#=GF':
+            return cls(i, 'GF', None, *line.split(maxsplit=2)[1:])
+        elif line[:4] == '#=GS':
+            return cls(i, 'GS', *line.split(maxsplit=3)[1:])
+        elif line[:4] == '#=GC':
+            return cls(i, 'GC', None, *line.split(maxsplit=2)[1:])
+        elif line[:4] == '#=GR':
+            return cls(i, 'GR', *line.split(maxsplit=3)[1:])
+        elif line[0] == '#':
+            return cls(i, None, None, None, line)
+        elif line == '//':
+            return cls(i, None, None, None, line)
+        else:
+            seqname, alnseq = line.split(maxsplit=2)
+            return cls(i, None, seqname, None, alnseq)
+
+
+def legacy_cgk_read_sto(fname):
+    """ cgk.iosto.read_sto before the unified parser. """
+    gf = deque()
+    gs = dict()
+    block = deque()
+    blocks = list()
+    end_of_alignment = False
+
+    with open(fname) as f:
+        header = f.readline()
+        if header != '# STOCKHOLM 1.0\n':
+            raise StockholmError("Invalid Stockholm header")
+
+        for i, line in enumerate(map(lambda line: line.strip(), f), 2):
+            line = LegacyStockholmLine.parse(i, line)
+            if len(block) > 0 and not any(line.descr):
+                block.append(line)
+                if len(blocks) == 0:
+                    blocklen = len(block)
+                elif blocklen == len(block):
+                    blocks[0].rotate(-1)
+                else:
+                    raise StockholmError("Unexpected end of block")
+                blocks.append(block)
+                block = deque()
+                if line.text == '//':
+                    end_of_alignment = True
+                    break
+            elif not any(line.descr):
+                if line.text == '//':
+                    end_of_alignment = True
+                    break
+            elif line.fmt == 'GF':
+                gf.append((line.field, line.text))
+            elif line.fmt == 'GS':
+                gs.setdefault(line.seqname, deque()).append((line.field, line.text))
+            elif len(blocks) == 0:
+                block.append(line)
+                if len(line.text) != len(block[0].text):
+                    raise StockholmError("Unexpected seqlen")
+            elif blocks[0][0].descr == line.descr:
+                block.append(line)
+                blocks[0].rotate(-1)
+            else:
+                raise StockholmError("Unexpected block order")
+
+    if not end_of_alignment:
+        raise StockholmError("Unexpected end of file")
+
+    msa, gr, gc = dict(), dict(), dict()
+    for i in range(len(blocks[0])):
+        if blocks[0][0].fmt == None and blocks[0][0].seqname:
+            msa[blocks[0][0].seqname] = ''.join(blocks[j].popleft().text for j in range(len(blocks)))
+        elif blocks[0][0].fmt == 'GC':
+            field = blocks[0][0].field
+            gc[field] = ''.join(blocks[j].popleft().text for j in range(len(blocks)))
+        elif blocks[0][0].fmt == 'GR':
+            seqname, field = blocks[0][0].seqname, blocks[0][0].field
+            gr.setdefault(seqname, {})[field] = ''.join(blocks[j].popleft().text for j in range(len(blocks)))
+        else:
+            for j in range(len(blocks)):
+                blocks[j].rotate(-1)
+    return msa, gf, gs, gr, gc
+
+
+def legacy_jps_parseline(line):
+    """ jps.util.iosto.sto_parseline before the unified parser, with its constructor call fixed. """
+    if len(line) == 0:
+        return ''
+    elif line.startswith('#='):
+        fmt = line[2:4]
+        if fmt == 'GF' or fmt == 'GC':
+            field, text = line.split(maxsplit=2)[1:]
+            return StoFeature(text=text, fmt=fmt, esltag=None, field=field)
+        elif fmt == 'GS' or fmt == 'GR':
+            esltag, field, text = line.split(maxsplit=3)[1:]
+            return StoFeature(text=text, fmt=fmt, esltag=esltag, field=field)
+        raise StockholmError(f"Invalid Stockholm line of unknown format '{fmt}': {line}")
+    elif line.startswith('#') or line == '//':
+        return line
+    else:
+        esltag, alnseq = line.split(maxsplit=1)
+        chraccn, coords = esltag.split('/')
+        start, end = (int(p) for p in coords.split('-'))
+        strand = '-' if start > end else '+'
+        if strand == '-':
+            start, end = end, start
+        return StoSequence(chraccn=chraccn, start=start, end=end, strand=strand, alnseq=alnseq)
+
+
+def legacy_jps_sto_read(path):
+    """ jps.util.iosto.sto_read before the unified parser, with its call arity fixed. """
+    features, sequences = [], {}
+    with open(path) as f:
+        if f.readline() != '# STOCKHOLM 1.0\n':
+            raise StockholmError("Invalid Stockholm header")
+        for line in f:
+            line = legacy_jps_parseline(line.strip())
+            if isinstance(line, str):
+                if line == '//':
+                    break
+            elif isinstance(line, StoFeature):
+                features.append(line)
+            elif line.esltag in sequences:
+                sequences[line.esltag].alnseq += line.alnseq
+            else:
+                sequences[line.esltag] = line
+    return sequences, features
+
+
+# -----------------------------------------------------------------------------
+# Synthetic alignments
+
+def write_alignment(path: str, nrows: int, ncols: int = 200, nblocks: int = 1, seed: int = 0):
+    """ Write a cmsearch -A style alignment, split into nblocks interleaved blocks. """
+    rng = random.Random(seed)
+    residues = 'ACGU-.'
+    esltags = [f"NZ_SYN{i:08d}.1/{1000 + i}-{1000 + i + ncols}" for i in range(nrows)]
+    width = ncols // nblocks
+
+    with open(path, 'w') as f:
+        f.write('# STOCKHOLM 1.0\n#=GF AU Infernal 1.1.4\n\n')
+        for esltag in esltags:
+            f.write(f'#=GS {esltag} DE synthetic sequence\n')
+        for b in range(nblocks):
+            f.write('\n')
+            cols = width if b < nblocks - 1 else ncols - width * b
+            for esltag in esltags:
+                f.write(f"{esltag:<40} {''.join(rng.choices(residues, k=cols))}\n")
+                f.write(f"#=GR {esltag:<35} PP {'*' * cols}\n")
+            f.write(f"#=GC {'SS_cons':<35} {'<' * cols}\n")
+        f.write('//\n')
+
+
+def timeit(func, *args):
+    t = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t
+
+
+@click.command()
+@click.option('--rows', 'rows', multiple=True, type=int, default=[10000, 1000000])
+@click.option('--cols', 'cols', default=200)
+@click.option('--blocks', 'blocks', multiple=True, type=int, default=[1, 4])
+def main(rows, cols, blocks):
+    parsers = [
+        ("cgk read_sto (legacy)", legacy_cgk_read_sto),
+        ("jps sto_read (legacy)", legacy_jps_sto_read),
+        ("read_sto (unified)", read_sto),
+        ("sto_read (unified)", sto_read),
+        ("sto_iter", lambda path: sum(1 for _ in sto_iter(path))),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for nrows in rows:
+            for nblocks in blocks:
+                path = os.path.join(tmp, f"bench_{nrows}_{nblocks}.sto")
+                write_alignment(path, nrows, cols, nblocks)
+                size = os.path.getsize(path) / 2**20
+                print(f"{nrows} rows x {cols} cols, {nblocks} block(s), {size:.1f} MiB")
+                for name, parser in parsers:
+                    print(f"  {name:<24} {timeit(parser, path):8.2f} s")
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,12 @@ Module for handling Stockholm file i/o. Utilities used by Stockholm
 #     a user can define arbitrary lines w/ arbitrary syntax; these issues
 #     should be caught by the user of the syntax
 
+import gc
 import os
 import sys
 from pprint import pprint
 from collections import deque
+from contextlib import contextmanager, nullcontext
 
 class StockholmError(Exception):
     """
@@ -23,124 +25,128 @@ class StockholmError(Exception):
     """
             
 
-class StockholmLine:
+# Line formats returned by parse_line, besides GF, GS, GC, and GR
+SEQ = None      # Aligned sequence
+BLANK = ''      # Empty line, terminates a block
+COMMENT = '#'   # Comment
+END = '//'      # End of alignment
+
+
+def parse_line(line, i=None):
     """
-    Represents a single line in a Stockholm file during parsing.
+    Classifies a stripped line from a Stockholm file on its first bytes.
+    Returns a (fmt, seqname, field, text) tuple, where fmt is SEQ, BLANK,
+    COMMENT, END, or one of 'GF', 'GS', 'GC', 'GR'.
     """
-    __slots__ = "i fmt seqname field text".split()
-
-    def __init__(self, i, fmt, seqname, field, text):
-        self.i = i
-        self.fmt = fmt
-        self.seqname = seqname
-        self.field = field 
-        self.text = text
-
-    def __repr__(self):
-        return "%s(%d, %s, %s, %s, %s)" % (
-            type(self).__name__, self.i, *self.descr, self.text)
-    
-    def join(self, other):
-        if self.descr() != other.descr:
-            raise StockholmError("Line mismatch")
-        self.text += other.text
-
-    @property
-    def descr(self):
-        """Format descriptor for comparing line orders"""
-        return self.fmt, self.seqname, self.field
-
-    @classmethod
-    def blank(cls, i):
-        """Factory for a blank line"""
-        return cls(i, None, None, None, None)
-
-    @classmethod
-    def parse(cls, i, line):
-        """Factory for parsing a line from a Stockholm file"""
-        if len(line) == 0:
-            return cls.blank(i)
-        elif line[:4] == '#=GF':
-            return cls(i, 'GF', None, *line.split(maxsplit=2)[1:])
-        elif line[:4] == '#=GS':
-            return cls(i, 'GS', *line.split(maxsplit=3)[1:])
-        elif line[:4] == '#=GC':
-            return cls(i, 'GC', None, *line.split(maxsplit=2)[1:])
-        elif line[:4] == '#=GR':
-            return cls(i, 'GR', *line.split(maxsplit=3)[1:])
+    try:
+        if not line:
+            return BLANK, None, None, line
         elif line[0] == '#':
-            return cls(i, None, None, None, line)
+            if line[1:2] != '=':
+                return COMMENT, None, None, line
+            fmt = line[2:4]
+            if fmt == 'GR' or fmt == 'GS':
+                _, seqname, field, text = line.split(None, 3)
+                return fmt, seqname, field, text
+            elif fmt == 'GC' or fmt == 'GF':
+                _, field, text = line.split(None, 2)
+                return fmt, None, field, text
+            raise StockholmError("Unknown markup '%s'" % fmt)
         elif line == '//':
-            return cls(i, None, None, None, line)
+            return END, None, None, line
         else:
-            seqname, alnseq = line.split(maxsplit=2)
-            return cls(i, None, seqname, None, alnseq)
-            
+            seqname, text = line.split(None, 1)
+            return SEQ, seqname, None, text
+    except ValueError:
+        raise StockholmError("Malformed line %s: %s" % (i, line)) from None
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pauses cyclic garbage collection. Parsing allocates millions of objects
+    but no reference cycles, so collection passes would only cost time.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
 
 def read_sto(fname):
     """
-    Extracts parsed content from a Stockholm file.
+    Extracts parsed content from a Stockholm file, given its path or an
+    open text file.
+
+    Rows (sequences, GC, and GR lines) are registered in order while reading
+    the first block; every later block must repeat them in the same order and
+    is read into a buffer preallocated with one slot per row. Fragments are
+    joined once at the end.
     """
     gf = deque()
     gs = dict()
-    block = deque()
+    rows = list()       # (fmt, seqname, field) of each row, in first-block order
+    seen = set()
+    block = list()      # Fragments of the current block, one slot per row
     blocks = list()
+    k = 0               # Position of the current line within its block
+    width = None        # Text width of the current block
     end_of_alignment = False
 
-    with open(fname) as f:
-    
+    with gc_paused(), open(fname) if isinstance(fname, str) else nullcontext(fname) as f:
+
         header = f.readline()
         if header != '# STOCKHOLM 1.0\n':
             raise StockholmError("Invalid Stockholm header")
-    
-        for i, line in enumerate(map(lambda line: line.strip(), f), 2):
-
-            line = StockholmLine.parse(i, line)
-
-            # An empty line terminates a block
-            if len(block) > 0 and not any(line.descr):
-                block.append(line)
-                if len(blocks) == 0:
-                    blocklen = len(block)
-                elif blocklen == len(block):
-                    blocks[0].rotate(-1)
+
+        for i, line in enumerate(f, 2):
+
+            fmt, seqname, field, text = parse_line(line.strip(), i)
+
+            # Alignment rows, the bulk of the file
+            if fmt is SEQ or fmt == 'GC' or fmt == 'GR':
+                if width is None:
+                    width = len(text)
+                elif len(text) != width:
+                    raise StockholmError("Unexpected seqlen at line %d" % i)
+
+                if not blocks:
+                    descr = fmt, seqname, field
+                    if descr in seen:
+                        raise StockholmError("Duplicate row at line %d" % i)
+                    seen.add(descr)
+                    rows.append(descr)
+                    block.append(text)
+                elif k >= len(rows) or rows[k] != (fmt, seqname, field):
+                    raise StockholmError("Unexpected block order at line %d" % i)
                 else:
-                    raise StockholmError("Unexpected end of block")
+                    block[k] = text
+                k += 1
+                continue
+
+            # An empty line or the end of the alignment terminates a block
+            if (fmt == BLANK or fmt == END) and k > 0:
+                if blocks and k != len(rows):
+                    raise StockholmError("Unexpected end of block at line %d" % i)
                 blocks.append(block)
-                block = deque()
-                if line.text == '//':
-                    end_of_alignment = True
-                    break
+                block = [None] * len(rows)
+                k = 0
+                width = None
 
-            # An empty line which does not end a block
-            elif not any(line.descr):
-                if line.text == '//':
-                    end_of_alignment = True
-                    break
+            if fmt == END:
+                end_of_alignment = True
+                break
 
             # GF can occur at any time (no further processing needed)
-            elif line.fmt == 'GF':
-                record = line.field, line.text
-                gf.append(record)
+            elif fmt == 'GF':
+                gf.append((field, text))
 
             # GS can occur at any time (check name validity after parsing)
-            elif line.fmt == 'GS':
-                record = line.field, line.text
-                gs.setdefault(line.seqname, deque()).append(record)
-
-            # Primary block
-            elif len(blocks) == 0:
-                block.append(line)
-                if len(line.text) != len(block[0].text):
-                    raise StockholmError("Unexpected seqlen")
-                
-            # Secondary blocks must be checked against primary block
-            elif blocks[0][0].descr == line.descr:
-                block.append(line)
-                blocks[0].rotate(-1)
-
-            else:
-                raise StockholmError("Unexpected block order")
+            elif fmt == 'GS':
+                gs.setdefault(seqname, deque()).append((field, text))
 
     if not end_of_alignment:
         raise StockholmError("Unexpected end of file")
@@ -149,27 +155,21 @@ def read_sto(fname):
     gr = dict()
     gc = dict()
 
-    for i in range(len(blocks[0])):
-        if blocks[0][0].fmt == None and blocks[0][0].seqname:
-            seqname = blocks[0][0].seqname
-            alnseq = ''.join(blocks[j].popleft().text for j in range(len(blocks)))
+    if len(blocks) == 1:
+        alnseqs = blocks[0]
+    else:
+        alnseqs = [''.join(fragments) for fragments in zip(*blocks)]
+
+    for (fmt, seqname, field), alnseq in zip(rows, alnseqs):
+        if fmt is SEQ:
             msa[seqname] = alnseq
-        elif blocks[0][0].fmt == 'GC':
-            field = blocks[0][0].field
-            alnseq = ''.join(blocks[j].popleft().text for j in range(len(blocks)))
+        elif fmt == 'GC':
             gc[field] = alnseq
-        elif blocks[0][0].fmt == 'GR':
-            seqname = blocks[0][0].seqname
-            field = blocks[0][0].field
-            alnseq = ''.join(blocks[j].popleft().text for j in range(len(blocks)))
-            gr.setdefault(seqname, {})[field] = alnseq
         else:
-            for j in range(len(blocks)):
-                blocks[j].rotate(-1)
-    
+            gr.setdefault(seqname, {})[field] = alnseq
+
     for seqname in gs:
         if seqname not in msa:
             raise StockholmError("GS seqname %s not in alignment" % seqname)
         
     return msa, gf, gs, gr, gc
-
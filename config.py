@@ -7,6 +7,7 @@ SEARCHES_DIR = os.path.join(DATADIR, "searches")
 ANALYSIS_DIR = os.path.join(DATADIR, "analysis")
 REFOLD_DIR = os.path.join(DATADIR, "refold")
 STO_DIR = os.path.join(DATADIR, "sto")
+CACHE_DIR = os.path.join(DATADIR, "cache")
 
 SCRIPTS_DIR = os.path.join(basedir, "jps/scripts")
 
@@ -15,12 +16,29 @@ SCRIPTS_DIR = os.path.join(basedir, "jps/scripts")
 os.makedirs(SEARCHES_DIR, exist_ok=True)
 os.makedirs(ANALYSIS_DIR, exist_ok=True)
 os.makedirs(REFOLD_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
 
 # Database paths
 GTDB_PROK_DB = "/gpfs/gibbs/pi/breaker/cgkdb/gtdb/gtdb-bact-r207-repr.fna.gz"
 
 
+# Parsed alignment cache settings
+STO_CACHE_DIR = os.path.join(CACHE_DIR, "sto")
+STO_CACHE_MAXBYTES = 20 * 2**30  # Least recently used entries are evicted beyond this size
+
+
 # SQLAlchemy settings
-SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(basedir, "data.sqlite")}'
+SQLALCHEMY_DATABASE_URI = os.environ.get('JPS_DATABASE_URI', f'sqlite:///{os.path.join(basedir, "data.sqlite")}')
+
+# SQLite storage profile, applied to every connection (see jps.db)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers (e.g. the web app) don't block the writer
+    'synchronous': 'NORMAL',  # Safe with WAL; fsyncs only at checkpoints
+    'cache_size': -256 * 2**10,  # In KiB when negative: 256 MiB
+    'mmap_size': 8 * 2**30,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PAGE_SIZE = 16384  # Applied to new databases, and to existing ones by `jps db optimize`
+SQLITE_BULK_PRAGMAS = {'synchronous': 'OFF'}  # During bulk loads, which can be rerun if interrupted
 
 
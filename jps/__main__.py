@@ -1,9 +1,9 @@
 import click
+from tabulate import tabulate
 
 from config import *
-from jps.analyze import *
+from jps.models import *
 from jps.util.helpers import *
-import jps.pipe as pipe
 
 
 @click.group()
@@ -15,24 +15,146 @@ def cli():
 @click.option('--e', 'e', default=1000.0)  # E-value threshold and cutoff
 @click.option('--dbfna', 'dbfna', default=GTDB_PROK_DB)  # path to database FASTA file
 def cmsearch(sto, e, dbfna):
-    cmsearch_out = pipe.cmsearch(sto, e=e, dbfna=dbfna)
-    print(f"Next, run analyze on {cmsearch_out}")
+    from jps.routes import cmbuild_submit, cmsearch_submit, cmsearch_parse
+    cmbuild_submit(sto, cm := f"{sto}.cm").wait()
+    with SessionLocal() as session:
+        search = cmsearch_submit(cm, f"-E {e} --incE {e}", dbfna)
+        session.add(search)
+        session.commit()
+        search.job.wait()
+        session.commit()
+        cmsearch_parse(search)
+        print(f"Next, run analyze on {search.id}")
 
 
 @cli.command()
-@click.argument('cmsearch_out')
+@click.option('--searches', 'searches_dir', default=SEARCHES_DIR)  # directory of search result directories
+@click.option('--workers', 'workers', default=None, type=int)  # number of parser processes
+def ingest(searches_dir, workers):
+    from jps.ingest import ingest_all
+    ingest_all(searches_dir, workers=workers)
+
+
+@cli.command()
+@click.argument('dirs', nargs=-1)  # search directories (default: every directory in SEARCHES_DIR)
+@click.option('--format', 'fmt', default='gz', type=click.Choice(['gz', 'xz', 'bz2']))
+def compress(dirs, fmt):
+    from jps.util.compress import compress_file
+    dirs = dirs or sorted(entry.path for entry in os.scandir(SEARCHES_DIR) if entry.is_dir())
+    for d in dirs:
+        for name in sorted(os.listdir(d)):
+            if not name.endswith(('.sto', '.tbl', '.out')):
+                continue
+            path = os.path.join(d, name)
+            if os.path.exists(f"{path}.idx"):
+                os.remove(f"{path}.idx")  # Offsets no longer match the compressed file
+            # Stockholm files are written as BGZF so that StoReader keeps random access to them
+            print(f"Compressed {compress_file(path, f'.{fmt}', bgzf=name.endswith('.sto'))}")
+
+
+@cli.command()
+@click.argument('search_ids', nargs=-1, type=int, required=True)
+@click.option('--dbfna', 'dbfna', default=GTDB_PROK_DB)  # path to database FASTA file, plain or gzipped
+@click.option('--out', 'out', required=True)  # path of the output FASTA file
+@click.option('--nt5p', 'nt5p', default=0)  # flanking nts upstream of each hit
+@click.option('--nt3p', 'nt3p', default=0)  # flanking nts downstream of each hit
+def extract(search_ids, dbfna, out, nt5p, nt3p):
+    from jps.neighbors import search_hits
+    from jps.util.flanks import stream_fasta
+    with SessionLocal() as session:
+        intervals, _, _ = search_hits(session, [session.get(Search, search_id) for search_id in search_ids])
+    stream_fasta(dbfna, intervals, out, nt5p, nt3p)
+    print(f"Wrote {len(intervals)} sequences to {out}")
+
+
+@cli.group()
+def db():
+    pass
+
+
+@db.command()
+@click.option('--no-vacuum', 'no_vacuum', is_flag=True)  # skip rebuilding the database file
+def optimize(no_vacuum):
+    from jps.db import optimize
+    for name, plan in optimize(vacuum=not no_vacuum).items():
+        print(name)
+        for step in plan:
+            print(f"    {step}")
+
+
+@cli.command()
+@click.argument('dbfna', default=GTDB_PROK_DB)  # path to database FASTA file, plain or gzipped
+@click.option('--out', 'out', default=None)  # path of the BGZF copy (default: <dbfna without .gz>.bgz)
+def bgzip(dbfna, out):
+    from jps.util.bgzf import bgzf_compress
+    print(f"Wrote {bgzf_compress(dbfna, out)} with .gzi and .fai indexes")
+
+
+@cli.command()
+@click.argument('search_ids', nargs=-1, type=int, required=True)
+@click.option('--distance', 'max_distance', default=100)  # maximum distance between hits of a pair
+@click.option('--strand', 'strand', default=None, type=click.Choice(['same', 'opposite']))
+@click.option('--across', is_flag=True)  # only pairs of hits from different searches
+def neighbors(search_ids, max_distance, strand, across):
+    from jps.neighbors import find_neighbors, store_neighbors
+    sign = {'same': 1, 'opposite': -1}.get(strand)
+    with SessionLocal() as session:
+        searches = [session.get(Search, search_id) for search_id in search_ids]
+        table = find_neighbors(session, searches, max_distance, sign, across)
+        store_neighbors(session, searches, table)
+    print(tabulate(table.tolist(), headers=table.dtype.names, tablefmt="plain"))
+    print(f"Found {len(table)} pairs of hits within {max_distance} nt")
+
+
+@cli.command()
+@click.argument('search_ids', nargs=-1, type=int, required=True)
+@click.option('--threshold', 'thresholds', multiple=True, type=float, default=[0.01])  # E-value thresholds
+def counts(search_ids, thresholds):
+    from jps.summary import get_summary
+    with SessionLocal() as session:
+        rows = []
+        for search_id in search_ids:
+            search = session.get(Search, search_id)
+            summary = get_summary(session, search)
+            rows.append([search.name, summary.count(), summary.count(unique=True),
+                         *(n for e in thresholds for n in (summary.count(e), summary.count(e, unique=True)))])
+        session.commit()
+    headers = ["Name", "# Total", "# Unique", *(h for e in thresholds for h in (f"# E<={e}", f"# Unique E<={e}"))]
+    print(tabulate(rows, headers=headers, tablefmt="plain"))
+
+
+@cli.command()
+@click.argument('search_id', type=int)
 @click.argument('color', default="DarkBlue")
 @click.option('--threshold', default=1.0)
-def analyze(cmsearch_out, color, threshold):
-    uniq_keep_sto = pipe.analyze(cmsearch_out, color=color, threshold=threshold)
+@click.option('--identity', 'identity', default=None, type=float)  # also count hits this identical to a better one as duplicates
+def analyze(search_id, color, threshold, identity):
+    from jps.routes import cmsearch_analyze
+    with SessionLocal() as session:
+        search = session.get(Search, search_id)
+        uniq_keep_sto = cmsearch_analyze(search, color=color, threshold=threshold, identity=identity)
     print(f"Next, run refold on {uniq_keep_sto}")
 
 
+def _reformat(sto: str, out: str = None) -> str:
+    """ Reformat a Stockholm alignment as FASTA, by default next to it. Returns the FASTA path. """
+    from jps.routes import sto_reformat
+    out = out or f"{os.path.splitext(sto)[0]}.fna"
+    sto_reformat(sto, out)
+    return out
+
+
+def _cmfind(fna: str) -> str:
+    """ Run CMfinder on a FASTA file and wait for it. Returns the path of its motif alignment. """
+    from jps.routes import run_cmfinder
+    run_cmfinder(fna).wait()
+    return f"{fna}.motif.h2_1"
+
+
 @cli.command()
 @click.argument('sto')
 def refold(sto):
-    fna = pipe.reformat(sto)
-    motif_sto = pipe.cmfind(fna)
+    motif_sto = _cmfind(_reformat(sto))
     print(f"Next, run r2r on {motif_sto}")
 
 
@@ -41,21 +163,22 @@ def refold(sto):
 @click.argument('sto')
 @click.argument('out', default=None)
 def reformat(sto, out):
-    fna = pipe.reformat(sto, out=out)
+    fna = _reformat(sto, out)
     print(f"Next, run cmfind on {fna}")
 
 
 @cli.command()
 @click.argument('fna')
 def cmfind(fna):
-    motif_sto = pipe.cmfind(fna)
+    motif_sto = _cmfind(fna)
     print(f"Next, run r2r on {motif_sto}")
 
 
 @cli.command()
 @click.argument('path')
 def r2r(path):
-    pipe.r2r(path)
+    from jps.routes import runr2r
+    runr2r(path)
 
 
 if __name__ == '__main__':
@@ -2,35 +2,28 @@
 Analyze search results and generate plots.
 """
 
+from dataclasses import dataclass
+import heapq
 import pandas
 import sys, os
 import matplotlib.pyplot as plt
 import numpy as np
+from sqlalchemy import select
 from tabulate import tabulate
 
 from config import *
 from jps.models import *
-from jps.routes import *
 from jps.util.helpers import *
 import jps.util.iosto as iosto
-from jps.extra.interval import ChrInterval
+from jps.sinks import HistogramSink, row_seqkey
+from jps.util.intervalarray import ChrIntervalArray
+from cgk.interval import ChrInterval
 
 
-# def compare(search1: Search, search2: Search):
-#     for hit in search1.overlapping_hits(search2).all():
-#         if h1.overlaps(h2) != 0:
-#             intersects.append((h1, h2))
-#         # Check for tandems
-#         elif h1.distance_to(h2) <= 100:
-#             print(f"Found tandem: {h1.chraccn} {h1.start}-{h1.end} (bit={h1.bitscore}) {h2.start}-{h2.end} (bit={h2.bitscore})")
-    
-#     return intersects
-
-
-def plot_score_distribution(hits: list[Hit], name, color, out, threshold=0.01):
-    df = pandas.DataFrame([hit.asdict() for hit in hits])
-    score = np.log10(df["evalue"])
-    ax = score.hist(bins=50, color=color, label=name, log=True)
+def plot_score_distribution(hist: HistogramSink, name, color, out, threshold=0.01):
+    """ Plot the E-value histogram accumulated by a HistogramSink. """
+    ax = plt.gca()
+    ax.hist(hist.centers, bins=50, weights=hist.counts, color=color, label=name, log=True)
     ax.axvline(x=np.log10(threshold), color=color, linestyle='dashed')
     ax.set_title(f"{name} score distribution")
     ax.set_xlabel('log(E-value)')
@@ -39,8 +32,145 @@ def plot_score_distribution(hits: list[Hit], name, color, out, threshold=0.01):
     plt.clf()
 
 
-def compare(search1: Search, search2: Search):
-    pass
+def hit_intervals(session, search: Search, unique: bool = False) -> tuple[ChrIntervalArray, np.ndarray]:
+    """
+    Intervals and E-values of a search's hits, in rank order. With unique=True, only the
+    first hit of each sequence is kept, by the seqkey rule of jps.sinks.route_hits.
+    """
+    rows = session.execute(
+        select(Hit.chraccn, Hit.start, Hit.end, Hit.strand, Hit.evalue, Alnseq.digest)
+        .outerjoin(Alnseq).where(Hit.search_id == search.id).order_by(Hit.rank)
+        .execution_options(yield_per=10000))
+    seen = set()
+    kept = []
+    for *columns, digest in rows:
+        if unique:
+            key = row_seqkey(*columns[:4], digest)
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(columns)
+    rows = kept
+    if not rows:
+        return ChrIntervalArray.empty(), np.empty(0)
+    *columns, evalues = zip(*rows)
+    return ChrIntervalArray.from_columns(*columns), np.array(evalues, dtype=np.float64)
+
+
+def overlap_join(a: ChrIntervalArray, b: ChrIntervalArray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find every pair of overlapping intervals (on either strand) between a and b, with a single
+    sort-merge sweep per chraccn. Returns the indices into a and into b of each pair.
+    """
+    names = np.union1d(a.names, b.names)
+    codes = (a.recode(names).tolist(), b.recode(names).tolist())
+    starts, ends = (a.starts.tolist(), b.starts.tolist()), (a.ends.tolist(), b.ends.tolist())
+    orders = [np.lexsort((x.starts, code)).tolist() for x, code in zip((a, b), codes)]
+
+    pairs = ([], [])
+    active: tuple[list, list] = ([], [])  # Heaps of (end, index) of intervals still open on each side
+    pos = [0, 0]
+    chrcode = None
+    while pos[0] < len(orders[0]) or pos[1] < len(orders[1]):
+        # Take the next interval by (chraccn, start) from either side
+        keys = [(codes[s][orders[s][pos[s]]], starts[s][orders[s][pos[s]]]) if pos[s] < len(orders[s]) else None
+                for s in (0, 1)]
+        side = 0 if keys[1] is None or (keys[0] is not None and keys[0] <= keys[1]) else 1
+        other = 1 - side
+        i = orders[side][pos[side]]
+        pos[side] += 1
+
+        if codes[side][i] != chrcode:
+            chrcode = codes[side][i]
+            active[0].clear()
+            active[1].clear()
+
+        # Close intervals on the other side that end before this one starts; the rest overlap it
+        start = starts[side][i]
+        opened = active[other]
+        while opened and opened[0][0] < start:
+            heapq.heappop(opened)
+        pairs[side].extend([i] * len(opened))
+        pairs[other].extend(j for _, j in opened)
+        heapq.heappush(active[side], (ends[side][i], i))
+
+    return np.array(pairs[0], dtype=np.int64), np.array(pairs[1], dtype=np.int64)
+
+
+@dataclass
+class Comparison:
+    """
+    Overlaps between the hits of two searches, with the E-values of both sides, so that
+    counts at any pair of E-value thresholds come from cumulative counts without new joins.
+    """
+    evalues1: np.ndarray  # E-value of each hit of search1, in rank order
+    evalues2: np.ndarray
+    pairs1: np.ndarray  # Indices into evalues1 of overlapping hits of search1...
+    pairs2: np.ndarray  # ...and into evalues2 of the search2 hits they overlap
+
+    @property
+    def best1(self) -> np.ndarray:
+        """ Lowest E-value of the search2 hits overlapping each search1 hit (inf if none). """
+        best = np.full(len(self.evalues1), np.inf)
+        np.minimum.at(best, self.pairs1, self.evalues2[self.pairs2])
+        return best
+
+    @property
+    def best2(self) -> np.ndarray:
+        """ Lowest E-value of the search1 hits overlapping each search2 hit (inf if none). """
+        best = np.full(len(self.evalues2), np.inf)
+        np.minimum.at(best, self.pairs2, self.evalues1[self.pairs1])
+        return best
+
+    @staticmethod
+    def _sweep(evalues: np.ndarray, best: np.ndarray, threshold: float, thresholds: list[float]) -> np.ndarray:
+        """ Number of hits with E <= threshold that overlap a hit with E <= t, for each t. """
+        return np.searchsorted(np.sort(best[evalues <= threshold]), thresholds, side='right')
+
+    def sweep1(self, threshold1: float, thresholds2: list[float]) -> np.ndarray:
+        """ Number of search1 hits at E <= threshold1 found by search2 at each of thresholds2. """
+        return self._sweep(self.evalues1, self.best1, threshold1, thresholds2)
+
+    def sweep2(self, threshold2: float, thresholds1: list[float]) -> np.ndarray:
+        """ Number of search2 hits at E <= threshold2 found by search1 at each of thresholds1. """
+        return self._sweep(self.evalues2, self.best2, threshold2, thresholds1)
+
+
+def compare(search1: Search, search2: Search, unique: bool = False) -> Comparison:
+    """ Overlaps between the hits of two searches, or only their unique hits (see hit_intervals). """
+    with SessionLocal() as session:
+        intervals1, evalues1 = hit_intervals(session, search1, unique)
+        intervals2, evalues2 = hit_intervals(session, search2, unique)
+    pairs1, pairs2 = overlap_join(intervals1, intervals2)
+    return Comparison(evalues1, evalues2, pairs1, pairs2)
+
+
+def compare_categories(search1: Search, search2: Search, combo: Search,
+                       thresholds=(1000, 100, 10, 1), threshold: float = 1) -> list[list]:
+    """
+    Compare a combined model's search against the searches of two older models, whose hits
+    are kept at E <= threshold, for each E-value threshold of the combined search. Returns
+    table rows of [E, I, II, III, IV, V] of unique hits where:
+        I   = # of search1 hits not in combo
+        II  = # of search1 hits in combo
+        III = # of combo hits not in search1 or search2
+        IV  = # of search2 hits in combo
+        V   = # of search2 hits not in combo
+    """
+    cmp1, cmp2 = compare(search1, combo, unique=True), compare(search2, combo, unique=True)
+    thresholds = list(thresholds)
+    in1 = cmp1.sweep1(threshold, thresholds)
+    in2 = cmp2.sweep1(threshold, thresholds)
+    total1 = int(np.count_nonzero(cmp1.evalues1 <= threshold))
+    total2 = int(np.count_nonzero(cmp2.evalues1 <= threshold))
+
+    # Combo hits found by neither older model, counted at each combo threshold
+    evalues = cmp1.evalues2
+    novel = np.sort(evalues[(cmp1.best2 > threshold) & (cmp2.best2 > threshold)])
+    III = np.searchsorted(novel, thresholds, side='right')
+
+    return [[t, total1 - int(i1), int(i1), int(iii), int(i2), total2 - int(i2)]
+            for t, i1, i2, iii in zip(thresholds, in1, in2, III)]
 
 
 
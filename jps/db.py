@@ -0,0 +1,143 @@
+"""
+db.py
+
+Module for maintaining the SQLite database: bulk-load settings, index creation, and
+optimization with a report of the query plans of common queries.
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, select, insert, delete, event
+from sqlalchemy.pool import NullPool
+
+from config import *
+from jps.models import *
+from jps.models.search import HIT_RTREE_DDL
+
+# Common queries whose plans `jps db optimize` reports; each should use an index
+PLAN_QUERIES = {
+    "Hits of a search under an E-value threshold":
+        select(Hit).where(Hit.search_id == 1, Hit.evalue <= 0.01),
+    "Hits of a search in rank order":
+        select(Hit).where(Hit.search_id == 1).order_by(Hit.rank),
+    "Hits overlapping a chromosome region":
+        select(Hit).where(Hit.chraccn == 'NC_000913.3', Hit.start <= 20000, Hit.end >= 10000),
+    "Hits in a chromosome window, through the R*Tree":
+        hits_in_window('NC_000913.3', 10000, 20000),
+    "Distinct sequences of a search":
+        select(Alnseq.digest).join(Hit).where(Hit.search_id == 1).distinct(),
+}
+
+
+def _pragmas(dbapi_connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def _reset_bulk_pragmas(dbapi_connection, connection_record):
+    """ Restore SQLITE_PRAGMAS on a connection that bulk_load relaxed, as it is checked in. """
+    if connection_record.info.pop('bulk_load', False) and dbapi_connection is not None:
+        _pragmas(dbapi_connection, {name: SQLITE_PRAGMAS[name] for name in SQLITE_BULK_PRAGMAS})
+
+
+@contextmanager
+def bulk_load(session):
+    """
+    Relax durability settings (SQLITE_BULK_PRAGMAS) for a bulk load through a session. They
+    are applied to every connection checked out of the session's engine during the load,
+    since commits hand connections back to the pool, and reset as each is checked in, so
+    no connection returns to the pool relaxed whether or not the load fails.
+    """
+    engine = session.get_bind()
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        _pragmas(dbapi_connection, SQLITE_BULK_PRAGMAS)
+        connection_record.info['bulk_load'] = True
+
+    if not event.contains(engine, 'checkin', _reset_bulk_pragmas):
+        event.listen(engine, 'checkin', _reset_bulk_pragmas)
+    event.listen(engine, 'checkout', checkout)
+    if session.in_transaction():
+        # Already checked out. SQLite cannot change the safety level inside a transaction, so a
+        # connection that has written is left as is, and relaxed from the next checkout
+        connection = session.connection().connection
+        if not connection.dbapi_connection.in_transaction:
+            checkout(connection.dbapi_connection, connection, None)
+    try:
+        yield session
+    finally:
+        event.remove(engine, 'checkout', checkout)
+
+
+def create_indexes():
+    """ Create indexes declared on the models, and the hit R*Tree, if missing from an existing database. """
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    build_rtree()
+
+
+def build_rtree():
+    """
+    Create hit_rtree if missing and add the boxes of any hits it lacks (numbering their
+    chraccns as Contigs), such as those of searches ingested before the R*Tree index existed.
+    """
+    with engine.begin() as connection:
+        connection.execute(HIT_RTREE_DDL)
+        connection.execute(insert(Contig).from_select(
+            ['chraccn'], select(Hit.chraccn).where(Hit.chraccn.not_in(select(Contig.chraccn))).distinct()))
+        connection.execute(insert(hit_rtree).from_select(
+            ['id', 'chr0', 'chr1', 'lo', 'hi'],
+            select(Hit.rtree_id, Contig.id, Contig.id, Hit.start, Hit.end)
+            .join(Contig, Contig.chraccn == Hit.chraccn)
+            .outerjoin(hit_rtree, hit_rtree.c.id == Hit.rtree_id)
+            .where(hit_rtree.c.id.is_(None))))
+
+
+def prune_alnseqs() -> int:
+    """ Delete the alnseqs that no hit or feature refers to any more. Returns how many were deleted. """
+    with engine.begin() as connection:
+        return connection.execute(delete(Alnseq).where(
+            Alnseq.key.not_in(select(Hit.alnseq_key).where(Hit.alnseq_key.is_not(None))),
+            Alnseq.key.not_in(select(StoFeature.alnseq_key).where(StoFeature.alnseq_key.is_not(None))),
+        )).rowcount
+
+
+def query_plans() -> dict[str, list[str]]:
+    """ SQLite's plan for each of PLAN_QUERIES. """
+    plans = {}
+    with engine.connect() as connection:
+        for name, query in PLAN_QUERIES.items():
+            compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+            plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def optimize(vacuum: bool = True) -> dict[str, list[str]]:
+    """
+    Create missing indexes, delete orphaned alnseqs, refresh the planner's statistics, and
+    (with vacuum) rebuild the database with SQLITE_PAGE_SIZE pages. Returns the resulting
+    query_plans().
+    """
+    create_indexes()
+    prune_alnseqs()
+
+    # Leaving WAL mode needs the only connection to the database, so close the idle pooled
+    # connections and work through a connection of our own
+    engine.dispose()
+    maintenance = create_engine(engine.url, poolclass=NullPool)
+    with maintenance.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("ANALYZE")
+        if vacuum:
+            # The page size of a WAL database cannot change, so VACUUM in rollback journal mode
+            connection.exec_driver_sql("PRAGMA journal_mode = DELETE")
+            connection.exec_driver_sql(f"PRAGMA page_size = {SQLITE_PAGE_SIZE}")
+            connection.exec_driver_sql("VACUUM")
+            connection.exec_driver_sql(f"PRAGMA journal_mode = {SQLITE_PRAGMAS['journal_mode']}")
+        connection.exec_driver_sql("PRAGMA optimize")
+    maintenance.dispose()
+    return query_plans()
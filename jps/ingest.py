@@ -0,0 +1,319 @@
+"""
+ingest.py
+
+Bulk ingestion of cmsearch result directories. Worker processes parse the .tbl and .sto files
+of each search in parallel and stream parsed rows back to the main process, which is the only
+one to touch the SQLite database, and writes them with BulkWriter.
+"""
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import queue as queuelib
+import os
+import sys
+import traceback
+from typing import Iterator
+import numpy as np
+
+from sqlalchemy import select, insert, delete
+
+from config import *
+from jps.models import *
+from jps.util.helpers import *
+from jps.db import bulk_load
+import jps.util.iosto as iosto
+import jps.util.tblio as tblio
+from jps.util.compress import resolve
+from jps.summary import SummaryBuilder
+from cgk.interval import ChrInterval
+
+BATCH_SIZE = 5000  # Rows per message from a worker
+POLL_INTERVAL = 5  # Seconds between checks for workers that died without reporting
+
+# Queue to the writer, set in each worker process
+_queue = None
+
+
+def discover(searches_dir: str = SEARCHES_DIR) -> list[str]:
+    """ Find search result directories, returning the datapath of each search's output. """
+    datapaths = []
+    for name in sorted(os.listdir(searches_dir)):
+        datapath = os.path.join(os.path.relpath(searches_dir, DATADIR), name, f"{name}.out")
+        if os.path.exists(resolve(f"{fullpath(datapath)}.tbl")):
+            datapaths.append(datapath)
+    return datapaths
+
+
+def cmsearch_hitrows(table: np.ndarray, rank: int = 0) -> Iterator[tuple[str, dict]]:
+    """ Esltag and Hit column values of each row of a typed cmsearch table, ranked from rank. """
+    minus = table['strand'] == '-'
+    columns = dict(
+        chraccn=table['target_name'], start=np.where(minus, table['seq_to'], table['seq_from']),
+        end=np.where(minus, table['seq_from'], table['seq_to']), strand=table['strand'],
+        evalue=table['E_value'], bitscore=table['score'], bias=table['bias'], gc=table['gc'],
+        trunc=table['trunc'], mdl_from=table['mdl_from'], mdl_to=table['mdl_to'])
+    eslcoords = zip(table['seq_from'].tolist(), table['seq_to'].tolist())
+    for i, (values, coords) in enumerate(zip(zip(*(col.tolist() for col in columns.values())), eslcoords)):
+        row = dict(zip(columns, values), rank=rank + i)
+        yield ChrInterval.make_esltag(row['chraccn'], coords), row
+
+
+def parse_search(datapath: str, batch_size: int = BATCH_SIZE) -> Iterator[tuple[str, object]]:
+    """
+    Parse the .sto and .tbl files of a search into batches of rows, as (kind, payload) pairs:
+      ('sto', (alnseqs, features))  alnseqs are Alnseq.pack values in alignment order; features
+                                    are (key, row, fmt, field, text) where key and row are their
+                                    alnseq's content key and row in the alignment
+      ('hits', rows)                Hit column values, with their alnseq_key and alnrow
+      ('summary', values)           SearchSummary column values, last
+    Alnseqs are keyed by content, so the rows reference each other without any database ids.
+    Identical rows of an alignment share an alnseq, but not their features, which follow the row.
+    """
+    path = fullpath(datapath)
+    esltag_to_alnseq: dict[str, tuple[bytes, int, int]] = {}  # Key, digest and row of each alnseq
+
+    if os.path.exists(resolve(f"{path}.sto")):
+        alnseqs, features = [], []
+        pending = defaultdict(list)  # GS lines precede their sequence
+        for record in iosto.sto_iter(f"{path}.sto"):
+            if isinstance(record, iosto.StoSequence):
+                alnseq = Alnseq.pack(record.alnseq)
+                key, row = alnseq['key'], len(esltag_to_alnseq)
+                esltag_to_alnseq[record.esltag] = key, alnseq['digest'], row
+                alnseqs.append(alnseq)
+                features += [(key, row, feat.fmt, feat.field, feat.text) for feat in pending.pop(record.esltag, ())]
+            elif record.esltag is None:
+                features.append((None, None, record.fmt, record.field, record.text))
+            elif record.esltag in esltag_to_alnseq:
+                key, _, row = esltag_to_alnseq[record.esltag]
+                features.append((key, row, record.fmt, record.field, record.text))
+            else:
+                pending[record.esltag].append(record)
+
+            if len(alnseqs) + len(features) >= batch_size:
+                yield 'sto', (alnseqs, features)
+                alnseqs, features = [], []
+
+        # Features of sequences missing from the alignment are kept unlinked
+        features += [(None, None, feat.fmt, feat.field, feat.text) for feats in pending.values() for feat in feats]
+        yield 'sto', (alnseqs, features)
+
+    rank = 0
+    summary = SummaryBuilder()
+    for table in tblio.tbl_iter_typed(f"{path}.tbl", chunksize=batch_size):
+        rows = []
+        for esltag, row in cmsearch_hitrows(table, rank):
+            key, digest, row['alnrow'] = esltag_to_alnseq.get(esltag, (None, None, None))
+            row['alnseq_key'] = key
+            rows.append(row)
+            summary.add(row['chraccn'], row['evalue'], row['bitscore'], digest if key is not None else esltag)
+        rank += len(table)
+        yield 'hits', rows
+    yield 'summary', summary.values()
+
+
+# -----------------------------------------------------------------------------
+# Workers
+#
+# Messages to the writer are (kind, task, payload) tuples: the ('sto', ...) and ('hits', ...)
+# batches of parse_search, then
+#   ('done', i, nhits)
+#   ('error', i, message)
+
+def _init_worker(queue):
+    global _queue
+    _queue = queue
+
+
+def _parse_search(task: tuple[int, str]):
+    """ Parse one search and send its rows to the writer. """
+    i, datapath = task
+    try:
+        nhits = 0
+        for kind, payload in parse_search(datapath):
+            if kind == 'hits':
+                nhits += len(payload)
+            _queue.put((kind, i, payload))
+        _queue.put(('done', i, nhits))
+    except Exception:
+        _queue.put(('error', i, traceback.format_exc()))
+
+
+# -----------------------------------------------------------------------------
+# Writer
+
+class BulkWriter:
+    """
+    Writes the rows of parse_search with Core executemany inserts, in batches of batch_size
+    rows, committing every commit_every rows (or only when asked, if None). Alnseqs already
+    stored, by this or any other search, are skipped on their key. Each hit also gets its box
+    in hit_rtree, numbering new chraccns as Contigs on the way.
+    """
+
+    def __init__(self, session, batch_size: int = 10000, commit_every: int = None):
+        self.session = session
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.contigs: dict[str, int] = dict(session.execute(select(Contig.chraccn, Contig.id)).all())
+        self.next_contig = max(self.contigs.values(), default=0) + 1
+        self._rows = {Alnseq: [], StoFeature: [], Hit: [], Contig: [], hit_rtree: [], SearchSummary: []}  # In foreign key order
+        self._nrows = 0
+        self._uncommitted = 0
+
+    def write(self, kind: str, payload, search_id: int, stockholm_id: int):
+        """ Write a batch of parse_search. """
+        if kind == 'sto':
+            alnseqs, features = payload
+            self._add(Alnseq, alnseqs)
+            self._add(StoFeature, [
+                dict(stockholm_id=stockholm_id, alnseq_key=key, alnrow=row, fmt=fmt, field=field, text=text)
+                for key, row, fmt, field, text in features])
+        elif kind == 'hits':
+            for row in payload:
+                row['search_id'] = search_id
+                row['stockholm_id'] = stockholm_id
+            self._add(Hit, payload)
+            boxes = []
+            for row in payload:
+                cid = self.contig_id(row['chraccn'])
+                boxes.append(dict(id=rtree_id(search_id, row['rank']), chr0=cid, chr1=cid, lo=row['start'], hi=row['end']))
+            self._add(hit_rtree, boxes)
+        elif kind == 'summary':
+            self._add(SearchSummary, [dict(payload, search_id=search_id)])
+        else:
+            raise ValueError(f"Unknown batch kind '{kind}'")
+
+    def contig_id(self, chraccn: str) -> int:
+        """ Id of the Contig of chraccn, numbering it if new. """
+        if (cid := self.contigs.get(chraccn)) is None:
+            cid = self.contigs[chraccn] = self.next_contig
+            self.next_contig += 1
+            self._add(Contig, [dict(id=cid, chraccn=chraccn)])
+        return cid
+
+    def _add(self, model, rows: list[dict]):
+        self._rows[model].extend(rows)
+        self._nrows += len(rows)
+        if self._nrows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Insert buffered rows, committing if commit_every rows are uncommitted. """
+        for model, rows in self._rows.items():
+            if rows:
+                stmt = insert(model)
+                if model is Alnseq:
+                    stmt = stmt.prefix_with('OR IGNORE')  # Content-addressed, so stored at most once
+                self.session.execute(stmt, rows)
+                rows.clear()
+        self._uncommitted += self._nrows
+        self._nrows = 0
+        if self.commit_every is not None and self._uncommitted >= self.commit_every:
+            self.session.commit()
+            self._uncommitted = 0
+
+    def commit(self):
+        self.flush()
+        self.session.commit()
+        self._uncommitted = 0
+
+
+def reset_search(session, search: Search):
+    """ Remove rows left behind by an interrupted ingestion of a search. """
+    session.execute(delete(SearchSummary).where(SearchSummary.search_id == search.id))
+    session.execute(delete(hit_rtree).where(hit_rtree.c.id.in_(select(Hit.rtree_id).where(Hit.search_id == search.id))))
+    session.execute(delete(Hit).where(Hit.search_id == search.id))
+    for sto_id in session.scalars(select(Stockholm.id).where(Stockholm.datapath == f"{search.datapath}.sto")):
+        session.execute(delete(StoFeature).where(StoFeature.stockholm_id == sto_id))
+        session.execute(delete(Stockholm).where(Stockholm.id == sto_id))
+    # Alnseqs may be shared with other searches, and are left to jps.db.prune_alnseqs
+
+
+def ingest_all(searches_dir: str = SEARCHES_DIR, workers: int = None):
+    """
+    Ingest every search directory under searches_dir that has not been ingested yet.
+    Returns the list of ingested searches' datapaths.
+    """
+    workers = workers or os.cpu_count()
+
+    with SessionLocal() as session:
+        # Skip searches that are already ingested
+        ingested = set(session.scalars(select(Search.source).where(Search.ingested == True)))
+        datapaths = [datapath for datapath in discover(searches_dir) if datapath not in ingested]
+        print(f"Ingesting {len(datapaths)} searches ({len(ingested)} already ingested) with {workers} workers")
+        if not datapaths:
+            return []
+
+        # Create (or reset) a Search and a Stockholm entry per search
+        searches: list[Search] = []
+        stockholm_ids: list[int] = []
+        for datapath in datapaths:
+            search = session.scalars(select(Search).where(Search.source == datapath)).first()
+            if search is None:
+                name = os.path.basename(os.path.dirname(datapath))
+                search = Search(cm=name, source=datapath, ingested=False)
+                session.add(search)
+            else:
+                reset_search(session, search)
+            sto = Stockholm(datapath=f"{datapath}.sto")
+            session.add(sto)
+            session.flush()
+            searches.append(search)
+            stockholm_ids.append(sto.id)
+        session.commit()
+        search_ids = [search.id for search in searches]
+
+        writer = BulkWriter(session, batch_size=BATCH_SIZE)
+
+        ctx = multiprocessing.get_context()
+        queue = ctx.Queue(maxsize=4 * workers)  # Bounds the rows in flight
+        done: list[str] = []
+        nfailed = 0
+        reported: set[int] = set()  # Tasks that are done or failed
+        finished: set[int] = set()  # Unreported tasks whose futures had finished at the last poll
+        with bulk_load(session), ProcessPoolExecutor(
+                workers, mp_context=ctx, initializer=_init_worker, initargs=(queue,)) as pool:
+            futures = {pool.submit(_parse_search, task): task[0] for task in enumerate(datapaths)}
+
+            while len(reported) < len(datapaths):
+                try:
+                    kind, i, payload = queue.get(timeout=POLL_INTERVAL)
+                except queuelib.Empty:
+                    # A worker killed outright (e.g. out of memory) never reports: the executor
+                    # then fails the futures of all tasks in progress, whose last messages may
+                    # be lost too. Tasks still unreported a whole poll after their futures
+                    # finished have failed.
+                    for future, i in futures.items():
+                        if i in finished and i not in reported:
+                            reported.add(i)
+                            nfailed += 1
+                            reason = future.exception() or "worker exited before reporting"
+                            print(f"[{len(reported)}/{len(datapaths)}] {datapaths[i]} failed: {reason!r}", file=sys.stderr)
+                    finished = {i for future, i in futures.items() if future.done() and i not in reported}
+                    continue
+
+                if i in reported:
+                    continue  # Rows a dead worker sent before its task was failed
+
+                if kind == 'done':
+                    writer.flush()
+                    session.get(Search, search_ids[i]).ingested = True
+                    writer.commit()
+                    reported.add(i)
+                    done.append(datapaths[i])
+                    print(f"[{len(reported)}/{len(datapaths)}] {datapaths[i]}: {payload} hits")
+
+                elif kind == 'error':
+                    # Rows already written stay unmarked, and are reset on the next run
+                    reported.add(i)
+                    nfailed += 1
+                    print(f"[{len(reported)}/{len(datapaths)}] {datapaths[i]} failed:\n{payload}", file=sys.stderr)
+
+                else:
+                    writer.write(kind, payload, search_ids[i], stockholm_ids[i])
+
+        writer.commit()
+
+    print(f"Ingested {len(done)} searches, {nfailed} failed")
+    return done
@@ -1,15 +1,40 @@
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, declarative_base, declared_attr
+from sqlalchemy import create_engine, event
 from config import *
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URI,
     connect_args={"check_same_thread": False},
 )
+
+
+@event.listens_for(engine, "connect")
+def _sqlite_profile(dbapi_connection, connection_record):
+    """ Apply the SQLite storage profile to each new connection. """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA page_size = {SQLITE_PAGE_SIZE}")  # Only takes effect on an empty database
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
-Base.metadata.create_all(bind=engine)
+class _Base:
+    """
+    Common configuration of the models: each table is named after its model, as foreign keys
+    (e.g. 'Search.id') refer to them, and plain annotations (e.g. id: int = Column(...)) are allowed.
+    """
+    __allow_unmapped__ = True
+
+    @declared_attr
+    def __tablename__(cls):
+        return cls.__name__
 
-from jps.models.search import Search, Hit, SlurmJob
-from jps.models.alnseq import Alnseq, StoFeature, Stockholm
\ No newline at end of file
+
+Base = declarative_base(cls=_Base)
+
+# search refers to the alnseq models, so those are defined first
+from jps.models.alnseq import Alnseq, StoFeature, Stockholm
+from jps.models.search import Search, SearchSummary, Hit, SlurmJob, Neighbor, Contig, hit_rtree, rtree_id, hits_in_window
+
+Base.metadata.create_all(bind=engine)
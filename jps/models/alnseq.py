@@ -1,38 +1,59 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text
-from sqlalchemy.orm import relationship, Mapped, DeclarativeBase
+import zlib
+
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Text, LargeBinary, Index
+from sqlalchemy.orm import relationship, Mapped
 
 from config import *
+from jps.models import Base
+from jps.util.sketch import aln_key, degap, seq_digest
 
 
-class Alnseq(DeclarativeBase):
-    """ Represents a sequence in a Stockholm file. """
+class Alnseq(Base):
+    """
+    Represents an aligned sequence, stored once under its content key (see
+    jps.util.sketch.aln_key) however many searches and alignments it appears in.
+    """
 
-    id: int = Column(Integer, primary_key=True)
-    stockholm_id: Mapped[int] = Column(Integer, ForeignKey('stockholm.id'))
-    stockholm: Mapped['Stockholm'] = relationship('Stockholm')
+    key: bytes = Column(LargeBinary(16), primary_key=True)
+    zalnseq: bytes = Column(LargeBinary)  # zlib-compressed text
+    digest: int = Column(BigInteger, index=True)  # Digest of the degapped sequence (see jps.util.sketch)
+
+    @property
+    def alnseq(self) -> str:
+        return zlib.decompress(self.zalnseq).decode()
 
-    alnseq: str = Column(Text)
+    @staticmethod
+    def pack(alnseq: str) -> dict:
+        """ Column values of the Alnseq of an aligned sequence. """
+        return dict(key=aln_key(alnseq), zalnseq=zlib.compress(alnseq.encode(), 9),
+                    digest=seq_digest(degap(alnseq)))
 
 
-class StoFeature(DeclarativeBase):
+class StoFeature(Base):
     """ Represents a feature in a Stockholm file. """
 
     id: int = Column(Integer, primary_key=True)
     stockholm_id: int = Column(Integer, ForeignKey('Stockholm.id'))
-    stockholm: 'Stockholm' = relationship('Stockholm')
+    stockholm: 'Stockholm' = relationship('Stockholm', back_populates='features')
 
     # If feature is associated with a sequence
-    alnseq_id: int = Column(Integer, ForeignKey('Alnseq.id'), nullable=True)
-    alnseq: Alnseq = relationship('Alnseq')
+    alnseq_key: bytes = Column(LargeBinary(16), ForeignKey('Alnseq.key'), nullable=True)
+    alnseq: Alnseq = relationship('Alnseq', backref='features')
+    alnrow: int = Column(Integer, nullable=True)  # Row of the sequence in the alignment (see Hit.features)
 
     field: str = Column(String(255))
     text: str = Column(Text)
     fmt: str = Column(String(2))  # GF, GS, GC, GR
 
+    __table_args__ = (
+        Index('ix_stofeature_row', 'stockholm_id', 'alnrow'),
+    )
 
-class Stockholm(DeclarativeBase):
+
+class Stockholm(Base):
     """ Represents a Stockholm file, including its alignment and features. """
 
+    id: int = Column(Integer, primary_key=True)
     datapath: str = Column(String(255), unique=True)
-    alnseqs: Mapped[list[Alnseq]] = relationship('Alnseq', backref='stockholm')
-    features: Mapped[list[StoFeature]] = relationship('Feature', backref='stockholm')
+    alnseqs: Mapped[list[Alnseq]] = relationship('Alnseq', secondary='Hit', viewonly=True)
+    features: Mapped[list[StoFeature]] = relationship('StoFeature', back_populates='stockholm')
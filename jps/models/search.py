@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, Text, select, func, and_
-from sqlalchemy.orm import relationship, Mapped, column_property
+from sqlalchemy import Column, Integer, String, Float, LargeBinary, ForeignKey, ForeignKeyConstraint, Index, Boolean, DateTime, Text, select, func, and_, not_
+from sqlalchemy import DDL, JSON, MetaData, Table, event
+from sqlalchemy.orm import relationship, Mapped, WriteOnlyMapped, column_property, deferred, aliased, object_session, selectinload
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from datetime import datetime
+from typing import Iterator
+import numpy as np
 
 from config import *
-from jps.models import Base, Alnseq
+from jps.models import Base, Alnseq, StoFeature
 from jps.util.slurm import *
 from cgk.interval import ChrInterval
 
@@ -42,6 +45,58 @@ class SlurmJob(Base):
         self.status = "FINISHED"
 
 
+# -----------------------------------------------------------------------------
+# R*Tree index of hit locations
+#
+# SQLite's R*Tree module only stores numeric boxes, so each hit is a box over its Contig id in
+# one dimension and [start, end] in the other, with the rowid packing the (search_id, rank)
+# key of its Hit. Window lookups then touch only the boxes they intersect.
+
+RTREE_RANK_BITS = 32
+RTREE_RANK_MASK = (1 << RTREE_RANK_BITS) - 1
+
+# Not part of Base.metadata, since create_all cannot create virtual tables
+hit_rtree = Table(
+    'hit_rtree', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('chr0', Integer), Column('chr1', Integer),
+    Column('lo', Integer), Column('hi', Integer),
+)
+HIT_RTREE_DDL = DDL("CREATE VIRTUAL TABLE IF NOT EXISTS hit_rtree USING rtree_i32(id, chr0, chr1, lo, hi)")
+event.listen(Base.metadata, 'after_create', HIT_RTREE_DDL)
+
+
+def rtree_id(search_id: int, rank: int) -> int:
+    """ Rowid of a hit in hit_rtree. """
+    return (search_id << RTREE_RANK_BITS) | rank
+
+
+class Contig(Base):
+    """ A chromosome accession, numbered for the hit R*Tree index. """
+    id: int = Column(Integer, primary_key=True)
+    chraccn: str = Column(String(255), unique=True, nullable=False)
+
+
+def _rtree_hit(hit, rtree):
+    """ Join condition of a Hit entity to its box in an hit_rtree alias. """
+    return and_(hit.search_id == rtree.c.id.op('>>')(RTREE_RANK_BITS),
+                hit.rank == rtree.c.id.op('&')(RTREE_RANK_MASK))
+
+
+def hits_in_window(chraccn: str, start: int, end: int, search_ids: list[int] = None):
+    """ Query for the hits on chraccn overlapping [start, end], of search_ids if given. """
+    contig = select(Contig.id).where(Contig.chraccn == chraccn).scalar_subquery()
+    query = (
+        select(Hit)
+        .join(hit_rtree, _rtree_hit(Hit, hit_rtree))
+        .where(hit_rtree.c.chr0 <= contig, hit_rtree.c.chr1 >= contig,
+               hit_rtree.c.lo <= end, hit_rtree.c.hi >= start)
+    )
+    if search_ids is not None:
+        query = query.where(Hit.search_id.in_(search_ids))
+    return query
+
+
 class Hit(Base, ChrInterval):
     """
     Represents a single hit in a cmsearch result, consisting of data from a row in the
@@ -53,14 +108,20 @@ class Hit(Base, ChrInterval):
     rank: int = Column(Integer, primary_key=True)
 
     # Stockholm file properties
-    alnseq_id: Mapped[int] = Column(Integer, ForeignKey('Alnseq.id'), nullable=True)
-    alnseq: Mapped[Alnseq] = relationship("Alnseq", back_populates="hits")
+    stockholm_id: Mapped[int] = Column(Integer, ForeignKey('Stockholm.id'), nullable=True)
+    alnseq_key: Mapped[bytes] = Column(LargeBinary(16), ForeignKey('Alnseq.key'), nullable=True, index=True)
+    alnseq: Mapped[Alnseq] = relationship("Alnseq")
+    alnrow: int = Column(Integer, nullable=True)  # Row of the alnseq in the alignment
+    # Sequence features of the hit's row (an Alnseq's own features span every row with its text)
+    features: Mapped[list[StoFeature]] = relationship(
+        "StoFeature", viewonly=True,
+        primaryjoin="and_(Hit.stockholm_id == foreign(StoFeature.stockholm_id), Hit.alnrow == foreign(StoFeature.alnrow))")
 
     # DBFNA properties
     chraccn: str = Column(String(255))
     start: int = Column(Integer)
     end: int = Column(Integer)
-    strand: str = Column(Boolean)
+    strand: str = Column(String(1))
     
     # Tblstats
     evalue: float = Column(Float)
@@ -71,24 +132,40 @@ class Hit(Base, ChrInterval):
     mdl_from: int = Column(Integer)
     mdl_to: int = Column(Integer)
 
-    # overlaps = column_property(
-    #     select('Hit')
-    #     .where(
-    #         and_(
-    #             'Hit'.chraccn == chraccn,
-    #             'Hit'.start <= end,
-    #             'Hit'.end >= start,
-    #         )
-    #     )
-    #     .correlate_except('Hit')
-    # )
-
-    # @hybrid_method
-    # def overlaps(self, other: 'Hit'):
-    #     sign = 2 * (self.strand == other.strand) - 1
-    #     return sign * (
-    #         (self.chraccn == other.chraccn) & (not self.end < other.start) & (not self.start > other.end)
-    #     )
+    # (search_id, rank) lookups use the primary key
+    __table_args__ = (
+        Index('ix_hit_search_evalue', 'search_id', 'evalue'),
+        Index('ix_hit_location', 'chraccn', 'start', 'end'),
+    )
+
+    @hybrid_property
+    def rtree_id(self) -> int:
+        """ Rowid of the hit's box in hit_rtree. """
+        return rtree_id(self.search_id, self.rank)
+
+    @rtree_id.expression
+    def rtree_id(cls):
+        return cls.search_id.op('<<')(RTREE_RANK_BITS).op('|')(cls.rank)
+
+    def window(self, distance: int = 0, search_ids: list[int] = None):
+        """ Query for the other hits at most distance nts from this one, of search_ids if given. """
+        return hits_in_window(self.chraccn, self.start - distance, self.end + distance, search_ids).where(
+            not_(and_(Hit.search_id == self.search_id, Hit.rank == self.rank)))
+
+    def nearest(self, k: int = 1, search_ids: list[int] = None, distance: int = 1000,
+                max_distance: int = 1 << 30) -> list[tuple['Hit', int]]:
+        """
+        The k hits nearest this one, as (hit, distance) pairs sorted by distance, within
+        max_distance. The window around the hit starts at distance nts and doubles until it
+        holds k hits, at which point no hit outside it can be nearer than the kth.
+        """
+        session = object_session(self)
+        while True:
+            hits = session.scalars(self.window(distance, search_ids)).all()
+            nearest = sorted(((hit, self.distance_to(hit)) for hit in hits), key=lambda pair: pair[1])
+            if len(nearest) >= k or distance >= max_distance:
+                return [pair for pair in nearest[:k] if pair[1] <= max_distance]
+            distance = min(2 * distance, max_distance)
 
     def asdict(self):
         return {
@@ -119,22 +196,82 @@ class Search(Base):
     target: str = Column(String)
     timestamp: DateTime = Column(DateTime, default=datetime.now)
 
+    # Output path prefix of a search ingested from an existing directory (see jps.ingest)
+    source: str = Column(String, unique=True, nullable=True)
+    ingested: bool = Column(Boolean, default=False)  # Whether results have been fully parsed
+
     # Slurm job ID
-    jobid: Mapped[int] = Column(Integer, ForeignKey('SlurmJob.id'))
-    job: Mapped[SlurmJob] = relationship("SlurmJob", back_populates="search")
-
-    # Search results
-    hits: Mapped[list[Hit]] = relationship("Hit", back_populates="search")
-
-    # @hybrid_property
-    # def overlapping_hits(self, other: 'Search'):
-    #     return self.hits.join(other.hits).filter(
-    #         and_(
-    #             Hit.chraccn == other.hits.chraccn,
-    #             Hit.start <= other.hits.end,
-    #             Hit.end >= other.hits.start,
-    #         )
-    #     )
+    jobid: Mapped[int] = Column(Integer, ForeignKey('SlurmJob.jobid'))
+    job: Mapped[SlurmJob] = relationship("SlurmJob")
+
+    # Search results, never loaded whole: search.hits.select() or the methods below query them
+    hits: WriteOnlyMapped[Hit] = relationship("Hit", back_populates="search", lazy="write_only")
+    summary: Mapped['SearchSummary'] = relationship("SearchSummary", back_populates="search", uselist=False)
+
+    def select_hits(self, *columns, where=(), evalue_max: float = None, alnseqs: bool = False,
+                    features: bool = False):
+        """
+        Query for the hits of this search in rank order, or only the given Hit columns of them.
+        alnseqs and features eagerly load those of each hit, in one query per batch.
+        """
+        query = select(*columns) if columns else select(Hit)
+        query = query.where(Hit.search_id == self.id, *where)
+        if evalue_max is not None:
+            query = query.where(Hit.evalue <= evalue_max)
+        if alnseqs:
+            query = query.options(selectinload(Hit.alnseq))
+        if features:
+            query = query.options(selectinload(Hit.features))
+        return query.order_by(Hit.rank)
+
+    def iter_hits(self, session=None, batch_size: int = 1000, **kwargs) -> Iterator[Hit]:
+        """ Stream the hits of select_hits(**kwargs), fetching and loading batch_size at a time. """
+        session = session or object_session(self)
+        return iter(session.scalars(self.select_hits(**kwargs).execution_options(yield_per=batch_size)))
+
+    def iter_hit_pages(self, session=None, page_size: int = 1000, after_rank: int = -1,
+                       **kwargs) -> Iterator[list[Hit]]:
+        """
+        Pages of the hits of select_hits(**kwargs) ranked after after_rank, each fetched by its
+        own keyset query on the (search_id, rank) key, so no cursor stays open between pages.
+        """
+        session = session or object_session(self)
+        while page := session.scalars(
+                self.select_hits(**kwargs).where(Hit.rank > after_rank).limit(page_size)).all():
+            yield page
+            after_rank = page[-1].rank
+
+    def iter_columns(self, *columns, session=None, batch_size: int = 10000, **kwargs) -> Iterator[tuple]:
+        """ Stream rows of only the given Hit columns of the hits of select_hits(**kwargs). """
+        session = session or object_session(self)
+        return iter(session.execute(self.select_hits(*columns, **kwargs).execution_options(yield_per=batch_size)))
+
+    def evalues(self, session=None, **kwargs) -> np.ndarray:
+        """ E-values of the hits of select_hits(**kwargs), in rank order. """
+        session = session or object_session(self)
+        return np.fromiter(session.scalars(
+            self.select_hits(Hit.evalue, **kwargs).execution_options(yield_per=10000)), dtype=float)
+
+    def hits_in_window(self, chraccn: str, start: int, end: int):
+        """ Query for the hits of this search on chraccn overlapping [start, end]. """
+        return hits_in_window(chraccn, start, end, [self.id])
+
+    def overlapping_hits(self, other: 'Search', distance: int = 0):
+        """
+        Query for the (hit, other_hit) pairs of hits of this search and of other at most
+        distance nts apart. Each hit of this search looks up its box in hit_rtree, whose
+        neighborhood is searched for boxes of hits of other.
+        """
+        box1, box2 = hit_rtree.alias('box1'), hit_rtree.alias('box2')
+        hit1, hit2 = aliased(Hit), aliased(Hit)
+        return (
+            select(hit1, hit2)
+            .join(box1, box1.c.id == hit1.rtree_id)
+            .join(box2, and_(box2.c.chr0 <= box1.c.chr1, box2.c.chr1 >= box1.c.chr0,
+                             box2.c.lo <= box1.c.hi + distance, box2.c.hi >= box1.c.lo - distance))
+            .join(hit2, _rtree_hit(hit2, box2))
+            .where(hit1.search_id == self.id, hit2.search_id == other.id)
+        )
 
     @property
     def name(self):
@@ -143,6 +280,8 @@ class Search(Base):
 
     @property
     def datapath(self):
+        if self.source:
+            return self.source
         return os.path.join("searches", self.name, f"{self.name}.out")
 
     def submit(self):
@@ -153,3 +292,56 @@ class Search(Base):
         )
         self.job.submit()
 
+
+class SearchSummary(Base):
+    """
+    Summary statistics of the hits of a search, maintained at ingestion (see jps.summary).
+    Score arrays are sorted, so counts at any threshold take a binary search. They are
+    deferred, each loaded only when first used, so total and unique cost no blob reads.
+    """
+
+    search_id: int = Column(Integer, ForeignKey('Search.id'), primary_key=True)
+    search: Mapped[Search] = relationship("Search", back_populates="summary")
+
+    total: int = Column(Integer)
+    unique: int = Column(Integer)  # Hits whose sequence no better-ranked hit has
+    evalues: bytes = deferred(Column(LargeBinary))  # Sorted float64 E-values of all hits...
+    unique_evalues: bytes = deferred(Column(LargeBinary))  # ...and of unique hits
+    bitscores: bytes = deferred(Column(LargeBinary))  # Sorted float64 bit scores of all hits
+    chr_counts: dict = Column(JSON)  # Hits per chraccn
+
+    def array(self, name: str) -> np.ndarray:
+        """ One of the sorted score arrays. """
+        return np.frombuffer(getattr(self, name), dtype=np.float64)
+
+    def count(self, evalue_max: float = None, unique: bool = False) -> int:
+        """ Number of hits, or unique hits, with E-value <= evalue_max. """
+        if evalue_max is None:
+            return self.unique if unique else self.total
+        return int(np.searchsorted(self.array('unique_evalues' if unique else 'evalues'), evalue_max, side='right'))
+
+    def count_bitscore(self, bitscore_min: float) -> int:
+        """ Number of hits with bit score >= bitscore_min. """
+        return self.total - int(np.searchsorted(self.array('bitscores'), bitscore_min, side='left'))
+
+
+class Neighbor(Base):
+    """ A pair of hits close together on a chromosome, such as a tandem (see jps.neighbors). """
+
+    id: int = Column(Integer, primary_key=True)
+
+    # Hit with the lower start, and the other hit
+    search1_id: int = Column(Integer, nullable=False, index=True)
+    rank1: int = Column(Integer, nullable=False)
+    search2_id: int = Column(Integer, nullable=False, index=True)
+    rank2: int = Column(Integer, nullable=False)
+    hit1: Mapped[Hit] = relationship("Hit", foreign_keys=[search1_id, rank1])
+    hit2: Mapped[Hit] = relationship("Hit", foreign_keys=[search2_id, rank2])
+
+    distance: int = Column(Integer)  # As ChrInterval.distance_to; 0 if overlapping
+    sign: int = Column(Integer)  # 1 for same strand, -1 for opposite strand
+
+    __table_args__ = (
+        ForeignKeyConstraint([search1_id, rank1], ['Hit.search_id', 'Hit.rank']),
+        ForeignKeyConstraint([search2_id, rank2], ['Hit.search_id', 'Hit.rank']),
+    )
@@ -0,0 +1,99 @@
+"""
+neighbors.py
+
+Detection of tandem and co-located hits. Hits of one or more searches are sorted by chraccn
+and start, and a sweep line keeps the hits that may still lie within the maximum distance of
+the next one, so finding all close pairs costs O(n log n + output).
+"""
+
+from typing import Iterable
+import heapq
+import numpy as np
+from sqlalchemy import select, insert, delete
+
+from jps.models import Hit, Search, Neighbor
+from jps.util.intervalarray import ChrIntervalArray
+
+# Table of neighboring hit pairs, hit 1 being the one with the lower start
+NEIGHBOR_SCHEMA = [
+    ('search1_id', np.int64), ('rank1', np.int64), ('search2_id', np.int64), ('rank2', np.int64),
+    ('distance', np.int64), ('sign', np.int8),
+]
+
+
+def neighbor_pairs(intervals: ChrIntervalArray, max_distance: int, sign: int = None,
+                   groups: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find every pair of intervals at most max_distance apart, overlapping pairs included.
+    sign selects same-strand (1) or opposite-strand (-1) pairs only. If groups is given,
+    only pairs of intervals in different groups are reported.
+    Returns the indices of both intervals of each pair, their distance, and their sign.
+    """
+    codes, strands = intervals.codes.tolist(), intervals.strands.tolist()
+    starts, ends = intervals.starts.tolist(), intervals.ends.tolist()
+    groups = groups.tolist() if groups is not None else None
+
+    pairs1, pairs2, distances, signs = [], [], [], []
+    active: list[tuple[int, int]] = []  # Heap of (end, index) of intervals that may be near the next one
+    chrcode = None
+    for i in np.lexsort((intervals.starts, intervals.codes)).tolist():
+        if codes[i] != chrcode:
+            chrcode = codes[i]
+            active = []
+
+        # Intervals ending too far before this one starts are out of reach of all later ones
+        start = starts[i]
+        while active and active[0][0] < start - max_distance:
+            heapq.heappop(active)
+        for end, j in active:
+            s = 1 if strands[i] == strands[j] else -1
+            if (sign is not None and s != sign) or (groups is not None and groups[i] == groups[j]):
+                continue
+            pairs1.append(j)
+            pairs2.append(i)
+            distances.append(max(0, start - end))
+            signs.append(s)
+        heapq.heappush(active, (ends[i], i))
+
+    return (np.array(pairs1, dtype=np.int64), np.array(pairs2, dtype=np.int64),
+            np.array(distances, dtype=np.int64), np.array(signs, dtype=np.int8))
+
+
+def search_hits(session, searches: Iterable[Search]) -> tuple[ChrIntervalArray, np.ndarray, np.ndarray]:
+    """ Intervals of the hits of searches, with each hit's search id and rank. """
+    rows = session.execute(
+        select(Hit.chraccn, Hit.start, Hit.end, Hit.strand, Hit.search_id, Hit.rank)
+        .where(Hit.search_id.in_([search.id for search in searches]))).all()
+    if not rows:
+        return ChrIntervalArray.empty(), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    *columns, search_ids, ranks = zip(*rows)
+    return (ChrIntervalArray.from_columns(*columns),
+            np.array(search_ids, dtype=np.int64), np.array(ranks, dtype=np.int64))
+
+
+def find_neighbors(session, searches: Iterable[Search], max_distance: int = 100, sign: int = None,
+                   across: bool = False) -> np.ndarray:
+    """
+    Find pairs of hits at most max_distance apart among the hits of searches, as a
+    NEIGHBOR_SCHEMA table. With across=True, only pairs of hits from different searches
+    are reported, e.g. hits of two models co-located on a chromosome.
+    """
+    intervals, search_ids, ranks = search_hits(session, searches)
+    i, j, distances, signs = neighbor_pairs(intervals, max_distance, sign, search_ids if across else None)
+
+    table = np.empty(len(i), dtype=NEIGHBOR_SCHEMA)
+    table['search1_id'], table['rank1'] = search_ids[i], ranks[i]
+    table['search2_id'], table['rank2'] = search_ids[j], ranks[j]
+    table['distance'], table['sign'] = distances, signs
+    return table
+
+
+def store_neighbors(session, searches: Iterable[Search], table: np.ndarray):
+    """ Replace the stored neighbors among searches with those of a find_neighbors table. """
+    ids = [search.id for search in searches]
+    session.execute(delete(Neighbor).where(Neighbor.search1_id.in_(ids), Neighbor.search2_id.in_(ids)))
+    if len(table):
+        names = [name for name, _ in NEIGHBOR_SCHEMA]
+        session.execute(insert(Neighbor), [
+            dict(zip(names, row)) for row in zip(*(table[name].tolist() for name in names))])
+    session.commit()
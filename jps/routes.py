@@ -15,17 +15,17 @@ import subprocess
 from jps.util.slurm import shexecute
 import jps.util.tblio as tblio
 import jps.util.iosto as iosto
+import jps.sinks as sinks
+import jps.neighbors as neighbors
+import jps.ingest as ingest
+from jps.db import bulk_load
+from jps.summary import get_summary
 from jps.analyze import plot_score_distribution
 from jps.models import *
 from jps.util.helpers import *
 from cgk.interval import ChrInterval
 
 
-CMSEARCH_TBLHEADERS = ['target_name', 'target_accession', 'query_name', 'query_accession', 
-                       'mdl', 'mdl_from', 'mdl_to', 'seq_from', 'seq_to', 'strand', 'trunc', 
-                       'pass_', 'gc', 'bias', 'score', 'E_value', 'inc', 'description_of_target']
-
-
 def cmbuild_submit(sto: str, out: str = None):
     """ Submit a cmbuild job. """
     return SlurmJob.submit(os.path.join(SCRIPTS_DIR, 'cmbuild.sh'), fullpath(sto), fullpath(out))
@@ -45,48 +45,29 @@ def cmsearch_submit(cm: str, param: str, target: str):
     return search
 
 
-def cmsearch_parse(search: Search):
-    """ Parse cmsearch results into a list of Hit objects. """
+def cmsearch_parse(search: Search, batch_size: int = 10000, commit_every: int = 200000):
+    """
+    Parse cmsearch results into the database with bulk inserts (see jps.ingest.BulkWriter),
+    committing every commit_every rows. Rows of an earlier, interrupted parse are replaced.
+    """
+    with SessionLocal() as session, bulk_load(session):
+        search = session.merge(search)
+        session.flush()
+        ingest.reset_search(session, search)
 
-    # Parse Stockholm and table files
-    sequences, features = iosto.sto_read(f"{fullpath(search.datapath)}.sto")
-    rows = tblio.tbl_read(f"{fullpath(search.datapath)}.tbl", headers=CMSEARCH_TBLHEADERS)
-    rows = dict(zip(CMSEARCH_TBLHEADERS, rows))
-
-    with SessionLocal() as session:
         # Create Stockholm database entry
         sto = Stockholm(datapath=f"{search.datapath}.sto")
-        
-        # Create Alnseq database entries
-        esltag_to_id = defaultdict(int)
-        for esltag, seq in sequences.items():
-            alnseq = Alnseq(alnseq=seq.alnseq)
-            esltag_to_id[esltag] = alnseq.id
-            sto.alnseqs.append(alnseq)
-        
-        # Create Feature database entries
-        for feat in features:
-            feature = StoFeature(
-                alnseq_id=esltag_to_id[feat.esltag], fmt=feat.fmt, field=feat.field, text=feat.text)
-            sto.features.append(feature)
-        
         session.add(sto)
+        session.flush()
 
-        # Create hits from table
-        for i, row in enumerate(rows):
-            start, end = int(row['seq_from']), int(row['seq_to'])
-            if (strand := row['strand']) == '-':
-                start, end = end, start
-            hit = Hit(
-                search=search, rank=i,
-                chraccn=row['target_name'], start=start, end=end, strand=strand,
-                evalue=row['E_value'], bitscore=row['score'], bias=row['bias'], gc=row['gc'],
-                trunc=row['trunc'], mdl_from=row['mdl_from'], mdl_to=row['mdl_to'])
-            if hit.esltag in esltag_to_id:
-                hit.alnseq_id = esltag_to_id[hit.esltag]
-            search.hits.append(hit)
-        
-        session.commit()
+        # Stream alignments, features and hits in batches
+        writer = ingest.BulkWriter(session, batch_size=batch_size, commit_every=commit_every)
+        for kind, payload in ingest.parse_search(search.datapath, batch_size):
+            writer.write(kind, payload, search.id, sto.id)
+        writer.flush()
+
+        search.ingested = True
+        writer.commit()
 
 
 def runr2r(sto: str):
@@ -98,37 +79,69 @@ def runr2r(sto: str):
         print("R2R failed to run, skipping...", file=sys.stderr)
 
 
-def cmsearch_analyze(search: Search, color, threshold=0.01):
+def cmsearch_analyze(search: Search, color, threshold=0.01, identity=None):
     outdir = os.path.join(ANALYSIS_DIR, search.name)
-    os.makedirs(outdir, exist_ok=True)
+    os.makedirs(datadir := os.path.join(outdir, "data"), exist_ok=True)
 
-    # Filter out duplicate hits
-    unique = search.hits.distinct(Hit.alnseq.alnseq)
+    # Hit filters: duplicate hits are those with the same sequence as a better-ranked hit,
+    # or with one at least identity identical if given
+    keep = sinks.evalue_le(threshold)
+    keep_unique = sinks.all_of(sinks.unique, keep)
+    uniq_path = os.path.join(datadir, f"{search.name}.uniq")
+    keep_path = os.path.join(datadir, f"{search.name}.keepE{slugify_float(threshold)}")
+    keep_uniq_path = os.path.join(datadir, f"{search.name}.uniq.keepE{slugify_float(threshold)}")
+
+    with SessionLocal() as session:
+        # Global features of the search alignment, as stored at ingestion
+        features = session.scalars(
+            select(StoFeature).join(Stockholm)
+            .where(Stockholm.datapath == f"{search.datapath}.sto", StoFeature.fmt.in_(('GF', 'GC')))
+        ).all()
+        gf = [feat for feat in features if feat.fmt == 'GF']
+        gc = [feat for feat in features if feat.fmt == 'GC']
+
+        # Counts and the score histogram come from the search summary, except when near
+        # duplicates count as duplicates, which only walking the hits can tell
+        if identity is None:
+            summary = get_summary(session, search)
+            session.commit()
+            counts = [summary.count(), summary.count(unique=True),
+                      summary.count(threshold), summary.count(threshold, unique=True)]
+            hist = sinks.HistogramSink.from_evalues(summary.array('unique_evalues'))
+            tallies = []
+        else:
+            counters = [sinks.CountSink(where) for where in (sinks.everything, sinks.unique, keep, keep_unique)]
+            hist = sinks.HistogramSink(sinks.unique)
+            tallies = [*counters, hist]
+
+        # Walk the hits once, writing every output variant
+        hits = search.iter_hits(session, alnseqs=True, features=True)
+        sinks.route_hits(hits, [
+            *tallies,
+            sinks.StoSink(f"{uniq_path}.sto", sinks.unique, gf=gf, gc=gc),
+            sinks.StoSink(f"{keep_path}.sto", keep, gf=gf, gc=gc),
+            sinks.StoSink(f"{keep_uniq_path}.sto", keep_unique, gf=gf, gc=gc),
+            sinks.TblSink(f"{uniq_path}.tbl", sinks.unique),
+            sinks.TblSink(f"{keep_path}.tbl", keep),
+            sinks.TblSink(f"{keep_uniq_path}.tbl", keep_unique),
+        ], identity=identity)
+        if identity is not None:
+            counts = [counter.count for counter in counters]
 
     # Plot score distribution
-    plot_score_distribution(unique.all(), search.name, color, 
+    plot_score_distribution(hist, search.name, color, 
                         out=os.path.join(outdir, f"{search.name}_score_distribution.png"), threshold=threshold)
-    
-    # Filter hits by threshold
-    keep = search.hits.filter(Hit.evalue <= threshold)
-    keep_unique = unique.filter(Hit.evalue <= threshold)
 
     # Write counts table
     with open(os.path.join(ANALYSIS_DIR, f"{search.name}.counts.txt"), 'w') as f:
         table = [
             ["Name", "# Total", "# Unique", f"# E<{threshold}", f"# Unique E<{threshold}"],
-            [search.name, search.hits.count(), unique.count(), keep.count(), keep_unique.count()]
+            [search.name, *counts]
         ]
         f.write(tabulate(table, headers="firstrow", tablefmt="plain"))
-    
-    
-    os.makedirs(datadir := os.path.join(outdir, "data"), exist_ok=True)
-    iosto.sto_write(unique.all(), os.path.join(datadir, f"{search.name}.uniq.sto"))
-    iosto.sto_write(keep.all(), os.path.join(datadir, f"{search.name}.keepE{slugify_float(threshold)}.sto"))
-    iosto.sto_write(keep_unique.all(), keep_uniq_path := os.path.join(datadir, f"{search.name}.uniq.keepE{slugify_float(threshold)}.sto"))
 
     # Run R2R
-    runr2r(keep_uniq_path)
+    runr2r(keep_uniq_path := f"{keep_uniq_path}.sto")
 
     return keep_uniq_path
 
@@ -197,14 +210,10 @@ if __name__ == "__main__":
 #     )
 #     return overlapping
 
-# def select_tandems():
-#     """ Select tandem hits. """
-#     # tandem = select((Hit, Hit, 'distance')).where(
-#     #     Hit.chraccn == Hit.chraccn,
-#     # ).order_by(
-#     #     Hit.chraccn, Hit.start, Hit.end
-#     # ).having(
-#     #     'distance < 1000'
-#     # )
-#     # return tandem
+def select_tandems(search: Search, max_distance: int = 100, sign: int = None):
+    """ Find pairs of hits of a search within max_distance of each other, store them, and return them as a table. """
+    with SessionLocal() as session:
+        table = neighbors.find_neighbors(session, [search], max_distance, sign)
+        neighbors.store_neighbors(session, [search], table)
+    return table
 
@@ -0,0 +1,166 @@
+"""
+sinks.py
+
+Single-pass analysis of cmsearch hits. Hits are walked once in rank order and each one is
+routed to every sink whose filter accepts it, so adding output variants costs no extra queries.
+"""
+
+from collections import Counter
+from typing import Callable, Iterable
+import math
+import numpy as np
+
+import jps.util.iosto as iosto
+import jps.util.tblio as tblio
+from jps.models import Hit
+from jps.util.sketch import SketchClusterer, degap, seq_digest
+from cgk.interval import ChrInterval
+
+# A filter receives a hit and whether it is the first hit with its alignment
+HitFilter = Callable[[Hit, bool], bool]
+
+# E-values of 0 (underflow in cmsearch) are binned as the smallest positive float
+MIN_EVALUE = np.finfo(float).tiny
+
+HIT_TBLHEADERS = ['chraccn', 'start', 'end', 'strand', 'mdl_from', 'mdl_to', 'trunc',
+                  'gc', 'bias', 'bitscore', 'evalue']
+
+
+def everything(hit: Hit, first: bool):
+    return True
+
+
+def unique(hit: Hit, first: bool):
+    return first
+
+
+def evalue_le(threshold: float) -> HitFilter:
+    """ Filter for hits with E-value <= threshold. """
+    return lambda hit, first: hit.evalue <= threshold
+
+
+def all_of(*filters: HitFilter) -> HitFilter:
+    return lambda hit, first: all(f(hit, first) for f in filters)
+
+
+class HitSink:
+    """ Consumer of the hits accepted by its filter. """
+
+    def __init__(self, where: HitFilter = everything):
+        self.where = where
+
+    def write(self, hit: Hit):
+        pass
+
+    def close(self):
+        pass
+
+
+class CountSink(HitSink):
+    """ Counts accepted hits. """
+
+    def __init__(self, where: HitFilter = everything):
+        super().__init__(where)
+        self.count = 0
+
+    def write(self, hit: Hit):
+        self.count += 1
+
+
+class HistogramSink(HitSink):
+    """ Accumulates a fine-grained histogram of log10(E-value) for accepted hits. """
+
+    def __init__(self, where: HitFilter = everything, binwidth: float = 0.01):
+        super().__init__(where)
+        self.binwidth = binwidth
+        self.bins: Counter[int] = Counter()
+
+    def write(self, hit: Hit):
+        self.bins[math.floor(math.log10(max(hit.evalue, MIN_EVALUE)) / self.binwidth)] += 1
+
+    @classmethod
+    def from_evalues(cls, evalues: np.ndarray, binwidth: float = 0.01) -> 'HistogramSink':
+        """ The histogram of an array of E-values, such as those of a SearchSummary. """
+        hist = cls(binwidth=binwidth)
+        bins, counts = np.unique(np.floor(np.log10(np.maximum(evalues, MIN_EVALUE)) / binwidth).astype(np.int64), return_counts=True)
+        hist.bins.update(dict(zip(bins.tolist(), counts.tolist())))
+        return hist
+
+    @property
+    def centers(self) -> list[float]:
+        """ log10(E-value) at the center of each non-empty bin. """
+        return [(b + 0.5) * self.binwidth for b in self.bins]
+
+    @property
+    def counts(self) -> list[int]:
+        return list(self.bins.values())
+
+
+class StoSink(HitSink):
+    """ Streams accepted hits to a Stockholm file. """
+
+    def __init__(self, path: str, where: HitFilter = everything, gf=(), gc=()):
+        super().__init__(where)
+        self.path = path
+        self.writer = iosto.StoWriter(path, gf=gf, gc=gc)
+
+    def write(self, hit: Hit):
+        if hit.alnseq is not None:
+            self.writer.write(hit.esltag, hit.alnseq.alnseq, hit.features)
+
+    def close(self):
+        self.writer.close()
+
+
+class TblSink(HitSink):
+    """ Streams accepted hits to a table file. """
+
+    def __init__(self, path: str, where: HitFilter = everything, headers: list[str] = HIT_TBLHEADERS):
+        super().__init__(where)
+        self.path = path
+        self.headers = headers
+        self.writer = tblio.TblWriter(path, [tblio.TblColumn(h) for h in headers])
+
+    def write(self, hit: Hit):
+        self.writer.write([str(getattr(hit, h)) for h in self.headers])
+
+    def close(self):
+        self.writer.close()
+
+
+def row_seqkey(chraccn: str, start: int, end: int, strand: str, digest: int | None) -> int | str:
+    """ seqkey of a hit from its columns and its alnseq's digest, without loading the hit. """
+    if digest is not None:
+        return digest
+    return ChrInterval.make_esltag(chraccn, (end, start) if strand == '-' else (start, end))
+
+
+def seqkey(hit: Hit) -> int | str:
+    """ Digest of a hit's degapped sequence, used to find duplicate hits. """
+    if hit.alnseq is None:
+        return hit.esltag
+    if hit.alnseq.digest is not None:
+        return hit.alnseq.digest
+    return seq_digest(degap(hit.alnseq.alnseq))
+
+
+def route_hits(hits: Iterable[Hit], sinks: list[HitSink], identity: float = None):
+    """
+    Walk hits once in rank order, routing each to every sink whose filter accepts it.
+    A hit is first (see HitFilter) unless a better-ranked hit has the same sequence or, if
+    identity is given, a sequence estimated to be at least that identical (see SketchClusterer).
+    """
+    seen: set[int | str] = set()
+    clusterer = SketchClusterer(identity) if identity is not None else None
+    for hit in hits:
+        key = seqkey(hit)
+        first = key not in seen
+        seen.add(key)
+        if first and clusterer is not None and hit.alnseq is not None:
+            first = clusterer.add(degap(hit.alnseq.alnseq))[1]
+        for sink in sinks:
+            if sink.where(hit, first):
+                sink.write(hit)
+
+    for sink in sinks:
+        sink.close()
@@ -0,0 +1,68 @@
+"""
+summary.py
+
+Module for the per-search summary statistics stored as SearchSummary. SummaryBuilder takes hit
+rows in rank order as a search is parsed (see jps.ingest.parse_search); summarize builds the
+summary of a search ingested before summaries existed from its Hit rows.
+"""
+
+from collections import Counter
+import numpy as np
+from sqlalchemy import select, delete, insert
+
+from jps.models import Hit, Alnseq, Search, SearchSummary
+from jps.sinks import row_seqkey
+
+
+def pack_sorted(values: list[float]) -> bytes:
+    """ Sorted float64 array of values, as stored in SearchSummary. """
+    return np.sort(np.asarray(values, dtype=np.float64)).tobytes()
+
+
+class SummaryBuilder:
+    """
+    Accumulates the SearchSummary of a search from its hits in rank order. A hit is unique
+    if no earlier hit has the same seqkey, as in jps.sinks.route_hits.
+    """
+
+    def __init__(self):
+        self.evalues: list[float] = []
+        self.unique_evalues: list[float] = []
+        self.bitscores: list[float] = []
+        self.chr_counts: Counter[str] = Counter()
+        self.seen: set = set()
+
+    def add(self, chraccn: str, evalue: float, bitscore: float, seqkey):
+        self.evalues.append(evalue)
+        self.bitscores.append(bitscore)
+        self.chr_counts[chraccn] += 1
+        if seqkey not in self.seen:
+            self.seen.add(seqkey)
+            self.unique_evalues.append(evalue)
+
+    def values(self) -> dict:
+        """ SearchSummary column values, but for search_id. """
+        return dict(
+            total=len(self.evalues), unique=len(self.unique_evalues),
+            evalues=pack_sorted(self.evalues), unique_evalues=pack_sorted(self.unique_evalues),
+            bitscores=pack_sorted(self.bitscores), chr_counts=dict(self.chr_counts))
+
+
+def summarize(session, search: Search) -> SearchSummary:
+    """ Build and store the summary of a search from its Hit rows, replacing any earlier one. """
+    builder = SummaryBuilder()
+    rows = session.execute(
+        select(Hit.chraccn, Hit.start, Hit.end, Hit.strand, Hit.evalue, Hit.bitscore, Alnseq.digest)
+        .outerjoin(Alnseq).where(Hit.search_id == search.id).order_by(Hit.rank)
+        .execution_options(yield_per=10000))
+    for chraccn, start, end, strand, evalue, bitscore, digest in rows:
+        builder.add(chraccn, evalue, bitscore, row_seqkey(chraccn, start, end, strand, digest))
+
+    session.execute(delete(SearchSummary).where(SearchSummary.search_id == search.id))
+    session.execute(insert(SearchSummary), [dict(builder.values(), search_id=search.id)])
+    return session.get(SearchSummary, search.id)
+
+
+def get_summary(session, search: Search) -> SearchSummary:
+    """ The summary of a search, built first if it has none. """
+    return session.get(SearchSummary, search.id) or summarize(session, search)
@@ -0,0 +1,162 @@
+"""
+alignment.py
+
+Module for working with Stockholm alignments as NumPy residue matrices.
+"""
+
+from dataclasses import dataclass, field
+import numpy as np
+
+from cgk.interval import ChrInterval
+from jps.util.iosto import StockholmError, StoFeature, StoSequence, sto_read
+
+# Gap characters: '-' deletion, '.' insertion gap, '~' missing data (truncated hits)
+GAP_CHARS = b'-.~'
+RNA_ALPHABET = 'ACGU'
+
+# Lookup tables for vectorized residue classification
+_ISGAP = np.zeros(256, dtype=bool)
+_ISGAP[list(GAP_CHARS)] = True
+_UPPER = np.arange(256, dtype=np.uint8)
+_UPPER[ord('a'):ord('z') + 1] -= ord('a') - ord('A')
+
+
+def _encode(texts: list[str], ncols: int = None) -> np.ndarray:
+    """ Pack equal-length strings into an n x ncols uint8 matrix with a single join. """
+    if ncols is None:
+        ncols = len(texts[0]) if texts else 0
+    if any(len(text) != ncols for text in texts):
+        raise StockholmError("Unexpected seqlen")
+    buf = ''.join(texts).encode('ascii')
+    return np.frombuffer(buf, dtype=np.uint8).reshape(len(texts), ncols)
+
+
+def _decode(row: np.ndarray) -> str:
+    return row.tobytes().decode('ascii')
+
+
+@dataclass
+class StoAlignment:
+    """
+    Represents a Stockholm alignment as an n_seqs x n_cols uint8 residue matrix, with
+    the esltag and ChrInterval of each row alongside it.
+
+    Row and column slices share memory with the original alignment. GF and GS features
+    are kept as StoFeatures; GC and GR lines are kept as uint8 rows so they can be
+    sliced by column together with the residues.
+    """
+    residues: np.ndarray
+    esltags: list[str]
+    intervals: list[ChrInterval]
+    gc: dict[str, np.ndarray] = field(default_factory=dict)  # field -> column annotation
+    gr: dict[tuple[str, str], np.ndarray] = field(default_factory=dict)  # (esltag, field) -> column annotation
+    features: list[StoFeature] = field(default_factory=list)  # GF and GS features
+
+    def __len__(self):
+        return self.residues.shape[0]
+
+    def __getitem__(self, key) -> 'StoAlignment':
+        """
+        Select rows, or rows and columns, e.g. aln[:100] or aln[:, 20:80].
+        Slices return views of the residue matrix; index arrays return copies.
+        """
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, int):
+            rows = slice(rows, rows + 1 or None)
+        if isinstance(cols, int):
+            cols = slice(cols, cols + 1 or None)
+
+        residues = self.residues[rows, cols]
+        index = np.arange(len(self))[rows]
+        esltags = [self.esltags[i] for i in index]
+        selected = set(esltags)
+        return StoAlignment(
+            residues=residues,
+            esltags=esltags,
+            intervals=[self.intervals[i] for i in index],
+            gc={f: text[cols] for f, text in self.gc.items()},
+            gr={(esltag, f): text[cols] for (esltag, f), text in self.gr.items() if esltag in selected},
+            features=[feat for feat in self.features if feat.esltag is None or feat.esltag in selected],
+        )
+
+    @property
+    def shape(self):
+        return self.residues.shape
+
+    @property
+    def ncols(self):
+        return self.residues.shape[1]
+
+    # ---------------------------------------------------------------------
+    # Column statistics
+
+    def gaps(self) -> np.ndarray:
+        """ Boolean matrix marking gap characters. """
+        return _ISGAP[self.residues]
+
+    def gap_fraction(self) -> np.ndarray:
+        """ Fraction of sequences with a gap in each column. """
+        if len(self) == 0:
+            return np.zeros(self.ncols)
+        return self.gaps().mean(axis=0)
+
+    def frequencies(self, alphabet: str = RNA_ALPHABET) -> np.ndarray:
+        """
+        Residue frequencies per column, as a len(alphabet) x n_cols array.
+        Case is ignored, so insert-column residues are counted too.
+        """
+        upper = _UPPER[self.residues]
+        counts = np.stack([(upper == ord(ch)).sum(axis=0) for ch in alphabet.upper()])
+        return counts / max(len(self), 1)
+
+    def conservation(self, alphabet: str = RNA_ALPHABET) -> np.ndarray:
+        """
+        Fraction of the non-gap residues in each column that match the column's most
+        frequent residue. Columns with only gaps have a conservation of 0.
+        """
+        freqs = self.frequencies(alphabet)
+        total = freqs.sum(axis=0)
+        return np.divide(freqs.max(axis=0), total, out=np.zeros(self.ncols), where=total > 0)
+
+    # ---------------------------------------------------------------------
+    # Conversion
+
+    @staticmethod
+    def from_sto(sequences: dict[str, StoSequence], features: list[StoFeature]) -> 'StoAlignment':
+        """ Build an alignment from the output of iosto.sto_read. """
+        esltags = list(sequences)
+        residues = _encode([seq.alnseq for seq in sequences.values()])
+        ncols = residues.shape[1]
+
+        gc, gr, other = {}, {}, []
+        for feat in features:
+            if feat.fmt == 'GC':
+                gc[feat.field] = _encode([feat.text], ncols)[0]
+            elif feat.fmt == 'GR':
+                gr[feat.esltag, feat.field] = _encode([feat.text], ncols)[0]
+            else:
+                other.append(feat)
+
+        return StoAlignment(
+            residues=residues,
+            esltags=esltags,
+            intervals=[ChrInterval(seq.chraccn, seq.start, seq.end, seq.strand) for seq in sequences.values()],
+            gc=gc, gr=gr, features=other,
+        )
+
+    @staticmethod
+    def from_file(path: str) -> 'StoAlignment':
+        return StoAlignment.from_sto(*sto_read(path))
+
+    def to_sto(self) -> tuple[dict[str, StoSequence], list[StoFeature]]:
+        """ Convert back to the sequences and features used by iosto.sto_write. """
+        sequences = {
+            esltag: StoSequence(iv.chraccn, iv.start, iv.end, iv.strand, _decode(row))
+            for esltag, iv, row in zip(self.esltags, self.intervals, self.residues)
+        }
+        features = list(self.features)
+        features += [StoFeature(esltag=esltag, field=f, text=_decode(text), fmt='GR')
+                     for (esltag, f), text in self.gr.items()]
+        features += [StoFeature(esltag=None, field=f, text=_decode(text), fmt='GC')
+                     for f, text in self.gc.items()]
+        return sequences, features
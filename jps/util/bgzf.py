@@ -0,0 +1,281 @@
+"""
+bgzf.py
+
+Module for random access into compressed genome databases. bgzf_compress re-compresses a FASTA
+file (plain or gzipped) as BGZF, a series of independent gzip blocks of at most 64 KiB that
+plain gzip readers still accept, and writes two sidecar indexes in samtools' formats:
+
+    <out>.gzi  compressed and uncompressed offsets of every block (as bgzip -i)
+    <out>.fai  name, length, offset, line bases and line width of every sequence (as samtools faidx)
+
+BgzfFasta reads such a file with the get_seq and len(db[name]) interface of pyfaidx.Fasta, so
+ChrInterval.getflanks and FlankExtractor work against the compressed database, decompressing
+only the blocks a query touches. BgzfWriter, which bgzf_compress writes through, also backs
+`jps compress` for Stockholm files, which StoReader then reads through a BgzfReader.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+import os
+import struct
+import zlib
+
+from jps.util.compress import xopen
+from jps.util.flanks import revcomp
+
+BLOCK_SIZE = 0xff00  # Uncompressed bytes per block, as bgzip
+HEADER = struct.Struct('<4BI2BH2BHH')  # gzip header with the BC extra field holding the block size
+FOOTER = struct.Struct('<II')  # CRC32 and uncompressed size
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def _block(data: bytes, level: int) -> bytes:
+    """ A BGZF block holding data. """
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = deflate.compress(data) + deflate.flush()
+    bsize = HEADER.size + len(body) + FOOTER.size
+    return (HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, bsize - 1)
+            + body + FOOTER.pack(zlib.crc32(data), len(data)))
+
+
+@dataclass
+class FaiEntry:
+    """ A line of a .fai index. """
+    name: str
+    length: int
+    offset: int  # Uncompressed offset of the first base
+    linebases: int
+    linewidth: int
+
+    def byte_offset(self, pos: int) -> int:
+        """ Uncompressed offset of 0-based position pos. """
+        return self.offset + pos // self.linebases * self.linewidth + pos % self.linebases
+
+
+class BgzfWriter:
+    """
+    Streams data into a BGZF file and, on close, writes its .gzi index. The file is written
+    under <path>.tmp and moved into place by close, so readers never see a partial file.
+    """
+
+    def __init__(self, path: str, level: int = 6):
+        self.path = path
+        self.level = level
+        self.blocks: list[tuple[int, int]] = []  # (compressed, uncompressed) offsets of blocks after the first
+        self._file = open(path + '.tmp', 'wb')
+        self._buffer = bytearray()
+        self._coffset = self._uoffset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self.path + '.tmp')
+
+    def tell(self) -> int:
+        """ Uncompressed offset of the next byte written. """
+        return self._uoffset + len(self._buffer)
+
+    def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._flush(BLOCK_SIZE)
+            self.blocks.append((self._coffset, self._uoffset))
+
+    def _flush(self, size: int):
+        block = _block(bytes(self._buffer[:size]), self.level)
+        self._file.write(block)
+        self._coffset += len(block)
+        self._uoffset += size
+        del self._buffer[:size]
+
+    def close(self):
+        if self._buffer:
+            self._flush(len(self._buffer))
+        elif self.blocks:
+            self.blocks.pop()  # No block starts at the end of the data
+        self._file.write(EOF_BLOCK)
+        self._file.close()
+        with open(self.path + '.gzi', 'wb') as f:
+            f.write(struct.pack('<Q', len(self.blocks)))
+            f.write(b''.join(struct.pack('<QQ', c, u) for c, u in self.blocks))
+        os.replace(self.path + '.tmp', self.path)
+
+
+def bgzf_compress(src: str, out: str = None, level: int = 6) -> str:
+    """
+    Write a BGZF copy of a FASTA file, with .gzi and .fai indexes, in one streaming pass.
+    Returns the path of the copy, <src without .gz>.bgz by default.
+    """
+    if out is None:
+        out = os.path.splitext(src)[0] + '.bgz' if src.endswith('.gz') else src + '.bgz'
+
+    fai: list[FaiEntry] = []
+    entry = None
+    short = False  # Whether the current sequence has had a line shorter than the others
+
+    with xopen(src, 'rb') as fin, BgzfWriter(out, level) as fout:
+        for i, line in enumerate(fin, 1):
+            uoffset = fout.tell()
+            if line.startswith(b'>'):
+                entry = FaiEntry(line[1:].split(maxsplit=1)[0].decode(), 0, uoffset + len(line), 0, 0)
+                fai.append(entry)
+                short = False
+            elif entry is not None and (bases := len(line.rstrip(b'\r\n'))):
+                if entry.linebases == 0:
+                    entry.linebases, entry.linewidth = bases, len(line)
+                elif short or bases > entry.linebases or len(line) - bases != entry.linewidth - entry.linebases:
+                    raise ValueError(f"Line {i} of {src}: sequence lines must all have the same length")
+                short = bases < entry.linebases
+                entry.length += bases
+            fout.write(line)
+
+    with open(out + '.fai', 'w') as f:
+        f.writelines(f"{e.name}\t{e.length}\t{e.offset}\t{e.linebases}\t{e.linewidth}\n" for e in fai)
+    return out
+
+
+class BgzfReader:
+    """ Random access to the uncompressed bytes of a BGZF file with a .gzi index. """
+
+    def __init__(self, path: str, cache_blocks: int = 64):
+        self.path = path
+        with open(path + '.gzi', 'rb') as f:
+            n, = struct.unpack('<Q', f.read(8))
+            offsets = struct.unpack(f'<{2 * n}Q', f.read(16 * n))
+        self.coffsets = [0, *offsets[0::2]]
+        self.uoffsets = [0, *offsets[1::2]]
+        self._file = open(path, 'rb')
+        self._cache: OrderedDict[int, bytes] = OrderedDict()
+        self._cache_blocks = cache_blocks
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _load(self, i: int) -> bytes:
+        """ Uncompressed data of block i, through an LRU cache. """
+        if (data := self._cache.get(i)) is not None:
+            self._cache.move_to_end(i)
+            return data
+        self._file.seek(self.coffsets[i])
+        header = self._file.read(HEADER.size)
+        bsize = HEADER.unpack(header)[-1] + 1
+        data = zlib.decompress(self._file.read(bsize - HEADER.size)[:-FOOTER.size], -15)
+        self._cache[i] = data
+        if len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+        return data
+
+    def read(self, offset: int, size: int) -> bytes:
+        """ size uncompressed bytes starting at uncompressed offset. """
+        i = bisect_right(self.uoffsets, offset) - 1
+        chunks = []
+        while size > 0 and i < len(self.uoffsets):
+            data = self._load(i)
+            chunk = data[offset - self.uoffsets[i]:offset - self.uoffsets[i] + size]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+            i += 1
+        return b''.join(chunks)
+
+
+@dataclass
+class Sequence:
+    """ A sequence fetched by BgzfFasta.get_seq, like pyfaidx.Sequence. """
+    name: str
+    seq: str
+    start: int
+    end: int
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __str__(self):
+        return self.seq
+
+
+class BgzfRecord:
+    """ A sequence of a BgzfFasta, like pyfaidx.FastaRecord. """
+
+    def __init__(self, fasta: 'BgzfFasta', entry: FaiEntry):
+        self.fasta = fasta
+        self.entry = entry
+        self.name = entry.name
+
+    def __len__(self):
+        return self.entry.length
+
+    def __getitem__(self, key: slice) -> Sequence:
+        start, stop, _ = key.indices(len(self))
+        return self.fasta.get_seq(self.name, start + 1, stop)
+
+
+class BgzfFasta:
+    """ FASTA reader over a BGZF file indexed by bgzf_compress, with pyfaidx.Fasta's interface. """
+
+    def __init__(self, path: str, cache_blocks: int = 64):
+        self.path = path
+        self.reader = BgzfReader(path, cache_blocks)
+        self.index: dict[str, FaiEntry] = {}
+        with open(path + '.fai') as f:
+            for line in f:
+                name, length, offset, linebases, linewidth = line.split('\t')
+                self.index[name] = FaiEntry(name, int(length), int(offset), int(linebases), int(linewidth))
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name: str):
+        return name in self.index
+
+    def __iter__(self):
+        return (BgzfRecord(self, entry) for entry in self.index.values())
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, name: str) -> BgzfRecord:
+        return BgzfRecord(self, self.index[name])
+
+    def get_seq(self, name: str, start: int, end: int, rc: bool = False) -> Sequence:
+        """ Sequence from 1-based start to end inclusive, reverse-complemented if rc. """
+        entry = self.index[name]
+        start, end = max(1, start), min(entry.length, end)
+        if end < start:
+            return Sequence(name, '', start, end)
+        offset = entry.byte_offset(start - 1)
+        raw = self.reader.read(offset, entry.byte_offset(end - 1) - offset + 1)
+        seq = raw.decode().replace('\n', '').replace('\r', '')
+        return Sequence(name, revcomp(seq) if rc else seq, start, end)
+
+
+def open_genome(path: str, cache_blocks: int = 64):
+    """
+    Open a genome database for random access: its BGZF copy (<path>.bgz, or path itself)
+    if one has been built with bgzf_compress, and otherwise a pyfaidx.Fasta.
+    """
+    for candidate in (path, os.path.splitext(path)[0] + '.bgz' if path.endswith('.gz') else path + '.bgz'):
+        if os.path.exists(candidate + '.gzi') and os.path.exists(candidate + '.fai'):
+            return BgzfFasta(candidate, cache_blocks)
+    from pyfaidx import Fasta
+    return Fasta(path)
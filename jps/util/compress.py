@@ -0,0 +1,72 @@
+"""
+compress.py
+
+Module for transparently reading and writing compressed (.gz, .xz, .bz2) data files.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+
+COMPRESSORS = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+    '.bz2': bz2.open,
+}
+
+
+def iscompressed(path: str) -> bool:
+    return os.path.splitext(path)[1] in COMPRESSORS
+
+
+def resolve(path: str) -> str:
+    """
+    Return path if it exists, or else its compressed sibling (e.g. <path>.gz) if one exists,
+    so that callers can keep referring to files by their uncompressed names.
+    """
+    if not os.path.exists(path):
+        for ext in COMPRESSORS:
+            if os.path.exists(path + ext):
+                return path + ext
+    return path
+
+
+def xopen(path: str, mode: str = 'r'):
+    """
+    Open a file, compressing or decompressing on the fly according to its extension.
+    In read modes, a missing file is looked up among its compressed siblings.
+    """
+    if 'r' in mode:
+        path = resolve(path)
+    opener = COMPRESSORS.get(os.path.splitext(path)[1])
+    if opener is None:
+        return open(path, mode)
+    # Compressed files open in binary mode by default
+    if 'b' not in mode and 't' not in mode:
+        mode += 't'
+    return opener(path, mode)
+
+
+def compress_file(path: str, ext: str = '.gz', bgzf: bool = False) -> str:
+    """
+    Compress a file in place, keeping its mtime. Returns the path of the compressed file.
+    With bgzf, a .gz file is written as BGZF with a .gzi index (see jps.util.bgzf), which
+    gzip readers still accept and which allows random access into the compressed file.
+    """
+    if ext not in COMPRESSORS:
+        raise ValueError(f"Unknown compression format '{ext}'")
+    out = path + ext
+    if bgzf and ext == '.gz':
+        from jps.util.bgzf import BgzfWriter
+        with open(path, 'rb') as src, BgzfWriter(out) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    else:
+        with open(path, 'rb') as src, COMPRESSORS[ext](out + '.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(out + '.tmp', out)
+    stat = os.stat(path)
+    os.utime(out, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.remove(path)
+    return out
@@ -0,0 +1,218 @@
+"""
+flanks.py
+
+Module for extracting the sequences of many intervals, with flanking context, from a genome
+database. Requests are grouped by contig and sorted, and nearby windows are merged so that
+each stretch of the database is read once, instead of once per interval as in
+ChrInterval.getflanks.
+
+The database may be a pyfaidx.Fasta or any object with the same get_seq(name, start, end)
+and len(db[name]) interface. Without an index, stream_flanks extracts everything in a single
+sequential pass over a (gzipped) FASTA file instead.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+import queue
+import sys
+import threading
+
+from cgk.interval import ChrInterval
+from jps.util.compress import xopen
+
+COMPLEMENT = str.maketrans('ACGTURYKMBVDHSWNacgturykmbvdhswn', 'TGCAAYRMKVBHDSWNtgcaayrmkvbhdswn')
+
+
+def revcomp(seq: str) -> str:
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+@dataclass
+class Flanked:
+    """ Sequence of an interval with its flanks, as returned by ChrInterval.getflanks. """
+    esltag: str
+    seq5p: str
+    seq: str
+    seq3p: str
+    nt5p: int  # Flanking nts actually retrieved, which may be fewer near contig ends
+    nt3p: int
+
+    def fasta(self, sep: str = '') -> str:
+        return f">{self.esltag}\n{self.seq5p}{sep}{self.seq}{sep}{self.seq3p}\n"
+
+
+def flank_window(iv: ChrInterval, length: int, nt5p: int, nt3p: int) -> tuple[int, int, int, int]:
+    """
+    Window (lo, hi) of an interval expanded by nt5p and nt3p within a contig of the given
+    length, along with the flanking nts it actually covers, as in ChrInterval.getflanks.
+    """
+    if not isinstance(nt5p, int) or not isinstance(nt3p, int):
+        raise ValueError("flanking nt count must be int")
+    elif nt5p < 0 or nt3p < 0:
+        raise ValueError("flanking nt count must be positive")
+
+    if iv.strand == '-':
+        lo, hi = max(1, iv.start - nt3p), min(length, iv.end + nt5p)
+        return lo, hi, hi - iv.end, iv.start - lo
+    lo, hi = max(1, iv.start - nt5p), min(length, iv.end + nt3p)
+    return lo, hi, iv.start - lo, hi - iv.end
+
+
+class FlankExtractor:
+    """
+    Batched sequence extraction from a genome database. Contig lengths are cached across
+    calls. Windows on the same contig closer than gap nts are read together, as long as the
+    merged read spans at most maxspan nts.
+    """
+
+    def __init__(self, dbfna, gap: int = 1000, maxspan: int = 1 << 20):
+        self.dbfna = dbfna
+        self.gap = gap
+        self.maxspan = maxspan
+        self._lengths: dict[str, int] = {}
+
+    def length(self, chraccn: str) -> int:
+        if (length := self._lengths.get(chraccn)) is None:
+            length = self._lengths[chraccn] = len(self.dbfna[chraccn])
+        return length
+
+    def _reads(self, windows: list[tuple[int, int, int]]) -> Iterable[tuple[int, int, list[tuple[int, int, int]]]]:
+        """ Group sorted (lo, hi, k) windows into reads of (lo, hi, windows). """
+        group = [windows[0]]
+        lo, hi = windows[0][0], windows[0][1]
+        for window in windows[1:]:
+            if window[0] <= hi + self.gap and max(hi, window[1]) - lo < self.maxspan:
+                group.append(window)
+                hi = max(hi, window[1])
+            else:
+                yield lo, hi, group
+                group = [window]
+                lo, hi = window[0], window[1]
+        yield lo, hi, group
+
+    def extract(self, intervals: Iterable[ChrInterval], nt5p: int = 0, nt3p: int = 0) -> list[Flanked]:
+        """ Sequences of intervals with up to nt5p and nt3p flanking nts, in request order. """
+        intervals = list(intervals)
+        bycontig: dict[str, list[tuple[int, int, int]]] = defaultdict(list)
+        flanks: list[tuple[int, int]] = []
+        for k, iv in enumerate(intervals):
+            lo, hi, n5, n3 = flank_window(iv, self.length(iv.chraccn), nt5p, nt3p)
+            bycontig[iv.chraccn].append((lo, hi, k))
+            flanks.append((n5, n3))
+
+        results: list[Flanked] = [None] * len(intervals)
+        for chraccn, windows in bycontig.items():
+            windows.sort()
+            for lo, hi, group in self._reads(windows):
+                region = self.dbfna.get_seq(chraccn, lo, hi).seq.upper()
+                for wlo, whi, k in group:
+                    iv, (n5, n3) = intervals[k], flanks[k]
+                    seq = region[wlo - lo:whi - lo + 1]
+                    if iv.strand == '-':
+                        seq = revcomp(seq)
+                    results[k] = Flanked(
+                        iv.esltag, seq[:n5], seq[n5:len(seq) - n3], seq[len(seq) - n3:] if n3 > 0 else '', n5, n3)
+        return results
+
+    def write_fasta(self, intervals: Iterable[ChrInterval], path: str, nt5p: int = 0, nt3p: int = 0,
+                    sep: str = ''):
+        """ Write the sequences of intervals with their flanks to a FASTA file, in request order. """
+        with xopen(path, 'w') as f:
+            for flanked in self.extract(intervals, nt5p, nt3p):
+                f.write(flanked.fasta(sep))
+
+
+def _read_chunks(path: str, chunks: queue.Queue, stop: threading.Event, chunksize: int):
+    """ Decompress a file into a queue of chunks, ending with None (or an exception). """
+    try:
+        with xopen(path, 'rb') as f:
+            while not stop.is_set() and (chunk := f.read(chunksize)):
+                chunks.put(chunk)
+    except Exception as e:
+        chunks.put(e)
+    chunks.put(None)
+
+
+def _fasta_records(path: str, wanted: set[str], chunksize: int) -> Iterator[tuple[str, bytes]]:
+    """
+    Stream the records of a FASTA file whose names are in wanted, as (name, sequence) pairs.
+    Decompression runs in a reader thread, overlapped with parsing, and chunks are scanned
+    for record starts with bytes.find, so only wanted records are ever copied.
+    """
+    chunks = queue.Queue(maxsize=8)
+    stop = threading.Event()
+    threading.Thread(target=_read_chunks, args=(path, chunks, stop, chunksize), daemon=True).start()
+
+    name, parts = None, []
+    header = b''
+    in_header = False
+    try:
+        while (chunk := chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            pos = 0
+            while pos < len(chunk):
+                if in_header:
+                    end = chunk.find(b'\n', pos)
+                    if end == -1:
+                        header += chunk[pos:]
+                        break
+                    header += chunk[pos:end]
+                    name = header.split(maxsplit=1)[0].decode() if header.strip() else ''
+                    name = name if name in wanted else None
+                    in_header, pos = False, end + 1
+                    continue
+
+                # Sequence runs up to the next record
+                end = chunk.find(b'>', pos)
+                if name is not None:
+                    parts.append(chunk[pos:end if end != -1 else len(chunk)])
+                if end == -1:
+                    break
+                if name is not None:
+                    yield name, b''.join(parts).translate(None, b'\r\n')
+                name, parts = None, []
+                header, in_header, pos = b'', True, end + 1
+        if name is not None:
+            yield name, b''.join(parts).translate(None, b'\r\n')
+    finally:
+        stop.set()
+        while not chunks.empty():
+            chunks.get_nowait()  # Unblock the reader thread
+
+
+def stream_flanks(path: str, intervals: Iterable[ChrInterval], nt5p: int = 0, nt3p: int = 0,
+                  chunksize: int = 1 << 22) -> Iterator[tuple[int, Flanked]]:
+    """
+    Extract the sequences of intervals with their flanks in a single sequential pass over a
+    plain or gzipped FASTA file, for databases without an index. Yields (k, flanked) pairs,
+    k being the position of the interval in the request, as each contig passes; intervals on
+    contigs missing from the database are reported on stderr.
+    """
+    intervals = list(intervals)
+    bycontig: dict[str, list[int]] = defaultdict(list)
+    for k, iv in enumerate(intervals):
+        bycontig[iv.chraccn].append(k)
+
+    for chraccn, seq in _fasta_records(path, set(bycontig), chunksize):
+        for k in bycontig.pop(chraccn, ()):
+            iv = intervals[k]
+            lo, hi, n5, n3 = flank_window(iv, len(seq), nt5p, nt3p)
+            window = seq[lo - 1:hi].decode().upper()
+            if iv.strand == '-':
+                window = revcomp(window)
+            yield k, Flanked(iv.esltag, window[:n5], window[n5:len(window) - n3],
+                             window[len(window) - n3:] if n3 > 0 else '', n5, n3)
+
+    if bycontig:
+        missing = sum(len(ks) for ks in bycontig.values())
+        print(f"{missing} intervals on {len(bycontig)} contigs missing from {path}, skipping...", file=sys.stderr)
+
+
+def stream_fasta(path: str, intervals: Iterable[ChrInterval], out: str, nt5p: int = 0, nt3p: int = 0,
+                 sep: str = ''):
+    """ Write the sequences of intervals with their flanks to a FASTA file, in database order. """
+    with xopen(out, 'w') as f:
+        for _, flanked in stream_flanks(path, intervals, nt5p, nt3p):
+            f.write(flanked.fasta(sep))
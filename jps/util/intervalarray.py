@@ -0,0 +1,267 @@
+"""
+intervalarray.py
+
+Module for columnar arrays of chromosome intervals, for batch interval arithmetic.
+
+A ChrIntervalArray holds chraccns dictionary-encoded as int32 codes into a sorted array of
+names, start and end as int64 arrays, and strands as int8 codes into STRANDS. Operations
+follow their ChrInterval counterparts, but run over whole arrays at once.
+"""
+
+from typing import Iterable, Sequence
+import numpy as np
+
+from cgk.interval import ChrInterval
+
+STRANDS = [None, '+', '-', '.']
+PLUS, MINUS = STRANDS.index('+'), STRANDS.index('-')
+
+
+def _encode(values) -> tuple[np.ndarray, np.ndarray]:
+    """ Dictionary-encode values, returning sorted unique values and each value's code. """
+    names, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    return names, codes.astype(np.int32).reshape(-1)
+
+
+def _encode_strands(strands) -> np.ndarray:
+    lookup = {strand: code for code, strand in enumerate(STRANDS)}
+    try:
+        return np.fromiter((lookup[s] for s in strands), dtype=np.int8)
+    except KeyError as e:
+        raise ValueError(f"Strand must be '+', '-', '.', or None, not {e.args[0]!r}") from None
+
+
+class ChrIntervalArray:
+    """ Array of chromosomal intervals, stored column by column. """
+
+    def __init__(self, names: np.ndarray, codes: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 strands: np.ndarray):
+        if not (len(codes) == len(starts) == len(ends) == len(strands)):
+            raise ValueError("Columns must have the same length")
+        if np.any(ends < starts):
+            raise ValueError("end cannot be less than start")
+        self.names = names
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.strands = np.asarray(strands, dtype=np.int8)
+
+    # -------------------------------------------------------------------------
+    # Construction
+
+    @classmethod
+    def from_columns(cls, chraccns: Sequence[str], starts: Sequence[int], ends: Sequence[int],
+                     strands: Sequence[str]) -> 'ChrIntervalArray':
+        """ Build from parallel columns of chraccns, starts, ends and strand characters. """
+        names, codes = _encode(chraccns)
+        return cls(names, codes, np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64),
+                   _encode_strands(strands))
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[str, int, int, str]]) -> 'ChrIntervalArray':
+        """
+        Build from (chraccn, start, end, strand) rows, such as the result of
+        session.execute(select(Hit.chraccn, Hit.start, Hit.end, Hit.strand)),
+        without creating an object per row.
+        """
+        columns = list(zip(*rows))
+        if not columns:
+            return cls.empty()
+        return cls.from_columns(*columns)
+
+    @classmethod
+    def from_intervals(cls, intervals: Iterable[ChrInterval]) -> 'ChrIntervalArray':
+        """ Build from ChrInterval objects (e.g. Hit instances). """
+        return cls.from_rows((iv.chraccn, iv.start, iv.end, iv.strand) for iv in intervals)
+
+    @classmethod
+    def from_esltags(cls, esltags: Sequence[str], sep: str = '/', delim: str = '-') -> 'ChrIntervalArray':
+        """
+        Parse <chraccn>/<5prime>-<3prime> esltags in bulk, e.g. the keys returned by
+        iosto.sto_read. As in ChrInterval.from_esltag, reversed coordinates mean the minus strand.
+        """
+        if len(esltags) == 0:
+            return cls.empty()
+        tags = np.asarray(esltags, dtype=str)
+        head = np.char.rpartition(tags, sep)
+        if np.any(head[:, 1] == ''):
+            raise ValueError(f"Invalid esltag, expected <chraccn>{sep}<coords>")
+        coords = np.char.partition(head[:, 2], delim)
+        c5p, c3p = coords[:, 0].astype(np.int64), coords[:, 2].astype(np.int64)
+        minus = c5p > c3p
+        names, codes = _encode(head[:, 0])
+        return cls(names, codes, np.where(minus, c3p, c5p), np.where(minus, c5p, c3p),
+                   np.where(minus, MINUS, PLUS).astype(np.int8))
+
+    @classmethod
+    def empty(cls) -> 'ChrIntervalArray':
+        return cls(np.empty(0, dtype=object), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64),
+                   np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8))
+
+    @classmethod
+    def concat(cls, arrays: Sequence['ChrIntervalArray']) -> 'ChrIntervalArray':
+        """ Concatenate arrays, merging their chraccn dictionaries. """
+        if not arrays:
+            return cls.empty()
+        names = np.unique(np.concatenate([a.names for a in arrays]))
+        return cls(names, np.concatenate([a.recode(names) for a in arrays]),
+                   np.concatenate([a.starts for a in arrays]), np.concatenate([a.ends for a in arrays]),
+                   np.concatenate([a.strands for a in arrays]))
+
+    # -------------------------------------------------------------------------
+    # Access
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        """ An interval as a ChrInterval, or a subarray for slices, index arrays and masks. """
+        if isinstance(key, (int, np.integer)):
+            return ChrInterval(self.names[self.codes[key]], int(self.starts[key]), int(self.ends[key]),
+                               STRANDS[self.strands[key]])
+        return ChrIntervalArray(self.names, self.codes[key], self.starts[key], self.ends[key], self.strands[key])
+
+    def __iter__(self):
+        return iter(self.to_intervals())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} intervals on {len(self.names)} chraccns)"
+
+    @property
+    def chraccns(self) -> np.ndarray:
+        return self.names[self.codes]
+
+    def strand_chars(self) -> list[str]:
+        return [STRANDS[s] for s in self.strands.tolist()]
+
+    def to_intervals(self) -> list[ChrInterval]:
+        return [ChrInterval(chraccn, start, end, strand) for chraccn, start, end, strand in zip(
+            self.chraccns.tolist(), self.starts.tolist(), self.ends.tolist(), self.strand_chars())]
+
+    def recode(self, names: np.ndarray) -> np.ndarray:
+        """ Codes of this array's chraccns in another sorted names array that includes them all. """
+        return np.searchsorted(names, self.names).astype(np.int32)[self.codes]
+
+    def _aligned(self, other: 'ChrIntervalArray') -> tuple[np.ndarray, np.ndarray]:
+        """ Codes of both arrays in a shared dictionary. """
+        if self.names is other.names or np.array_equal(self.names, other.names):
+            return self.codes, other.codes
+        names = np.union1d(self.names, other.names)
+        return self.recode(names), other.recode(names)
+
+    # -------------------------------------------------------------------------
+    # Elementwise properties
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.ends - self.starts + 1
+
+    @property
+    def midpoints(self) -> np.ndarray:
+        return (self.starts + self.ends) / 2
+
+    @property
+    def eslcoords(self) -> tuple[np.ndarray, np.ndarray]:
+        """ 5' and 3' coordinates. """
+        minus = self.strands == MINUS
+        return np.where(minus, self.ends, self.starts), np.where(minus, self.starts, self.ends)
+
+    def esltags(self, sep: str = '/', delim: str = '-') -> list[str]:
+        """ Esltags of all intervals, as ChrInterval.esltag. """
+        c5p, c3p = self.eslcoords
+        tags = np.char.add(self.names.astype(str)[self.codes], sep)
+        tags = np.char.add(np.char.add(tags, c5p.astype(str)), delim)
+        return np.char.add(tags, c3p.astype(str)).tolist()
+
+    # -------------------------------------------------------------------------
+    # Comparisons: elementwise (self[i] vs other[i]) and pairwise (self[i] vs other[j])
+
+    def _elementwise(self, other: 'ChrIntervalArray'):
+        if len(self) != len(other):
+            raise ValueError("Arrays must have the same length")
+        a, b = self._aligned(other)
+        if np.any(a != b):
+            raise ValueError('Cannot compare w/ different accns')
+        sign = np.where(self.strands == other.strands, 1, -1).astype(np.int8)
+        return sign, self.starts, self.ends, other.starts, other.ends
+
+    def _pairwise(self, other: 'ChrIntervalArray'):
+        a, b = self._aligned(other)
+        samechr = a[:, None] == b[None, :]
+        sign = np.where(self.strands[:, None] == other.strands[None, :], 1, -1).astype(np.int8) * samechr
+        return sign, self.starts[:, None], self.ends[:, None], other.starts[None, :], other.ends[None, :]
+
+    @staticmethod
+    def _overlaps(sign, s1, e1, s2, e2) -> np.ndarray:
+        return sign * ((e1 >= s2) & (s1 <= e2))
+
+    @staticmethod
+    def _contains(sign, s1, e1, s2, e2) -> np.ndarray:
+        return sign * ((s1 <= s2) & (e1 >= e2))
+
+    @staticmethod
+    def _distance(sign, s1, e1, s2, e2) -> np.ndarray:
+        return np.maximum(0, np.maximum(s2 - e1, s1 - e2))
+
+    def overlaps(self, other: 'ChrIntervalArray') -> np.ndarray:
+        """ self[i].overlaps(other[i]) for all i: 1 same strand, -1 opposite strand, 0 none. """
+        return self._overlaps(*self._elementwise(other))
+
+    def contains(self, other: 'ChrIntervalArray') -> np.ndarray:
+        """ self[i].contains(other[i]) for all i. """
+        return self._contains(*self._elementwise(other))
+
+    def distance_to(self, other: 'ChrIntervalArray') -> np.ndarray:
+        """ self[i].distance_to(other[i]) for all i; 0 if overlapping. """
+        return self._distance(*self._elementwise(other))
+
+    def pairwise_overlaps(self, other: 'ChrIntervalArray') -> np.ndarray:
+        """ Matrix of self[i].overlaps(other[j]), with 0 for different chraccns. """
+        return self._overlaps(*self._pairwise(other))
+
+    def pairwise_contains(self, other: 'ChrIntervalArray') -> np.ndarray:
+        """ Matrix of self[i].contains(other[j]), with 0 for different chraccns. """
+        return self._contains(*self._pairwise(other))
+
+    def pairwise_distance(self, other: 'ChrIntervalArray') -> np.ndarray:
+        """ Matrix of self[i].distance_to(other[j]), with -1 for different chraccns. """
+        sign, *coords = self._pairwise(other)
+        a, b = self._aligned(other)
+        return np.where(a[:, None] == b[None, :], self._distance(sign, *coords), -1)
+
+    # -------------------------------------------------------------------------
+    # Sorting and merging
+
+    def argsort(self) -> np.ndarray:
+        """ Order by chraccn, start, and end. """
+        return np.lexsort((self.ends, self.starts, self.codes))
+
+    def sorted(self) -> 'ChrIntervalArray':
+        return self[self.argsort()]
+
+    def merge(self, stranded: bool = True) -> 'ChrIntervalArray':
+        """
+        Merge overlapping intervals into their union, per chraccn and, if stranded, per strand.
+        Returns the merged intervals sorted by chraccn (and strand), then start. Unstranded
+        merges have strand None.
+        """
+        if len(self) == 0:
+            return self
+        strands = self.strands if stranded else np.zeros(len(self), dtype=np.int8)
+        order = np.lexsort((self.starts, strands, self.codes))
+        codes, strands = self.codes[order], strands[order]
+        starts, ends = self.starts[order], self.ends[order]
+
+        # Groups of (chraccn, strand), and the running maximum of ends within each group
+        newgroup = np.ones(len(self), dtype=bool)
+        newgroup[1:] = (codes[1:] != codes[:-1]) | (strands[1:] != strands[:-1])
+        group = np.cumsum(newgroup) - 1
+        offset = group * (int(ends.max()) + 1)
+        maxend = np.maximum.accumulate(ends + offset) - offset
+
+        # An interval starts a new run if it begins after every earlier interval of its group ends
+        newrun = newgroup.copy()
+        newrun[1:] |= starts[1:] > maxend[:-1]
+        first = np.flatnonzero(newrun)
+        last = np.append(first[1:], len(self)) - 1
+        return ChrIntervalArray(self.names, codes[first], starts[first], maxend[last], strands[first])
@@ -0,0 +1,145 @@
+"""
+intervalindex.py
+
+Module for indexing chromosome intervals (ChrInterval, or Hit) for fast overlap queries.
+
+Intervals are grouped by chraccn and strand, and each group is kept as arrays sorted by start
+along with the running maximum of ends, so a query bisects to its candidates instead of
+scanning every interval. Strand is respected as in ChrInterval.overlaps: queries take a sign
+of 1 for same-strand matches only, -1 for opposite-strand matches only, or None for both.
+"""
+
+from collections import defaultdict
+from typing import Iterable, Iterator, TypeVar
+import numpy as np
+
+from cgk.interval import ChrInterval
+
+T = TypeVar('T', bound=ChrInterval)
+
+
+class _SortedIntervals:
+    """ Intervals on one chraccn and strand, sorted by start. """
+    __slots__ = ('items', 'starts', 'ends', 'maxend', 'argmaxend')
+
+    def __init__(self, items: list[ChrInterval]):
+        starts = np.fromiter((iv.start for iv in items), dtype=np.int64, count=len(items))
+        ends = np.fromiter((iv.end for iv in items), dtype=np.int64, count=len(items))
+        order = np.lexsort((ends, starts))
+        self.items = [items[i] for i in order.tolist()]
+        self.starts = starts[order]
+        self.ends = ends[order]
+
+        # Running maximum of ends, and the index of the interval that reaches it
+        self.maxend = np.maximum.accumulate(self.ends)
+        index = np.arange(len(items))
+        self.argmaxend = np.maximum.accumulate(np.where(self.ends == self.maxend, index, 0))
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        """ Indices of intervals overlapping [start, end]. """
+        j = np.searchsorted(self.maxend, start, 'left')
+        k = np.searchsorted(self.starts, end, 'right')
+        return j + np.flatnonzero(self.ends[j:k] >= start)
+
+    def within(self, start: int, end: int) -> np.ndarray:
+        """ Indices of intervals contained by [start, end]. """
+        j = np.searchsorted(self.starts, start, 'left')
+        k = np.searchsorted(self.starts, end, 'right')
+        return j + np.flatnonzero(self.ends[j:k] <= end)
+
+    def containing(self, start: int, end: int) -> np.ndarray:
+        """ Indices of intervals containing [start, end]. """
+        j = np.searchsorted(self.maxend, end, 'left')
+        k = np.searchsorted(self.starts, start, 'right')
+        return j + np.flatnonzero(self.ends[j:k] >= end)
+
+    def nearest(self, start: int, end: int) -> tuple[int, int] | None:
+        """ Index of and distance to the interval closest to [start, end]; 0 if overlapping. """
+        j = np.searchsorted(self.maxend, start, 'left')
+        k = np.searchsorted(self.starts, end, 'right')
+        if j < k and (hits := self.overlapping(start, end)).size:
+            return int(hits[0]), 0
+        best = None
+        if j > 0:
+            best = int(self.argmaxend[j - 1]), start - int(self.maxend[j - 1])
+        if k < len(self.items) and (best is None or int(self.starts[k]) - end < best[1]):
+            best = k, int(self.starts[k]) - end
+        return best
+
+
+class ChrIntervalIndex:
+    """
+    Index of intervals keyed by chraccn. Construction sorts each (chraccn, strand) group once,
+    in O(n log n); each query then costs O(log n) plus the size of its answer.
+    """
+
+    def __init__(self, intervals: Iterable[T] = ()):
+        groups: dict[str, dict[str, list[T]]] = defaultdict(lambda: defaultdict(list))
+        for iv in intervals:
+            groups[iv.chraccn][iv.strand].append(iv)
+        self._groups = {
+            chraccn: {strand: _SortedIntervals(items) for strand, items in bystrand.items()}
+            for chraccn, bystrand in groups.items()}
+        self._len = sum(len(s.items) for bystrand in self._groups.values() for s in bystrand.values())
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self) -> Iterator[T]:
+        for bystrand in self._groups.values():
+            for group in bystrand.values():
+                yield from group.items
+
+    def __contains__(self, chraccn: str):
+        return chraccn in self._groups
+
+    @property
+    def chraccns(self) -> list[str]:
+        return list(self._groups)
+
+    def _select(self, chraccn: str, strand: str, sign: int = None) -> list[_SortedIntervals]:
+        """ Groups on chraccn whose strand relates to strand as sign requires. """
+        bystrand = self._groups.get(chraccn, {})
+        if sign is None:
+            return list(bystrand.values())
+        elif sign == 1:
+            return [bystrand[strand]] if strand in bystrand else []
+        elif sign == -1:
+            return [group for s, group in bystrand.items() if s != strand]
+        raise ValueError("sign must be 1, -1, or None")
+
+    @staticmethod
+    def _collect(groups: list[_SortedIntervals], method: str, start: int, end: int) -> list[T]:
+        found = [(group, getattr(group, method)(start, end)) for group in groups]
+        items = [group.items[i] for group, indices in found for i in indices.tolist()]
+        if len(found) > 1:
+            items.sort(key=lambda iv: (iv.start, iv.end))
+        return items
+
+    def stab(self, chraccn: str, pos: int, strand: str = None) -> list[T]:
+        """ Intervals on chraccn covering position pos, on the given strand if one is given. """
+        groups = self._select(chraccn, strand, None if strand is None else 1)
+        return self._collect(groups, 'overlapping', pos, pos)
+
+    def overlapping(self, iv: ChrInterval, sign: int = None) -> list[T]:
+        """ Intervals overlapping iv, as iv.overlaps(other) == sign. """
+        return self._collect(self._select(iv.chraccn, iv.strand, sign), 'overlapping', iv.start, iv.end)
+
+    def contained(self, iv: ChrInterval, sign: int = None) -> list[T]:
+        """ Intervals contained by iv, as iv.contains(other) == sign. """
+        return self._collect(self._select(iv.chraccn, iv.strand, sign), 'within', iv.start, iv.end)
+
+    def containing(self, iv: ChrInterval, sign: int = None) -> list[T]:
+        """ Intervals containing iv, as other.contains(iv) == sign. """
+        return self._collect(self._select(iv.chraccn, iv.strand, sign), 'containing', iv.start, iv.end)
+
+    def nearest(self, iv: ChrInterval, sign: int = None) -> tuple[T, int] | None:
+        """
+        Interval closest to iv and its iv.distance_to, which is 0 if they overlap.
+        Returns None if there is no interval on iv's chraccn (and strand, per sign).
+        """
+        best = None
+        for group in self._select(iv.chraccn, iv.strand, sign):
+            if (found := group.nearest(iv.start, iv.end)) is not None and (best is None or found[1] < best[1]):
+                best = group.items[found[0]], found[1]
+        return best
@@ -6,9 +6,14 @@ Module for handling Stockholm file i/o.
 
 from dataclasses import dataclass, field
 from collections import defaultdict
+from typing import Iterator
 import os
+import shutil
+import tempfile
 
 from cgk.interval import ChrInterval
+from jps.util.compress import xopen
+from cgk.iosto import StockholmError, parse_line, read_sto, gc_paused, SEQ
 
 # Stockholm line formats:
 #   GF:   Global feature
@@ -20,10 +25,6 @@ from cgk.interval import ChrInterval
 #   else: Sequence
 
 
-class StockholmError(Exception):
-    """ Errors related to Stockholm file formatting. """
-
-
 @dataclass
 class StoFeature:
     """ Represents a feature in a Stockholm file. """    
@@ -43,42 +44,66 @@ class StoSequence(ChrInterval):
     alnseq: str
 
 
-def sto_parseline(line: str):
+def sto_parseline(line: str, i: int = None):
     """
     Factory for parsing a line from a Stockholm file.
     Returns a StoFeature, StoSequence, or comment line.
     """
-    if len(line) == 0:  # Empty line
-        return ''
-    elif line.startswith('#='):  # Feature line
-        fmt = line[2:4]
-        if fmt == 'GF' or fmt == 'GC':  # GF and GC lines have no sequence name
-            field, text = line.split(maxsplit=2)[1:]
-            return StoFeature(text=text, fmt=fmt, esltag=None, field=field)
-        elif fmt == 'GS' or fmt == 'GR':  # GS and GR lines have a sequence name
-            esltag, field, text = line.split(maxsplit=3)[1:]
-            return StoFeature(text=text, fmt=fmt, esltag=esltag, field=field)
-        else:
-            raise StockholmError(f"Invalid Stockholm line of unknown format '{fmt}': {line}")
-    elif line.startswith('#') or line == '//':  # Comment or end of alignment
-        return line
-    else:  # Sequence line
-        esltag, alnseq = line.split(maxsplit=1)
-        chraccn, coords = esltag.split('/')
-        start, end = (int(p) for p in coords.split('-'))
-        strand = '-' if start > end else '+'
-        return StoSequence(text=alnseq, chraccn=chraccn, start=start, end=end, strand=strand)
+    fmt, seqname, field, text = parse_line(line, i)
+    if fmt is SEQ:
+        return StoSequence.from_esltag(seqname, text)
+    elif fmt in ('GF', 'GS', 'GC', 'GR'):
+        return StoFeature(esltag=seqname, field=field, text=text, fmt=fmt)
+    else:  # Empty line, comment, or end of alignment
+        return text
 
 
-def sto_read(path: str) -> tuple[dict[str, StoSequence], list[StoFeature]]:
-    """ Parse a Stockholm file. """
-    features: list[StoFeature] = []
-    sequences: dict[str, StoSequence] = {}
-    with open(path) as f:
-        if (header := f.readline()) != '# STOCKHOLM 1.0\n':
+def _sto_isblockline(line: str) -> bool:
+    """ Whether a raw line belongs to an alignment block (sequence, GC, or GR line). """
+    return line[0] != '#' or line.startswith(('#=GC', '#=GR'))
+
+
+def _sto_isinterleaved(f) -> bool:
+    """
+    Scan ahead in an open Stockholm file to check whether its alignment is split
+    across more than one block. Stops as soon as a second block is found.
+    """
+    seen_block = in_block = False
+    for line in f:
+        if line.startswith('//'):
+            break
+        elif line.isspace():  # An empty line ends a block
+            in_block = False
+        elif _sto_isblockline(line):
+            if seen_block and not in_block:
+                return True
+            seen_block = in_block = True
+    return False
+
+
+def sto_iter(path: str) -> Iterator[StoSequence | StoFeature]:
+    """
+    Stream the sequences and features of a Stockholm file in file order.
+
+    GF and GS features are yielded as soon as they are read. In a single-block
+    (Pfam format) file, like the ones written by cmsearch -A, sequences and GR/GC
+    features are yielded line by line too, so memory use stays flat. In an
+    interleaved file, fragments are collected in per-row chunk lists and each row
+    is joined once and yielded at the end of the alignment.
+    """
+    with xopen(path) as f:
+        if f.readline() != '# STOCKHOLM 1.0\n':
             raise StockholmError("Invalid Stockholm header")
-    
-        for i, line in enumerate(f):
+
+        start = f.tell()
+        interleaved = _sto_isinterleaved(f)
+        f.seek(start)
+
+        # Rows of an interleaved alignment, keyed by (fmt, esltag, field)
+        rows: dict[tuple, StoSequence | StoFeature] = {}
+        chunks: dict[tuple, list[str]] = {}
+
+        for i, line in enumerate(f, 2):
             line = sto_parseline(line.strip(), i)
 
             if isinstance(line, str):
@@ -86,49 +111,111 @@ def sto_read(path: str) -> tuple[dict[str, StoSequence], list[StoFeature]]:
                 # An end line indicates the end of the file
                 if line == '//':
                     break
-            elif isinstance(line, StoFeature):
-                features.append(line)
+            elif not interleaved or (isinstance(line, StoFeature) and line.fmt in ('GF', 'GS')):
+                yield line
             elif isinstance(line, StoSequence):
-                if line.esltag in sequences:
-                    sequences[line.esltag].alnseq += line.alnseq
+                if (key := (None, line.esltag, None)) in chunks:
+                    chunks[key].append(line.alnseq)
+                else:
+                    rows[key], chunks[key] = line, [line.alnseq]
+            else:
+                if (key := (line.fmt, line.esltag, line.field)) in chunks:
+                    chunks[key].append(line.text)
                 else:
-                    sequences[line.esltag] = line
-    
+                    rows[key], chunks[key] = line, [line.text]
+        else:
+            # A truncated file, e.g. of an interrupted cmsearch
+            raise StockholmError("Unexpected end of file")
+
+    # Join the fragments of each row once all blocks have been read
+    for key, row in rows.items():
+        if isinstance(row, StoSequence):
+            row.alnseq = ''.join(chunks[key])
+        else:
+            row.text = ''.join(chunks[key])
+        yield row
+
+
+def sto_read(path: str) -> tuple[dict[str, StoSequence], list[StoFeature]]:
+    """ Parse a Stockholm file into sequences keyed by esltag and a list of features. """
+    with xopen(path) as f:
+        msa, gf, gs, gr, gc = read_sto(f)
+
+    with gc_paused():
+        sequences = {esltag: StoSequence.from_esltag(esltag, alnseq) for esltag, alnseq in msa.items()}
+        features = [StoFeature(None, field, text, 'GF') for field, text in gf]
+        features += [StoFeature(esltag, field, text, 'GS') for esltag, records in gs.items() for field, text in records]
+        features += [StoFeature(esltag, field, text, 'GR') for esltag, fields in gr.items() for field, text in fields.items()]
+        features += [StoFeature(None, field, text, 'GC') for field, text in gc.items()]
     return sequences, features
 
 
-def sto_write(sequences: dict[str, StoSequence], features: list[StoFeature], path: str):
-    """ Write a Stockholm file. """
-    width = max(len(seq.esltag) for seq in sequences)
+class StoWriter:
+    """
+    Streaming Stockholm writer. Sequences and their GR lines are spooled to a temporary
+    file as they are written, and GS lines to another, so that the file can be laid out
+    like sto_write's (GF, GS, alignment, GC) without holding the alignment in memory.
+    Features may be iosto.StoFeature or database StoFeature objects.
+    """
 
-    with open(path, 'w') as f:
-        f.write('# STOCKHOLM 1.0\n')
+    def __init__(self, path: str, width: int = 30, gf: list[StoFeature] = (), gc: list[StoFeature] = ()):
+        self.path = path
+        self.width = width
+        self.gf = list(gf)
+        self.gc = list(gc)
+        self._gs = tempfile.TemporaryFile('w+', dir=os.path.dirname(os.path.abspath(path)))
+        self._body = tempfile.TemporaryFile('w+', dir=os.path.dirname(os.path.abspath(path)))
 
-        # Write global features at the top and record other features
-        above = ""
-        below = ""
-        gr: dict[str, list[StoFeature]] = defaultdict(list)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, esltag: str, alnseq: str, features: list[StoFeature] = ()):
+        """ Write an aligned sequence along with its GS and GR features. """
+        width = self.width
+        self._body.write(f'{esltag: <{width + 8}} {alnseq}\n')
         for feat in features:
-            if feat.fmt == 'GF':
-                f.write(f'#=GF {feat.field} {feat.text}\n')
-            elif feat.fmt == 'GS':
-                above += f'#=GS {feat.esltag: <{width + 3}} {feat.field} {feat.text}\n'
-            elif feat.fmt == 'GC':
-                below += f'#=GC {feat.field: <{width + 3}} {feat.text}\n'
+            if feat.fmt == 'GS':
+                self._gs.write(f'#=GS {esltag: <{width + 3}} {feat.field} {feat.text}\n')
             elif feat.fmt == 'GR':
-                gr[feat.esltag].append(feat)
+                self._body.write(f'#=GR {esltag: <{width}} {feat.field} {feat.text}\n')
+
+    def close(self):
+        """ Assemble the spooled sections into the output file. """
+        with xopen(self.path, 'w') as f:
+            f.write('# STOCKHOLM 1.0\n')
 
-        # Write sequence features above alignment
-        f.write(above)
+            # Write global features at the top
+            for feat in self.gf:
+                f.write(f'#=GF {feat.field} {feat.text}\n')
+
+            # Write sequence features above alignment, then aligned sequences and sequence comments
+            for spool in (self._gs, self._body):
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+                spool.close()
 
-        # Write aligned sequences and sequence comments
-        for seq in sequences.values():
-            f.write(f'{seq.esltag: <{width + 8}} {seq.alnseq}\n')
-            for feat in gr[seq.esltag]:
-                f.write(f'#=GR {seq.esltag: <{width}} {feat.field} {feat.text}\n')
+            # Write global comments at the bottom
+            for feat in self.gc:
+                f.write(f'#=GC {feat.field: <{self.width + 3}} {feat.text}\n')
 
-        # Write global comments at the bottom
-        f.write(below)
+            f.write('//\n')
 
-        f.write('//\n')
 
+def sto_write(sequences: dict[str, StoSequence], features: list[StoFeature], path: str):
+    """ Write a Stockholm file. """
+    width = max(len(esltag) for esltag in sequences)
+
+    # Group sequence features by esltag
+    bytag: dict[str, list[StoFeature]] = defaultdict(list)
+    for feat in features:
+        if feat.fmt in ('GS', 'GR'):
+            bytag[feat.esltag].append(feat)
+
+    gf = [feat for feat in features if feat.fmt == 'GF']
+    gc = [feat for feat in features if feat.fmt == 'GC']
+    with StoWriter(path, width, gf=gf, gc=gc) as writer:
+        for esltag, seq in sequences.items():
+            writer.write(esltag, seq.alnseq, bytag[esltag])
@@ -0,0 +1,157 @@
+"""
+sketch.py
+
+Module for finding duplicate and near-duplicate sequences. Exact duplicates share the 64-bit
+digest of their degapped sequence (stored in Alnseq.digest); near duplicates are found by
+greedy clustering of MinHash sketches of their k-mer sets. Identical aligned sequences share
+the aln_key under which Alnseq stores them.
+"""
+
+import hashlib
+import math
+import re
+import numpy as np
+
+from jps.util.alignment import GAP_CHARS
+
+_DEGAP = str.maketrans('uU', 'TT', GAP_CHARS.decode())
+
+# 2-bit codes of nucleotides, 255 for anything else
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _i, _bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+    _CODES[[ord(b) for b in _bases]] = _i
+
+_MASK64 = (1 << 64) - 1
+
+_GAPS = dict.fromkeys(GAP_CHARS)
+_RESIDUE = re.compile(f"[^{re.escape(GAP_CHARS.decode())}]")
+
+
+def degap(alnseq: str) -> str:
+    """ Sequence of an aligned sequence, without gaps, in upper case DNA letters. """
+    return alnseq.translate(_DEGAP).upper()
+
+
+def seq_digest(seq: str) -> int:
+    """ 64-bit digest of a sequence, as a signed integer that fits an SQL BIGINT. """
+    return int.from_bytes(hashlib.blake2b(seq.encode(), digest_size=8).digest(), 'little', signed=True)
+
+
+def gap_pattern(alnseq: str) -> str:
+    """ An aligned sequence with every residue replaced by 'x', keeping its gaps. """
+    return _RESIDUE.sub('x', alnseq)
+
+
+def aln_key(alnseq: str) -> bytes:
+    """
+    128-bit content key of an aligned sequence, from its residues (as written) and its gap
+    pattern, so that equal keys mean equal alignment text.
+    """
+    residues = alnseq.translate(_GAPS)
+    return hashlib.blake2b(f"{residues}\n{gap_pattern(alnseq)}".encode(), digest_size=16).digest()
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """ splitmix64 finalizer, spreading k-mer codes over 64 bits. """
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def kmer_hashes(seq: str, k: int) -> np.ndarray:
+    """ Hashes of the distinct k-mers of seq that consist of A, C, G, T/U only. """
+    codes = _CODES[np.frombuffer(seq.encode(), dtype=np.uint8)]
+    if len(codes) < k:
+        return np.empty(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    windows = windows[(windows != 255).all(axis=1)].astype(np.uint64)
+    kmers = windows @ (np.uint64(4) ** np.arange(k - 1, -1, -1, dtype=np.uint64))
+    return _mix(np.unique(kmers))
+
+
+class MinHasher:
+    """ MinHash sketches of k-mer sets, with num_perm multiply-shift hash functions. """
+
+    def __init__(self, k: int = 9, num_perm: int = 128, seed: int = 0):
+        if not 0 < k <= 32:
+            raise ValueError("k must be between 1 and 32")
+        rng = np.random.default_rng(seed)
+        self.k = k
+        self.num_perm = num_perm
+        self.a = rng.integers(0, _MASK64, num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, _MASK64, num_perm, dtype=np.uint64, endpoint=True)
+
+    def sketch(self, seq: str) -> np.ndarray | None:
+        """ Sketch of a sequence, or None if it has no k-mers. """
+        hashes = kmer_hashes(seq, self.k)
+        if hashes.size == 0:
+            return None
+        return (self.a[:, None] * hashes[None, :] + self.b[:, None]).min(axis=1)
+
+    def identity(self, sketch1: np.ndarray, sketches: np.ndarray) -> np.ndarray:
+        """
+        Identity estimated from the Jaccard similarity of sketch1 to each of sketches, with
+        the Mash distance -ln(2J / (1 + J)) / k.
+        """
+        jaccard = (sketches == sketch1).mean(axis=-1)
+        with np.errstate(divide='ignore'):
+            distance = -np.log(2 * jaccard / (1 + jaccard)) / self.k
+        return np.clip(1 - distance, 0, 1)
+
+
+class SketchClusterer:
+    """
+    Greedy clustering of sequences in the order they are added, as in CD-HIT: each sequence
+    joins the most similar representative estimated at >= identity, or else becomes a new
+    representative. Candidate representatives come from LSH buckets over bands of rows
+    minhashes, so each addition only compares against likely matches.
+    """
+
+    def __init__(self, identity: float = 0.95, k: int = 9, num_perm: int = 128, rows: int = 2, seed: int = 0):
+        if num_perm % rows:
+            raise ValueError("num_perm must be a multiple of rows")
+        self.threshold = identity
+        self.minhash = MinHasher(k, num_perm, seed)
+        self.rows = rows
+        self.digests: dict[int, int] = {}  # Digest of each representative sequence -> cluster
+        self.sketches: list[np.ndarray] = []  # Sketch of each sketchable representative...
+        self.clusters: list[int] = []  # ...and its cluster
+        self.buckets: list[dict[bytes, list[int]]] = [{} for _ in range(num_perm // rows)]
+        self.nclusters = 0
+
+    def add(self, seq: str) -> tuple[int, bool]:
+        """ Add a degapped sequence, returning its cluster and whether it started it. """
+        digest = seq_digest(seq)
+        if (cluster := self.digests.get(digest)) is not None:
+            return cluster, False
+
+        sketch = self.minhash.sketch(seq)
+        bands = None
+        if sketch is not None:
+            bands = [sketch[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(len(self.buckets))]
+            candidates = sorted({j for bucket, band in zip(self.buckets, bands) for j in bucket.get(band, ())})
+            if candidates:
+                identities = self.minhash.identity(sketch, np.stack([self.sketches[j] for j in candidates]))
+                best = int(np.argmax(identities))
+                if identities[best] >= self.threshold:
+                    return self.clusters[candidates[best]], False
+
+        # Start a new cluster
+        cluster = self.nclusters
+        self.nclusters += 1
+        self.digests[digest] = cluster
+        if sketch is not None:
+            j = len(self.sketches)
+            self.sketches.append(sketch)
+            self.clusters.append(cluster)
+            for bucket, band in zip(self.buckets, bands):
+                bucket.setdefault(band, []).append(j)
+        return cluster, True
+
+
+def cluster(seqs: list[str], identity: float = 0.95, **kwargs) -> list[int]:
+    """ Cluster of each degapped sequence, clustering greedily in the given order. """
+    clusterer = SketchClusterer(identity, **kwargs)
+    return [clusterer.add(seq)[0] for seq in seqs]
@@ -0,0 +1,163 @@
+"""
+stocache.py
+
+Module for caching parsed Stockholm alignments in a compact binary form, so that repeated
+analyses of the same file skip re-parsing its text.
+
+Each entry is an uncompressed .npz file holding the packed residue matrix, GC/GR rows, and
+an offsets table over concatenated names and feature texts.
+"""
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+from config import *
+from cgk.interval import ChrInterval
+from cgk.iosto import gc_paused
+from jps.util.alignment import StoAlignment
+from jps.util.iosto import StoFeature
+from jps.util.compress import resolve
+
+FEATURE_FMTS = ['GF', 'GS']
+STRANDS = [None, '+', '-', '.']
+
+
+def _pack(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """ Concatenate strings into a byte array plus an offsets table. """
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack(blob: np.ndarray, offsets: np.ndarray) -> list[str]:
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[a:b].decode() for a, b in zip(bounds, bounds[1:])]
+
+
+def file_digest(path: str) -> str:
+    """ Digest of a file's content. """
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(path: str, digest: bool = False) -> str:
+    """
+    Cache key of a Stockholm file. By default the key is derived from the file's path, size,
+    and mtime. With digest=True it is derived from the file's content instead, so entries
+    survive touches and copies at the cost of reading the file once per lookup.
+    """
+    path = resolve(path)
+    if digest:
+        return file_digest(path)
+    stat = os.stat(path)
+    ident = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.blake2b(ident.encode(), digest_size=20).hexdigest()
+
+
+def save(aln: StoAlignment, cachepath: str):
+    """ Write an alignment to a cache entry, atomically. """
+    gc_fields = list(aln.gc)
+    gr_keys = list(aln.gr)
+    rowof = {esltag: i for i, esltag in enumerate(aln.esltags)}
+
+    names, names_off = _pack(aln.esltags)
+    chraccns, chraccns_off = _pack([iv.chraccn for iv in aln.intervals])
+    gc_names, gc_names_off = _pack(gc_fields)
+    gr_names, gr_names_off = _pack([f for _, f in gr_keys])
+    feat_fields, feat_fields_off = _pack([feat.field for feat in aln.features])
+    feat_texts, feat_texts_off = _pack([feat.text for feat in aln.features])
+
+    arrays = dict(
+        residues=aln.residues,
+        names=names, names_off=names_off,
+        chraccns=chraccns, chraccns_off=chraccns_off,
+        starts=np.array([iv.start for iv in aln.intervals], dtype=np.int64),
+        ends=np.array([iv.end for iv in aln.intervals], dtype=np.int64),
+        strands=np.array([STRANDS.index(iv.strand) for iv in aln.intervals], dtype=np.int8),
+        gc=np.array([aln.gc[f] for f in gc_fields], dtype=np.uint8).reshape(len(gc_fields), aln.ncols),
+        gc_names=gc_names, gc_names_off=gc_names_off,
+        gr=np.array([aln.gr[k] for k in gr_keys], dtype=np.uint8).reshape(len(gr_keys), aln.ncols),
+        gr_rows=np.array([rowof[esltag] for esltag, _ in gr_keys], dtype=np.int64),
+        gr_names=gr_names, gr_names_off=gr_names_off,
+        feat_fmts=np.array([FEATURE_FMTS.index(feat.fmt) for feat in aln.features], dtype=np.uint8),
+        feat_rows=np.array([rowof.get(feat.esltag, -1) for feat in aln.features], dtype=np.int64),
+        feat_fields=feat_fields, feat_fields_off=feat_fields_off,
+        feat_texts=feat_texts, feat_texts_off=feat_texts_off,
+    )
+
+    os.makedirs(os.path.dirname(cachepath), exist_ok=True)
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(cachepath), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmppath, cachepath)
+
+
+def load(cachepath: str) -> StoAlignment:
+    """ Read an alignment from a cache entry. """
+    with gc_paused(), np.load(cachepath) as data:
+        esltags = _unpack(data['names'], data['names_off'])
+        chraccns = _unpack(data['chraccns'], data['chraccns_off'])
+        gc_fields = _unpack(data['gc_names'], data['gc_names_off'])
+        gr_fields = _unpack(data['gr_names'], data['gr_names_off'])
+        feat_fields = _unpack(data['feat_fields'], data['feat_fields_off'])
+        feat_texts = _unpack(data['feat_texts'], data['feat_texts_off'])
+        gc, gr = data['gc'], data['gr']
+
+        return StoAlignment(
+            residues=data['residues'],
+            esltags=esltags,
+            intervals=[
+                ChrInterval(chraccn, start, end, STRANDS[strand])
+                for chraccn, start, end, strand in zip(
+                    chraccns, data['starts'].tolist(), data['ends'].tolist(), data['strands'].tolist())
+            ],
+            gc={f: row for f, row in zip(gc_fields, gc)},
+            gr={(esltags[i], f): row for i, f, row in zip(data['gr_rows'].tolist(), gr_fields, gr)},
+            features=[
+                StoFeature(esltag=esltags[i] if i >= 0 else None, field=field, text=text, fmt=FEATURE_FMTS[fmt])
+                for fmt, i, field, text in zip(data['feat_fmts'].tolist(), data['feat_rows'].tolist(), feat_fields, feat_texts)
+            ],
+        )
+
+
+def evict(cachedir: str = STO_CACHE_DIR, maxbytes: int = STO_CACHE_MAXBYTES):
+    """ Remove the least recently used entries until the cache fits in maxbytes. """
+    entries = []
+    for entry in os.scandir(cachedir):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= maxbytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Evicted concurrently
+        total -= size
+
+
+def load_alignment(path: str, digest: bool = False,
+                   cachedir: str = STO_CACHE_DIR, maxbytes: int = STO_CACHE_MAXBYTES) -> StoAlignment:
+    """
+    Load a Stockholm file as a StoAlignment, from the cache when possible. On a miss the
+    file is parsed, stored, and the cache is trimmed to maxbytes.
+    """
+    cachepath = os.path.join(cachedir, f"{cache_key(path, digest)}.npz")
+    if os.path.exists(cachepath):
+        os.utime(cachepath)  # Mark as recently used
+        return load(cachepath)
+
+    aln = StoAlignment.from_file(path)
+    save(aln, cachepath)
+    evict(cachedir, maxbytes)
+    return aln
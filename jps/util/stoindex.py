@@ -0,0 +1,223 @@
+"""
+stoindex.py
+
+Module for random access into large Stockholm files through a sidecar byte-offset index.
+"""
+
+from dataclasses import dataclass
+import json
+import mmap
+import os
+import re
+
+from jps.util.bgzf import BgzfReader
+from jps.util.iosto import StockholmError, StoSequence
+from jps.util.compress import iscompressed, resolve, xopen
+
+# Index rows are keyed by esltag for sequences, and by the line prefix for GC/GR lines:
+#   <esltag>
+#   #=GC <field>
+#   #=GR <esltag> <field>
+
+# Leading part of each block line, up to the start of its aligned text
+_SEQ_RE = re.compile(rb'(\S+)[ \t]+')
+_GC_RE = re.compile(rb'#=GC[ \t]+(\S+)[ \t]+')
+_GR_RE = re.compile(rb'#=GR[ \t]+(\S+)[ \t]+(\S+)[ \t]+')
+
+
+def gc_key(field: str):
+    return f'#=GC {field}'
+
+
+def gr_key(esltag: str, field: str):
+    return f'#=GR {esltag} {field}'
+
+
+@dataclass
+class StoIndex:
+    """ Byte ranges of the fragments of every alignment row in a Stockholm file. """
+    size: int
+    mtime: int
+    ncols: int
+    blocks: list[int]  # Starting column of each block
+    rows: dict[str, list[tuple[int, int]]]  # Row key -> (offset, length) of its fragment in each block
+
+    def isstale(self, path: str):
+        """ Whether the indexed file has changed since the index was built. """
+        stat = os.stat(path)
+        return stat.st_size != self.size or stat.st_mtime_ns != self.mtime
+
+    @staticmethod
+    def build(path: str) -> 'StoIndex':
+        """ Index a Stockholm file in a single pass over its lines. """
+        stat = os.stat(path)
+        rows: dict[str, list[tuple[int, int]]] = {}
+        blocks: list[int] = []
+        ncols = 0
+        in_block = False
+
+        with xopen(path, 'rb') as f:
+            if f.readline() != b'# STOCKHOLM 1.0\n':
+                raise StockholmError("Invalid Stockholm header")
+
+            offset = f.tell()
+            for i, line in enumerate(f, 2):
+                pos, offset = offset, offset + len(line)
+
+                if line.startswith(b'//'):
+                    break
+                elif line.isspace():  # An empty line ends a block
+                    in_block = False
+                    continue
+                elif line.startswith(b'#=GC'):
+                    if m := _GC_RE.match(line):
+                        key = gc_key(m[1].decode())
+                elif line.startswith(b'#=GR'):
+                    if m := _GR_RE.match(line):
+                        key = gr_key(m[1].decode(), m[2].decode())
+                elif line.startswith(b'#'):  # GF, GS, and comment lines are not indexed
+                    continue
+                elif m := _SEQ_RE.match(line):
+                    key = m[1].decode()
+
+                if m is None:
+                    raise StockholmError(f"Invalid Stockholm line at line {i}: {line}")
+
+                length = len(line.rstrip()) - m.end()
+                if not in_block:
+                    # The first row of a block sets the block's width
+                    in_block = True
+                    blocks.append(ncols)
+                    ncols += length
+                rows.setdefault(key, []).append((pos + m.end(), length))
+
+        if any(len(frags) != len(blocks) for frags in rows.values()):
+            raise StockholmError("Unexpected block order")
+
+        return StoIndex(size=stat.st_size, mtime=stat.st_mtime_ns, ncols=ncols, blocks=blocks, rows=rows)
+
+    @staticmethod
+    def load(path: str) -> 'StoIndex':
+        with open(path) as f:
+            data = json.load(f)
+        data['rows'] = {key: [tuple(frag) for frag in frags] for key, frags in data['rows'].items()}
+        return StoIndex(**data)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.__dict__, f)
+
+
+def stoindex(path: str) -> StoIndex:
+    """
+    Return the index of a Stockholm file, stored in a sidecar <path>.idx file.
+    The index is rebuilt whenever the file's size or mtime no longer match.
+    Offsets in the index of a compressed file refer to its decompressed content, so building
+    it decompresses the whole file once, streaming.
+    """
+    path = resolve(path)
+    idxpath = f"{path}.idx"
+    if os.path.exists(idxpath):
+        index = StoIndex.load(idxpath)
+        if not index.isstale(path):
+            return index
+
+    index = StoIndex.build(path)
+    try:
+        index.save(idxpath)
+    except OSError:
+        pass  # Read-only directory, use the index without caching it
+    return index
+
+
+class StoReader:
+    """
+    Random-access reader for a Stockholm file. Fetches chosen rows, or windows of
+    columns, straight from a memory map of the file without parsing it. BGZF files with a
+    .gzi index (as written by `jps compress`) are read a block at a time through a
+    BgzfReader; other compressed files have no restart points, so they are decompressed
+    into memory whole. Indexed random access thus needs uncompressed or BGZF input.
+    """
+
+    def __init__(self, path: str):
+        self.path = resolve(path)
+        self.index = stoindex(self.path)
+        self._file = self._bgzf = None
+        if os.path.exists(self.path + '.gzi'):
+            self._bgzf = BgzfReader(self.path)
+        elif iscompressed(self.path):
+            with xopen(self.path, 'rb') as f:
+                self._mm = f.read()
+        else:
+            self._file = open(self.path, 'rb')
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.esltags)
+
+    def close(self):
+        if self._bgzf is not None:
+            self._bgzf.close()
+        if self._file is not None:
+            self._mm.close()
+            self._file.close()
+
+    def _read(self, offset: int, size: int) -> bytes:
+        """ size bytes at offset of the (decompressed) file. """
+        if self._bgzf is not None:
+            return self._bgzf.read(offset, size)
+        return self._mm[offset:offset + size]
+
+    @property
+    def ncols(self):
+        return self.index.ncols
+
+    @property
+    def esltags(self) -> list[str]:
+        """ Sequence esltags in alignment order. """
+        return [key for key in self.index.rows if not key.startswith('#=')]
+
+    @property
+    def gc_fields(self) -> list[str]:
+        """ Fields of the #=GC lines, e.g. SS_cons and RF. """
+        return [key[len('#=GC '):] for key in self.index.rows if key.startswith('#=GC ')]
+
+    def _fetch(self, key: str, start: int = 0, stop: int = None) -> str:
+        """ Read columns [start, stop) of an indexed row. """
+        if key not in self.index.rows:
+            raise KeyError(key)
+        stop = self.ncols if stop is None else min(stop, self.ncols)
+
+        chunks = []
+        for col, (offset, length) in zip(self.index.blocks, self.index.rows[key]):
+            if col >= stop:
+                break
+            lo, hi = max(start - col, 0), min(stop - col, length)
+            if lo < hi:
+                chunks.append(self._read(offset + lo, hi - lo))
+        return b''.join(chunks).decode()
+
+    def fetch(self, esltag: str, start: int = 0, stop: int = None) -> str:
+        """ Aligned sequence of esltag, optionally limited to columns [start, stop). """
+        return self._fetch(esltag, start, stop)
+
+    def gc(self, field: str, start: int = 0, stop: int = None) -> str:
+        """ Text of a #=GC line, e.g. SS_cons, optionally limited to columns [start, stop). """
+        return self._fetch(gc_key(field), start, stop)
+
+    def gr(self, esltag: str, field: str, start: int = 0, stop: int = None) -> str:
+        """ Text of a #=GR line, optionally limited to columns [start, stop). """
+        return self._fetch(gr_key(esltag, field), start, stop)
+
+    def sequences(self, esltags: list[str], start: int = 0, stop: int = None) -> dict[str, StoSequence]:
+        """ Fetch several sequences by esltag. """
+        return {
+            esltag: StoSequence.from_esltag(esltag, self.fetch(esltag, start, stop))
+            for esltag in esltags
+        }
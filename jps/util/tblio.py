@@ -4,33 +4,254 @@ tblio.py
 This module contains classes for parsing and working with tables.
 """
 from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Iterator, Sequence
+import os
+import tempfile
+import numpy as np
+
+from jps.util.compress import xopen
 
 
 class TableError(Exception):
     """ Errors related to table file formatting. """
 
 
-def tbl_read(path: str, headers: list[str]) -> list[list[str]]:
-    with open(path) as f:
+# Column names and types of a cmsearch --tblout table
+CMSEARCH_SCHEMA = [
+    ('target_name', object), ('target_accession', object), ('query_name', object), ('query_accession', object),
+    ('mdl', object), ('mdl_from', np.int64), ('mdl_to', np.int64), ('seq_from', np.int64), ('seq_to', np.int64),
+    ('strand', object), ('trunc', object), ('pass_', np.int64), ('gc', np.float64), ('bias', np.float64),
+    ('score', np.float64), ('E_value', np.float64), ('inc', object), ('description_of_target', object),
+]
+CMSEARCH_TBLHEADERS = [name for name, _ in CMSEARCH_SCHEMA]
+
+
+@dataclass
+class TblFilter:
+    """
+    Row predicates applied while a table is scanned. Only the leading columns the predicates
+    need are split out of each line, so rejected rows never become row objects.
+    Column names default to those of a cmsearch table.
+    """
+    evalue_max: float = None
+    score_min: float = None
+    strand: str = None
+    targets: set[str] = None
+
+    evalue_col: str = 'E_value'
+    score_col: str = 'score'
+    strand_col: str = 'strand'
+    target_col: str = 'target_name'
+
+    def compile(self, headers: list[str]) -> Callable[[str], bool]:
+        """ Build a predicate on raw table lines with the given headers. """
+        checks = []
+        if self.targets is not None:
+            targets = frozenset(self.targets)
+            checks.append((headers.index(self.target_col), targets.__contains__))
+        if self.strand is not None:
+            checks.append((headers.index(self.strand_col), self.strand.__eq__))
+        if self.evalue_max is not None:
+            evalue_max = self.evalue_max
+            checks.append((headers.index(self.evalue_col), lambda v: float(v) <= evalue_max))
+        if self.score_min is not None:
+            score_min = self.score_min
+            checks.append((headers.index(self.score_col), lambda v: float(v) >= score_min))
+
+        if not checks:
+            return lambda line: True
+        last = max(i for i, _ in checks)
+
+        def match(line: str) -> bool:
+            values = line.split(maxsplit=last + 1)
+            if len(values) <= last:
+                return True  # Let the full split report the malformed line
+            return all(test(values[i]) for i, test in checks)
+        return match
+
+
+def tbl_read(path: str, headers: list[str], where: TblFilter = None) -> list[list[str]]:
+    """ Read a table's rows as lists of strings, keeping only rows that pass where (if given). """
+    match = where.compile(headers) if where is not None else None
+    with xopen(path) as f:
         for i, line in enumerate(f):
             if line.startswith('#'): continue  # Skip comments
+            if match is not None and not match(line): continue
 
             # Split line into values
-            row = line.split(maxsplit=len(headers)-1)
+            row = line.rstrip().split(maxsplit=len(headers)-1)
             if len(row) != len(headers):
                 raise TableError(f"Expected {len(headers)} columns, got {len(row)} at line {i}")
             yield row
 
 
-def tbl_write(headers: list[str], rows: list[list[str]], path: str):
-    colwidths = {
-        h: max(
-            len(h) + (1 if i == 0 else 0),  # Add 1 to first column for # symbol
-            *(len(str(getattr(row, h))) for row in rows)
-            )
-        for i, h in enumerate(headers)}
-    with open(path, 'w') as f:
-        f.write(' '.join(f'{("#" + h if i == 0 else h): <{colwidths[h]}}' for i, h in enumerate(headers)) + "\n")
+@dataclass
+class TblColumn:
+    """ Layout of a table column. """
+    name: str
+    header: str = None  # Defaults to name
+    width: int = 0  # Minimum width
+    align: str = '<'  # '<' or '>'
+    spec: str = ''  # Format spec of values, e.g. '.2g'
+    grow: bool = True  # Widen to fit the longest value; otherwise long values overflow, as in printf
+
+    def __post_init__(self):
+        if self.header is None:
+            self.header = self.name
+
+    def justify(self, text: str, width: int) -> str:
+        return text.ljust(width) if self.align == '<' else text.rjust(width)
+
+
+def cmsearch_tblout_columns(tnamew: int = None, taccw: int = None, qnamew: int = None, qaccw: int = None,
+                            posw: int = None) -> list[TblColumn]:
+    """
+    Columns of Infernal's cmsearch --tblout layout, for rows with CMSEARCH_TBLHEADERS values.
+    Name, accession and position widths grow to fit, as Infernal computes them, unless given.
+    """
+    def w(width, minimum):
+        return dict(width=width or minimum, grow=width is None)
+    return [
+        TblColumn('target_name', 'target name', **w(tnamew, 20)),
+        TblColumn('target_accession', 'accession', **w(taccw, 9)),
+        TblColumn('query_name', 'query name', **w(qnamew, 20)),
+        TblColumn('query_accession', 'accession', **w(qaccw, 9)),
+        TblColumn('mdl', 'mdl', 3, '>', grow=False),
+        TblColumn('mdl_from', 'mdl from', 8, '>', 'd', grow=False),
+        TblColumn('mdl_to', 'mdl to', 8, '>', 'd', grow=False),
+        TblColumn('seq_from', 'seq from', align='>', spec='d', **w(posw, 8)),
+        TblColumn('seq_to', 'seq to', align='>', spec='d', **w(posw, 8)),
+        TblColumn('strand', 'strand', 6, '>', grow=False),
+        TblColumn('trunc', 'trunc', 5, '>', grow=False),
+        TblColumn('pass_', 'pass', 4, '>', 'd', grow=False),
+        TblColumn('gc', 'gc', 4, '>', '.2f', grow=False),
+        TblColumn('bias', 'bias', 5, '>', '.1f', grow=False),
+        TblColumn('score', 'score', 6, '>', '.1f', grow=False),
+        TblColumn('E_value', 'E-value', 9, '>', '.2g', grow=False),
+        TblColumn('inc', 'inc', 3, '<', grow=False),
+        TblColumn('description_of_target', 'description of target', grow=False),
+    ]
+
+
+class TblWriter:
+    """
+    Streaming table writer. Rows are sequences of values in column order. When every column
+    has a fixed width, rows go straight to the file; otherwise formatted cells are spooled to
+    a temporary file while column widths are measured, and laid out on close. Either way,
+    memory use does not depend on the number of rows.
+
+    With pad_last=False the last column is left unpadded, and with rule=True a line of dashes
+    follows the header, as in Infernal's --tblout tables. footer is written verbatim at the end.
+    """
+    SEP = '\x1f'
+
+    def __init__(self, path: str, columns: list[TblColumn], pad_last: bool = True, rule: bool = False,
+                 footer: str = ''):
+        self.path = path
+        self.columns = columns
+        self.pad_last = pad_last
+        self.rule = rule
+        self.footer = footer
+        # Header widths are part of the minimum widths; the first header is prefixed with '#'
+        self.widths = [max(col.width, len(col.header) + (i == 0)) for i, col in enumerate(columns)]
+        if not pad_last:
+            self.widths[-1] = 0
+        self._grow = [i for i, col in enumerate(columns[:len(columns) - (not pad_last)]) if col.grow]
+
+        if self._grow:
+            self._spool = tempfile.TemporaryFile('w+', dir=os.path.dirname(os.path.abspath(path)))
+            self._file = None
+        else:
+            self._spool = None
+            self._file = xopen(path, 'w')
+            self._write_header(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row: Sequence):
+        """ Write a row of values in column order. """
+        cells = [format(value, col.spec) for col, value in zip(self.columns, row)]
+        if self._spool is not None:
+            widths = self.widths
+            for i in self._grow:
+                if len(cells[i]) > widths[i]:
+                    widths[i] = len(cells[i])
+            self._spool.write(self.SEP.join(cells) + '\n')
+        else:
+            self._file.write(self._line(cells))
+
+    def _line(self, cells: list[str]) -> str:
+        line = ' '.join(col.justify(cell, width) for col, cell, width in zip(self.columns, cells, self.widths))
+        return line + '\n'
+
+    def _write_header(self, f):
+        headers = [col.header for col in self.columns]
+        cells = [self.columns[0].justify(headers[0], self.widths[0] - 1)]
+        cells += [col.justify(h, w) for col, h, w in zip(self.columns[1:], headers[1:], self.widths[1:])]
+        f.write('#' + ' '.join(cells) + '\n')
+        if self.rule:
+            dashes = [w or len(h) for h, w in zip(headers, self.widths)]
+            f.write('#' + ' '.join(['-' * (dashes[0] - 1)] + ['-' * n for n in dashes[1:]]) + '\n')
+
+    def close(self):
+        """ Finish the file, laying out spooled rows with their final column widths. """
+        if self._spool is not None:
+            with xopen(self.path, 'w') as f:
+                self._write_header(f)
+                self._spool.seek(0)
+                for line in self._spool:
+                    f.write(self._line(line[:-1].split(self.SEP)))
+                f.write(self.footer)
+            self._spool.close()
+            self._spool = None
+        elif self._file is not None:
+            self._file.write(self.footer)
+            self._file.close()
+            self._file = None
+
+
+def tbl_write(headers: list[str], rows: list, path: str):
+    """ Write the named attributes of rows to a table with left-aligned columns. """
+    with TblWriter(path, [TblColumn(h) for h in headers]) as writer:
         for row in rows:
-            f.write(' '.join([f"{getattr(row, h):<{colwidths[h]}}" for h in headers]) + "\n")
+            writer.write([str(getattr(row, h)) for h in headers])
+
+
+def _tbl_columns(rows: list[list[str]], schema: list[tuple[str, type]]) -> np.ndarray:
+    """ Convert split rows into a structured array, one vectorized cast per column. """
+    table = np.empty(len(rows), dtype=schema)
+    if rows:
+        for (name, dtype), col in zip(schema, zip(*rows)):
+            table[name] = np.array(col, dtype=dtype)
+    return table
+
+
+def tbl_iter_typed(path: str, schema: list[tuple[str, type]] = CMSEARCH_SCHEMA,
+                   chunksize: int = 100000, where: TblFilter = None) -> Iterator[np.ndarray]:
+    """ Read a table in chunks of up to chunksize rows, each a structured array typed by schema. """
+    rows = tbl_read(path, headers=[name for name, _ in schema], where=where)
+    while chunk := list(islice(rows, chunksize)):
+        try:
+            yield _tbl_columns(chunk, schema)
+        except ValueError as e:
+            raise TableError(f"Invalid value in {path}: {e}") from None
+
 
+def tbl_read_typed(path: str, schema: list[tuple[str, type]] = CMSEARCH_SCHEMA, frame: bool = False,
+                   where: TblFilter = None):
+    """
+    Read a whole table into a structured array typed by schema, with numeric columns
+    parsed straight into typed arrays. With frame=True, return a pandas DataFrame.
+    Rows rejected by where are skipped before they are split or cast.
+    """
+    chunks = list(tbl_iter_typed(path, schema, where=where))
+    table = np.concatenate(chunks) if chunks else np.empty(0, dtype=schema)
+    if frame:
+        import pandas
+        return pandas.DataFrame({name: table[name] for name, _ in schema})
+    return table
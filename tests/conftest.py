@@ -0,0 +1,62 @@
+"""
+conftest.py
+
+Shared fixtures. The database is pointed at a scratch file before jps.models is first imported,
+so tests never touch data.sqlite.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import pytest
+
+os.environ['JPS_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='jps-test-'), 'test.sqlite')}"
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+SEARCH = os.path.join(DATA, 'search', 'search.out')  # A search of 5 hits, 4 of them in its alignment
+STO = f"{SEARCH}.sto"
+TBL = f"{SEARCH}.tbl"
+
+
+@pytest.fixture
+def session():
+    """ A session on the emptied test database. """
+    from sqlalchemy import delete
+    from jps.models import Base, SessionLocal, hit_rtree
+    with SessionLocal() as session:
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(delete(table))
+        session.execute(delete(hit_rtree))
+        session.commit()
+        yield session
+
+
+@pytest.fixture
+def searches_dir(tmp_path) -> str:
+    """ A searches directory holding a copy of the fixture search. """
+    shutil.copytree(os.path.dirname(SEARCH), tmp_path / 'search')
+    return str(tmp_path)
+
+
+@pytest.fixture
+def search(session):
+    """ The fixture search, parsed into the emptied test database. """
+    from sqlalchemy import select
+    from jps.models import Search
+    from jps.routes import cmsearch_parse
+    cmsearch_parse(Search(cm='search.cm', source=SEARCH))
+    return session.scalars(select(Search).where(Search.source == SEARCH)).one()
+
+
+@pytest.fixture
+def genome(tmp_path) -> tuple[str, dict[str, str]]:
+    """ A FASTA file of random contigs in 60-nt lines, and the sequence of each contig. """
+    rng = random.Random(0)
+    contigs = {f"contig{i}": ''.join(rng.choice('ACGT') for _ in range(rng.randint(50, 5000))) for i in range(5)}
+    path = str(tmp_path / 'genome.fna')
+    with open(path, 'w') as f:
+        for name, seq in contigs.items():
+            f.write(f">{name} description of {name}\n")
+            f.writelines(f"{seq[i:i + 60]}\n" for i in range(0, len(seq), 60))
+    return path, contigs
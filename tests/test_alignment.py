@@ -0,0 +1,72 @@
+"""
+Tests of StoAlignment: conversion to and from parsed Stockholm files, slicing, and column statistics.
+"""
+
+import numpy as np
+import pytest
+
+from jps.util.alignment import StoAlignment
+from jps.util.iosto import StockholmError, StoSequence, sto_read
+
+from conftest import STO
+
+
+def key(feat):
+    return feat.fmt, feat.esltag, feat.field, feat.text
+
+
+def test_roundtrip():
+    sequences, features = sto_read(STO)
+    aln = StoAlignment.from_sto(sequences, features)
+    assert aln.shape == (4, 22)
+    assert aln.esltags == list(sequences)
+
+    sequences2, features2 = aln.to_sto()
+    assert sequences2 == sequences
+    assert sorted(map(key, features2)) == sorted(map(key, features))
+
+
+def test_slice():
+    aln = StoAlignment.from_file(STO)
+    window = aln[1:3, 10:20]
+    assert window.shape == (2, 10)
+    assert np.shares_memory(window.residues, aln.residues)
+    assert window.esltags == aln.esltags[1:3]
+    assert set(window.gc) == {'SS_cons', 'RF'}
+    assert all(len(text) == 10 for text in window.gc.values())
+    # Only the GR lines and GS features of the selected rows are kept
+    assert [esltag for esltag, f in window.gr] == ['NZ_JACHZX010000001.1/978422-978477']
+    assert {feat.esltag for feat in window.features} == {None, *window.esltags}
+
+    sequences, features = window.to_sto()
+    full, _ = sto_read(STO)
+    for esltag, seq in sequences.items():
+        assert seq.alnseq == full[esltag].alnseq[10:20]
+
+    assert aln[0].esltags == aln.esltags[:1]
+    assert aln[:, -1].shape == (4, 1)
+
+
+def test_column_statistics():
+    sequences = {
+        'a/1-4': StoSequence.from_esltag('a/1-4', 'AC-u'),
+        'b/1-4': StoSequence.from_esltag('b/1-4', 'AG.u'),
+        'c/1-4': StoSequence.from_esltag('c/1-4', 'AGa-'),
+        'd/1-4': StoSequence.from_esltag('d/1-4', 'UG-~'),
+    }
+    aln = StoAlignment.from_sto(sequences, [])
+    np.testing.assert_allclose(aln.gap_fraction(), [0, 0, 0.75, 0.5])
+    np.testing.assert_allclose(aln.frequencies()[:, 3], [0, 0, 0, 0.5])  # A, C, G, U
+    np.testing.assert_allclose(aln.conservation(), [0.75, 0.75, 1, 1])
+
+    # All-gap columns have no conservation
+    assert aln[1:2, 2:3].conservation().tolist() == [0]
+
+
+def test_unexpected_seqlen():
+    sequences = {
+        'a/1-4': StoSequence.from_esltag('a/1-4', 'ACGU'),
+        'b/1-3': StoSequence.from_esltag('b/1-3', 'ACG'),
+    }
+    with pytest.raises(StockholmError):
+        StoAlignment.from_sto(sequences, [])
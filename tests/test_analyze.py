@@ -0,0 +1,72 @@
+"""
+Tests of search comparison: overlap_join and the E-value threshold sweeps agree with brute force.
+"""
+
+import random
+import numpy as np
+import pytest
+
+from cgk.interval import ChrInterval
+from jps.analyze import Comparison, compare, hit_intervals, overlap_join
+from jps.util.intervalarray import ChrIntervalArray
+
+
+def random_intervals(rng: random.Random, n: int) -> list[ChrInterval]:
+    intervals = []
+    for _ in range(n):
+        start = rng.randint(1, 2000)
+        intervals.append(ChrInterval(rng.choice(['chr1', 'chr2', 'chr3']), start, start + rng.randint(0, 100), rng.choice('+-')))
+    return intervals
+
+
+def brute_join(a: list[ChrInterval], b: list[ChrInterval]) -> list[tuple[int, int]]:
+    return sorted((i, j) for i, p in enumerate(a) for j, q in enumerate(b)
+                  if p.chraccn == q.chraccn and p.overlaps(q))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_overlap_join(seed):
+    rng = random.Random(seed)
+    a, b = random_intervals(rng, rng.randint(0, 300)), random_intervals(rng, rng.randint(0, 300))
+    # Intervals sharing a start or an end with the other side are joined too
+    a += [ChrInterval('chr4', 10, 20, '+'), ChrInterval('chr4', 30, 40, '+')]
+    b += [ChrInterval('chr4', 10, 15, '-'), ChrInterval('chr4', 20, 30, '+')]
+
+    pairs1, pairs2 = overlap_join(ChrIntervalArray.from_intervals(a), ChrIntervalArray.from_intervals(b))
+    assert sorted(zip(pairs1.tolist(), pairs2.tolist())) == brute_join(a, b)
+
+
+def test_comparison_sweep():
+    rng = random.Random(0)
+    a, b = random_intervals(rng, 300), random_intervals(rng, 300)
+    evalues1 = np.array([10 ** rng.uniform(-10, 3) for _ in a])
+    evalues2 = np.array([10 ** rng.uniform(-10, 3) for _ in b])
+    pairs1, pairs2 = overlap_join(ChrIntervalArray.from_intervals(a), ChrIntervalArray.from_intervals(b))
+    cmp = Comparison(evalues1, evalues2, pairs1, pairs2)
+    pairs = brute_join(a, b)
+
+    thresholds = [1e-6, 1e-3, 1, 1000]
+    for threshold in thresholds:
+        assert cmp.sweep1(threshold, thresholds).tolist() == [
+            sum(1 for i in range(len(a)) if evalues1[i] <= threshold and
+                any(evalues2[j] <= t for i2, j in pairs if i2 == i))
+            for t in thresholds]
+        assert cmp.sweep2(threshold, thresholds).tolist() == [
+            sum(1 for j in range(len(b)) if evalues2[j] <= threshold and
+                any(evalues1[i] <= t for i, j2 in pairs if j2 == j))
+            for t in thresholds]
+
+
+def test_compare(search, session):
+    intervals, evalues = hit_intervals(session, search)
+    assert len(intervals) == 5
+    assert evalues.tolist() == [4.5e-07, 3e-06, 3.2e-06, 3.7e-06, 4.7e-06]
+
+    # Rank 2 has the same sequence as rank 1
+    intervals, evalues = hit_intervals(session, search, unique=True)
+    assert evalues.tolist() == [4.5e-07, 3e-06, 3.7e-06, 4.7e-06]
+
+    # Every hit overlaps itself, and no other
+    cmp = compare(search, search, unique=True)
+    assert sorted(zip(cmp.pairs1.tolist(), cmp.pairs2.tolist())) == [(i, i) for i in range(4)]
+    assert cmp.sweep1(1, [1e-6, 3.5e-6, 1]).tolist() == [1, 2, 4]
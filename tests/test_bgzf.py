@@ -0,0 +1,120 @@
+"""
+Tests of BGZF random access: reads at any offset match the uncompressed data, and BgzfFasta
+matches pyfaidx.
+"""
+
+import gzip
+import os
+import random
+import shutil
+import pytest
+from pyfaidx import Fasta
+
+from jps.util.bgzf import BLOCK_SIZE, BgzfFasta, BgzfReader, BgzfWriter, bgzf_compress, open_genome
+
+
+@pytest.fixture
+def data() -> bytes:
+    rng = random.Random(0)
+    return bytes(rng.choice(b'ACGT\n') for _ in range(3 * BLOCK_SIZE + 1234))
+
+
+def test_bgzf_writer(tmp_path, data):
+    path = str(tmp_path / 'data.gz')
+    with BgzfWriter(path) as writer:
+        for i in range(0, len(data), 10000):
+            writer.write(data[i:i + 10000])
+        assert writer.tell() == len(data)
+    assert not os.path.exists(path + '.tmp')
+
+    # Plain gzip readers see the concatenated blocks
+    with gzip.open(path, 'rb') as f:
+        assert f.read() == data
+
+    # The .gzi index lists the blocks after the first
+    with BgzfReader(path) as reader:
+        assert reader.uoffsets == [0, BLOCK_SIZE, 2 * BLOCK_SIZE, 3 * BLOCK_SIZE]
+
+
+@pytest.mark.parametrize('size', [BLOCK_SIZE, 2 * BLOCK_SIZE])
+def test_bgzf_writer_block_boundary(tmp_path, size):
+    # Data ending on a block boundary has no empty last block
+    path = str(tmp_path / 'data.gz')
+    with BgzfWriter(path) as writer:
+        writer.write(b'A' * size)
+    with BgzfReader(path) as reader:
+        assert reader.uoffsets[-1] < size
+        assert reader.read(0, size + 10) == b'A' * size
+
+
+def test_bgzf_writer_error(tmp_path):
+    path = str(tmp_path / 'data.gz')
+    with pytest.raises(RuntimeError):
+        with BgzfWriter(path) as writer:
+            writer.write(b'ACGT')
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
+
+
+def test_bgzf_reader(tmp_path, data):
+    path = str(tmp_path / 'data.gz')
+    with BgzfWriter(path) as writer:
+        writer.write(data)
+
+    rng = random.Random(1)
+    reads = [(0, 10), (BLOCK_SIZE - 5, 10), (BLOCK_SIZE, 1), (10, 2 * BLOCK_SIZE), (len(data) - 3, 100)]
+    reads += [(rng.randrange(len(data)), rng.randint(0, 3 * BLOCK_SIZE)) for _ in range(50)]
+    with BgzfReader(path, cache_blocks=2) as reader:
+        for offset, size in reads:
+            assert reader.read(offset, size) == data[offset:offset + size]
+
+
+@pytest.mark.parametrize('gzipped', [False, True])
+def test_bgzf_fasta(genome, tmp_path, gzipped):
+    path, contigs = genome
+    src = path
+    if gzipped:
+        with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb') as out:
+            shutil.copyfileobj(f, out)
+        src = path + '.gz'
+
+    # genome.fna and genome.fna.gz both get the copy genome.fna.bgz
+    out = bgzf_compress(src)
+    assert out == path + '.bgz'
+    rng = random.Random(0)
+    with BgzfFasta(out) as bgzf, Fasta(path) as fasta:
+        assert list(bgzf.keys()) == list(contigs)
+        assert 'contig0' in bgzf and 'missing' not in bgzf
+        for name, seq in contigs.items():
+            assert len(bgzf[name]) == len(seq)
+            assert bgzf[name][:].seq == seq
+            for _ in range(20):
+                start = rng.randint(1, len(seq))
+                end = rng.randint(start, len(seq))
+                for rc in (False, True):
+                    assert bgzf.get_seq(name, start, end, rc).seq == fasta.get_seq(name, start, end, rc).seq
+        # Requests past the contig ends are clipped
+        assert bgzf.get_seq('contig0', -5, 10 ** 9).seq == contigs['contig0']
+
+
+def test_bgzf_compress_ragged(tmp_path):
+    path = tmp_path / 'ragged.fna'
+    path.write_text('>a\nACGT\nAC\nACGT\n')
+    with pytest.raises(ValueError):
+        bgzf_compress(str(path))
+
+
+def test_open_genome(genome):
+    path, contigs = genome
+    with gzip.open(path + '.gz', 'wt') as f, open(path) as src:
+        f.write(src.read())
+
+    # A FASTA file without a BGZF copy is opened with pyfaidx
+    with open_genome(path) as genome:
+        assert isinstance(genome, Fasta)
+
+    # The BGZF copy of a gzipped database is found next to it
+    bgzf_compress(path + '.gz')
+    with open_genome(path + '.gz') as genome:
+        assert isinstance(genome, BgzfFasta)
+        assert genome.get_seq('contig1', 1, 10).seq == contigs['contig1'][:10]
@@ -0,0 +1,41 @@
+"""
+Smoke tests: every module imports, and every command of the jps CLI can be invoked.
+"""
+
+import importlib
+import os
+import pkgutil
+import pytest
+from click.testing import CliRunner
+
+import jps
+from jps.__main__ import cli
+
+# jps.util is a namespace package, which walk_packages does not descend into
+MODULES = sorted(info.name for info in pkgutil.walk_packages(jps.__path__, 'jps.'))
+MODULES += sorted(info.name for info in pkgutil.iter_modules([os.path.join(jps.__path__[0], 'util')], 'jps.util.'))
+
+
+def commands(group, prefix=()):
+    """ Paths of the commands of a click group, e.g. ('db', 'optimize'). """
+    for name, command in group.commands.items():
+        yield (*prefix, name)
+        if hasattr(command, 'commands'):
+            yield from commands(command, (*prefix, name))
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_import(module):
+    importlib.import_module(module)
+
+
+@pytest.mark.parametrize('command', list(commands(cli)), ids=' '.join)
+def test_help(command):
+    result = CliRunner().invoke(cli, [*command, '--help'])
+    assert result.exit_code == 0, result.output
+
+
+def test_counts(search):
+    result = CliRunner().invoke(cli, ['counts', str(search.id), '--threshold', '3.1e-06'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[1].split() == [search.name, '5', '4', '2', '2']
@@ -0,0 +1,58 @@
+"""
+Tests of transparent compressed i/o: compressed .sto and .tbl files read as their uncompressed names.
+"""
+
+import os
+import shutil
+import pytest
+
+from jps.util.compress import COMPRESSORS, compress_file, resolve, xopen
+from jps.util.iosto import StoSequence, sto_iter, sto_read
+from jps.util.stoindex import StoReader
+import jps.util.tblio as tblio
+
+from conftest import STO, TBL
+
+
+@pytest.mark.parametrize('ext', list(COMPRESSORS))
+def test_xopen(tmp_path, ext):
+    path = str(tmp_path / 'file.txt')
+    with xopen(path + ext, 'w') as f:
+        f.write('line\n')
+    assert not os.path.exists(path)
+    assert resolve(path) == path + ext
+
+    # Read through the uncompressed name, in text or binary mode
+    with xopen(path) as f:
+        assert f.read() == 'line\n'
+    with xopen(path, 'rb') as f:
+        assert f.read() == b'line\n'
+
+
+@pytest.mark.parametrize('ext, bgzf', [('.gz', False), ('.gz', True), ('.xz', False), ('.bz2', False)])
+def test_compress_file(tmp_path, ext, bgzf):
+    sto = shutil.copy(STO, str(tmp_path / 'search.out.sto'))
+    tbl = shutil.copy(TBL, str(tmp_path / 'search.out.tbl'))
+    os.utime(sto, ns=(0, 10 ** 9))
+    sequences, features = sto_read(sto)
+    rows = list(tblio.tbl_read(tbl, tblio.CMSEARCH_TBLHEADERS))
+
+    out = compress_file(sto, ext, bgzf=bgzf)
+    compress_file(tbl, ext)
+    assert out == sto + ext
+    assert not os.path.exists(sto)
+    assert os.stat(out).st_mtime_ns == 10 ** 9
+    assert os.path.exists(out + '.gzi') == bgzf
+
+    assert sto_read(sto) == (sequences, features)
+    assert {seq.esltag: seq for seq in sto_iter(sto) if isinstance(seq, StoSequence)} == sequences
+    assert list(tblio.tbl_read(tbl, tblio.CMSEARCH_TBLHEADERS)) == rows
+    with StoReader(sto) as reader:
+        assert reader.path == out
+        for esltag, seq in sequences.items():
+            assert reader.fetch(esltag, 10, 20) == seq.alnseq[10:20]
+
+
+def test_compress_file_unknown(tmp_path):
+    with pytest.raises(ValueError):
+        compress_file(str(tmp_path / 'file.txt'), '.zip')
@@ -0,0 +1,69 @@
+"""
+Tests of database maintenance: bulk-load settings are scoped to the load, and optimize runs
+with connections left in the pool.
+"""
+
+import pytest
+from sqlalchemy import select, text
+
+from config import *
+from jps.db import bulk_load, optimize
+from jps.models import Search, SessionLocal, engine
+
+
+def synchronous(session) -> int:
+    return session.execute(text("PRAGMA synchronous")).scalar()
+
+
+def test_bulk_load(session):
+    with bulk_load(session):
+        assert synchronous(session) == 0  # OFF
+        session.add(Search(cm='a.cm'))
+        session.commit()  # Hands the connection back to the pool...
+        assert synchronous(session) == 0  # ...and the next checkout is relaxed too
+    session.commit()
+
+    # No connection returns to the pool relaxed
+    assert synchronous(session) == 1  # NORMAL
+    with SessionLocal() as other:
+        assert synchronous(other) == 1
+
+
+def test_bulk_load_error(session):
+    with pytest.raises(RuntimeError):
+        with bulk_load(session):
+            assert synchronous(session) == 0
+            raise RuntimeError
+    session.rollback()
+    assert synchronous(session) == 1
+
+
+def test_bulk_load_in_transaction(session):
+    # A connection that has written cannot change its safety level, and is left as is
+    session.add(Search(cm='a.cm'))
+    session.flush()
+    with bulk_load(session):
+        session.add(Search(cm='b.cm'))
+        session.commit()
+        assert synchronous(session) == 0
+    session.commit()
+    assert session.scalars(select(Search.cm).order_by(Search.cm)).all() == ['a.cm', 'b.cm']
+
+
+def test_optimize(search, session):
+    # Connections of earlier sessions wait in the pool while the journal mode is switched
+    session.close()
+    for _ in range(2):
+        with SessionLocal() as other:
+            other.scalars(select(Search)).all()
+
+    plans = optimize()
+    for name, plan in plans.items():
+        # No query scans a whole table without an index
+        assert not any(line.startswith('SCAN') and 'INDEX' not in line for line in plan), name
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA page_size").scalar() == SQLITE_PAGE_SIZE
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar().upper() == SQLITE_PRAGMAS['journal_mode']
+    with SessionLocal() as other:
+        assert len(other.scalars(select(Search)).all()) == 1
@@ -0,0 +1,105 @@
+"""
+Tests of batched flank extraction: FlankExtractor agrees with ChrInterval.getflanks and with
+slicing the contigs directly, as does the single-pass stream_flanks.
+"""
+
+import gzip
+import random
+import shutil
+import pytest
+from pyfaidx import Fasta
+
+from cgk.interval import ChrInterval
+from jps.util.flanks import FlankExtractor, flank_window, revcomp, stream_fasta, stream_flanks
+
+
+def random_intervals(rng: random.Random, contigs: dict[str, str], n: int) -> list[ChrInterval]:
+    intervals = []
+    for _ in range(n):
+        name = rng.choice(list(contigs))
+        # At least 2 nts long, as getflanks takes the strand of single-nt intervals to be +
+        start = rng.randint(1, len(contigs[name]) - 1)
+        end = min(len(contigs[name]), start + rng.randint(1, 80))
+        intervals.append(ChrInterval(name, start, end, rng.choice('+-')))
+    return intervals
+
+
+def expected(contigs: dict[str, str], iv: ChrInterval, nt5p: int, nt3p: int) -> tuple[str, str, str]:
+    """ 5' flank, sequence and 3' flank of iv, sliced from its contig. """
+    contig = contigs[iv.chraccn]
+    if iv.strand == '-':
+        contig = revcomp(contig)
+        lo = len(contig) - iv.end  # 0-based start on the reverse strand
+        hi = len(contig) - iv.start + 1
+    else:
+        lo, hi = iv.start - 1, iv.end
+    return contig[max(0, lo - nt5p):lo], contig[lo:hi], contig[hi:hi + nt3p]
+
+
+def test_revcomp():
+    assert revcomp('AACGTn') == 'nACGTT'
+
+
+def test_flank_window():
+    iv = ChrInterval('contig0', 10, 20, '-')
+    assert flank_window(iv, 25, 10, 3) == (7, 25, 5, 3)
+    with pytest.raises(ValueError):
+        flank_window(iv, 25, -1, 0)
+
+
+@pytest.mark.parametrize('nt5p, nt3p', [(0, 0), (30, 0), (0, 30), (100, 250)])
+@pytest.mark.parametrize('gap, maxspan', [(0, 1), (1000, 1 << 20)])
+def test_extract(genome, nt5p, nt3p, gap, maxspan):
+    path, contigs = genome
+    intervals = random_intervals(random.Random(nt5p + nt3p), contigs, 200)
+    with Fasta(path) as dbfna:
+        flanked = FlankExtractor(dbfna, gap, maxspan).extract(intervals, nt5p, nt3p)
+        assert len(flanked) == len(intervals)
+        for iv, f in zip(intervals, flanked):
+            assert f.esltag == iv.esltag
+            assert (f.seq5p, f.seq, f.seq3p) == expected(contigs, iv, nt5p, nt3p)
+            # The flanks and their lengths are those of ChrInterval.getflanks
+            assert (f.seq5p, f.seq3p, f.nt5p, f.nt3p) == iv.getflanks(dbfna, nt5p, nt3p)
+
+
+def test_write_fasta(genome, tmp_path):
+    path, contigs = genome
+    intervals = random_intervals(random.Random(0), contigs, 20)
+    out = str(tmp_path / 'out.fna')
+    with Fasta(path) as dbfna:
+        FlankExtractor(dbfna).write_fasta(intervals, out, 5, 5, sep='-')
+    with open(out) as f:
+        lines = f.read().splitlines()
+    assert lines[0::2] == [f">{iv.esltag}" for iv in intervals]
+    assert lines[1::2] == ['-'.join(expected(contigs, iv, 5, 5)) for iv in intervals]
+
+
+@pytest.mark.parametrize('gzipped', [False, True])
+@pytest.mark.parametrize('chunksize', [7, 1 << 22])
+def test_stream_flanks(genome, tmp_path, gzipped, chunksize, capsys):
+    path, contigs = genome
+    if gzipped:
+        with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb') as out:
+            shutil.copyfileobj(f, out)
+        path += '.gz'
+    intervals = random_intervals(random.Random(0), contigs, 100)
+    intervals.append(ChrInterval('missing', 1, 10, '+'))
+
+    # Small chunks split headers and sequence lines between chunks
+    streamed = dict(stream_flanks(path, intervals, 20, 30, chunksize))
+    assert sorted(streamed) == list(range(len(intervals) - 1))
+    for k, flanked in streamed.items():
+        iv = intervals[k]
+        assert flanked.esltag == iv.esltag
+        assert (flanked.seq5p, flanked.seq, flanked.seq3p) == expected(contigs, iv, 20, 30)
+    assert '1 intervals on 1 contigs missing' in capsys.readouterr().err
+
+
+def test_stream_fasta(genome, tmp_path):
+    path, contigs = genome
+    intervals = random_intervals(random.Random(0), contigs, 20)
+    out = str(tmp_path / 'out.fna')
+    stream_fasta(path, intervals, out, 5, 5)
+    with open(out) as f:
+        records = dict(zip(*[iter(f.read().splitlines())] * 2))
+    assert records == {f">{iv.esltag}": ''.join(expected(contigs, iv, 5, 5)) for iv in intervals}
@@ -0,0 +1,38 @@
+"""
+Tests of a search's hit queries: hits stream in rank order, in batches or keyset pages.
+"""
+
+from jps.models import Hit
+
+
+def test_iter_hits(search, session):
+    hits = list(search.iter_hits(session, batch_size=2))
+    assert [hit.rank for hit in hits] == [0, 1, 2, 3, 4]
+    assert [hit.rank for hit in search.iter_hits(evalue_max=3.2e-06)] == [0, 1, 2]
+    assert [hit.rank for hit in search.iter_hits(where=[Hit.strand == '-'])] == [0, 3]
+
+    # The hits relationship is never loaded whole, but can be queried
+    assert session.scalars(search.hits.select().where(Hit.rank == 3)).one().chraccn == 'NZ_JAGL01000002.1'
+
+
+def test_iter_hit_pages(search, session):
+    pages = list(search.iter_hit_pages(session, page_size=2))
+    assert [[hit.rank for hit in page] for page in pages] == [[0, 1], [2, 3], [4]]
+    assert [[hit.rank for hit in page] for page in search.iter_hit_pages(page_size=2, after_rank=2)] == [[3, 4]]
+    assert list(search.iter_hit_pages(page_size=2, evalue_max=1e-9)) == []
+
+
+def test_iter_columns(search, session):
+    assert list(search.iter_columns(Hit.rank, Hit.chraccn, batch_size=2, evalue_max=3e-06)) == [
+        (0, 'JAAYCJ010000321.1'), (1, 'NZ_JACHZX010000001.1')]
+    assert search.evalues().tolist() == [4.5e-07, 3e-06, 3.2e-06, 3.7e-06, 4.7e-06]
+
+
+def test_select_hits_eager(search, session):
+    expected = [(hit.alnseq.alnseq if hit.alnseq else None, len(hit.features)) for hit in search.iter_hits()]
+    session.expire_all()
+    hits = list(search.iter_hits(session, batch_size=2, alnseqs=True, features=True))
+    session.expunge_all()
+    # Alnseqs and features were loaded with the hits, so they are readable while detached
+    assert [(hit.alnseq.alnseq if hit.alnseq else None, len(hit.features)) for hit in hits] == expected
+    assert expected[4][0] is None  # Rank 4 is not in the alignment
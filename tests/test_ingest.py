@@ -0,0 +1,102 @@
+"""
+Tests of the ingestion path: parse_search batches, BulkWriter inserts through cmsearch_parse,
+and process-pool ingestion of search directories with ingest_all.
+"""
+
+import os
+import shutil
+
+from sqlalchemy import select, func
+
+from jps.ingest import parse_search
+from jps.models import *
+from jps.util.sketch import aln_key
+import jps.util.iosto as iosto
+from conftest import SEARCH, STO
+
+
+def count(session, table) -> int:
+    return session.scalar(select(func.count()).select_from(table))
+
+
+def test_parse_search():
+    batches = list(parse_search(SEARCH))
+    assert [kind for kind, _ in batches] == ['sto', 'hits', 'summary']
+
+    alnseqs, features = batches[0][1]
+    assert len(alnseqs) == 4
+    assert len(features) == 9
+
+    hits = batches[1][1]
+    assert [hit['rank'] for hit in hits] == [0, 1, 2, 3, 4]
+    assert hits[0]['strand'] == '-' and (hits[0]['start'], hits[0]['end']) == (2779, 2831)
+    # Ranks 1 and 2 have the same alignment text, in different rows
+    assert hits[1]['alnseq_key'] == hits[2]['alnseq_key']
+    assert hits[1]['alnrow'] != hits[2]['alnrow']
+    # Rank 4 is missing from the alignment
+    assert hits[4]['alnseq_key'] is None and hits[4]['alnrow'] is None
+
+    summary = batches[2][1]
+    assert summary['total'] == 5 and summary['unique'] == 4
+
+
+def test_cmsearch_parse(session):
+    from jps.routes import cmsearch_parse
+    cmsearch_parse(Search(cm='search.cm', source=SEARCH))
+
+    search = session.scalars(select(Search).where(Search.source == SEARCH)).one()
+    assert search.ingested
+    assert count(session, Hit) == 5
+    assert count(session, Alnseq) == 3  # Stored once per distinct text
+    assert count(session, StoFeature) == 9
+    assert count(session, hit_rtree) == 5
+
+    sequences, _ = iosto.sto_read(STO)
+    for hit in search.iter_hits(session, alnseqs=True):
+        if hit.alnseq is not None:
+            assert hit.alnseq.key == aln_key(sequences[hit.esltag].alnseq)
+            assert hit.alnseq.alnseq == sequences[hit.esltag].alnseq
+
+
+def test_ingest_all(session, searches_dir):
+    from jps.ingest import discover, ingest_all
+
+    # A second copy of the search, and a search whose alignment cannot be parsed
+    for name in ('copy', 'broken'):
+        os.makedirs(os.path.join(searches_dir, name))
+        shutil.copy(f"{SEARCH}.tbl", os.path.join(searches_dir, name, f"{name}.out.tbl"))
+    shutil.copy(STO, os.path.join(searches_dir, 'copy', 'copy.out.sto'))
+    with open(os.path.join(searches_dir, 'broken', 'broken.out.sto'), 'w') as f:
+        f.write('# STOCKHOLM 1.0\nJAAYCJ010000321.1/2831-2779 GGGU\n')
+
+    datapaths = discover(searches_dir)
+    assert [os.path.basename(datapath) for datapath in datapaths] == ['broken.out', 'copy.out', 'search.out']
+
+    done = ingest_all(searches_dir, workers=2)
+    assert sorted(done) == datapaths[1:]
+    assert session.scalars(select(Search.source).where(Search.ingested == True).order_by(Search.source)).all() == datapaths[1:]
+    assert count(session, Hit) == 2 * 5
+    assert count(session, Alnseq) == 3  # Shared between the two copies
+    assert count(session, Contig) == 5
+    assert count(session, SearchSummary) == 2
+
+    # Ingested searches are skipped, and a failed one is reset and retried
+    os.remove(os.path.join(searches_dir, 'broken', 'broken.out.sto'))
+    assert ingest_all(searches_dir, workers=1) == datapaths[:1]
+    assert count(session, Hit) == 3 * 5
+    assert count(session, hit_rtree) == 3 * 5
+
+
+def test_cmsearch_parse_again(session):
+    # Rows of an earlier parse are replaced, in small batches and commits
+    from jps.routes import cmsearch_parse
+    cmsearch_parse(Search(cm='search.cm', source=SEARCH))
+    search = session.scalars(select(Search).where(Search.source == SEARCH)).one()
+    cmsearch_parse(search, batch_size=2, commit_every=3)
+
+    assert count(session, Search) == 1
+    assert count(session, Stockholm) == 1
+    assert count(session, Hit) == 5
+    assert count(session, StoFeature) == 9
+    assert count(session, hit_rtree) == 5
+    assert count(session, SearchSummary) == 1
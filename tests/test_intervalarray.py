@@ -0,0 +1,103 @@
+"""
+Tests of ChrIntervalArray: batch operations agree with their ChrInterval counterparts.
+"""
+
+import random
+import pytest
+
+from cgk.interval import ChrInterval
+from jps.util.intervalarray import ChrIntervalArray
+from jps.util.iosto import sto_read
+
+from conftest import STO
+
+
+def random_intervals(rng: random.Random, n: int, chraccns=('chr1', 'chr2')) -> list[ChrInterval]:
+    intervals = []
+    for _ in range(n):
+        start = rng.randint(1, 1000)
+        intervals.append(ChrInterval(rng.choice(chraccns), start, start + rng.randint(0, 100), rng.choice('+-')))
+    return intervals
+
+
+def astuples(intervals) -> list[tuple]:
+    return [(iv.chraccn, iv.start, iv.end, iv.strand) for iv in intervals]
+
+
+def test_construction():
+    sequences, _ = sto_read(STO)
+    intervals = [ChrInterval(seq.chraccn, seq.start, seq.end, seq.strand) for seq in sequences.values()]
+    array = ChrIntervalArray.from_esltags(list(sequences))
+    assert len(array) == 4
+    assert astuples(array) == astuples(intervals)
+    assert astuples(ChrIntervalArray.from_intervals(intervals)) == astuples(intervals)
+    assert array.esltags() == list(sequences)
+    assert array.lengths.tolist() == [len(iv) for iv in intervals]
+    assert astuples([array[1]]) == astuples(intervals[1:2])
+    assert astuples(array[::2]) == astuples(intervals[::2])
+
+    assert len(ChrIntervalArray.from_rows([])) == 0
+    with pytest.raises(ValueError):
+        ChrIntervalArray.from_columns(['chr1'], [10], [5], ['+'])
+    with pytest.raises(ValueError):
+        ChrIntervalArray.from_columns(['chr1'], [1], [5], ['x'])
+    with pytest.raises(ValueError):
+        ChrIntervalArray.from_esltags(['chr1:1-5'])
+
+
+def test_concat():
+    rng = random.Random(0)
+    a = random_intervals(rng, 10, ('chr1', 'chr2'))
+    b = random_intervals(rng, 10, ('chr2', 'chr3'))
+    array = ChrIntervalArray.concat([ChrIntervalArray.from_intervals(a), ChrIntervalArray.from_intervals(b)])
+    assert array.names.tolist() == ['chr1', 'chr2', 'chr3']
+    assert astuples(array) == astuples(a + b)
+
+
+def test_elementwise():
+    rng = random.Random(1)
+    a = random_intervals(rng, 300, ('chr1',))
+    b = random_intervals(rng, 300, ('chr1',))
+    x, y = ChrIntervalArray.from_intervals(a), ChrIntervalArray.from_intervals(b)
+    assert x.overlaps(y).tolist() == [p.overlaps(q) for p, q in zip(a, b)]
+    assert x.contains(y).tolist() == [p.contains(q) for p, q in zip(a, b)]
+    assert x.distance_to(y).tolist() == [p.distance_to(q) for p, q in zip(a, b)]
+
+    with pytest.raises(ValueError):
+        x.overlaps(ChrIntervalArray.from_intervals(random_intervals(rng, 300, ('chr2',))))
+
+
+def test_pairwise():
+    rng = random.Random(2)
+    a = random_intervals(rng, 40)
+    b = random_intervals(rng, 50, ('chr2', 'chr3'))
+    x, y = ChrIntervalArray.from_intervals(a), ChrIntervalArray.from_intervals(b)
+
+    def brute(method, missing):
+        return [[getattr(p, method)(q) if p.chraccn == q.chraccn else missing for q in b] for p in a]
+    assert x.pairwise_overlaps(y).tolist() == brute('overlaps', 0)
+    assert x.pairwise_contains(y).tolist() == brute('contains', 0)
+    assert x.pairwise_distance(y).tolist() == brute('distance_to', -1)
+
+
+@pytest.mark.parametrize('stranded', [True, False])
+def test_merge(stranded):
+    rng = random.Random(3)
+    intervals = random_intervals(rng, 200)
+    merged = ChrIntervalArray.from_intervals(intervals).merge(stranded)
+
+    # Positions covered by each (chraccn, strand) group, before and after merging
+    def coverage(intervals):
+        covered = {}
+        for iv in intervals:
+            key = (iv.chraccn, iv.strand if stranded else None)
+            covered.setdefault(key, set()).update(range(iv.start, iv.end + 1))
+        return covered
+    assert coverage(merged) == coverage(intervals)
+
+    # Merged intervals are sorted by group, then start, and do not overlap within a group
+    keys = list(zip(merged.codes.tolist(), merged.strands.tolist(), merged.starts.tolist()))
+    assert keys == sorted(keys)
+    for p, q in zip(merged, list(merged)[1:]):
+        if (p.chraccn, p.strand) == (q.chraccn, q.strand):
+            assert p.end < q.start
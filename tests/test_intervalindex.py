@@ -0,0 +1,90 @@
+"""
+Tests of ChrIntervalIndex: every query agrees with a brute-force scan over ChrInterval methods.
+"""
+
+import random
+import pytest
+
+from cgk.interval import ChrInterval
+from jps.util.intervalindex import ChrIntervalIndex
+
+CHRACCNS = ['chr1', 'chr2', 'chr3']
+
+
+def random_intervals(rng: random.Random, n: int, span: int = 2000) -> list[ChrInterval]:
+    intervals = []
+    for _ in range(n):
+        start = rng.randint(1, span)
+        intervals.append(ChrInterval(rng.choice(CHRACCNS[:2]), start, start + rng.randint(0, 200), rng.choice('+-')))
+    return intervals
+
+
+def ident(intervals) -> list[int]:
+    return sorted(map(id, intervals))
+
+
+@pytest.fixture
+def data():
+    rng = random.Random(0)
+    return random_intervals(rng, 500), random_intervals(rng, 100) + [ChrInterval('chr3', 1, 10, '+')]
+
+
+@pytest.mark.parametrize('sign', [None, 1, -1])
+def test_overlapping(data, sign):
+    intervals, queries = data
+    index = ChrIntervalIndex(intervals)
+    for q in queries:
+        expected = [iv for iv in intervals if iv.chraccn == q.chraccn and q.overlaps(iv) and
+                    (sign is None or q.overlaps(iv) == sign)]
+        found = index.overlapping(q, sign)
+        assert ident(found) == ident(expected)
+        assert found == sorted(found, key=lambda iv: (iv.start, iv.end))
+
+
+@pytest.mark.parametrize('sign', [None, 1, -1])
+def test_contained_containing(data, sign):
+    intervals, queries = data
+    index = ChrIntervalIndex(intervals)
+    for q in queries:
+        same = [iv for iv in intervals if iv.chraccn == q.chraccn]
+        assert ident(index.contained(q, sign)) == ident(
+            iv for iv in same if q.contains(iv) and (sign is None or q.contains(iv) == sign))
+        assert ident(index.containing(q, sign)) == ident(
+            iv for iv in same if iv.contains(q) and (sign is None or iv.contains(q) == sign))
+
+
+def test_stab(data):
+    intervals, queries = data
+    index = ChrIntervalIndex(intervals)
+    for q in queries:
+        pos = q.start
+        assert ident(index.stab(q.chraccn, pos)) == ident(
+            iv for iv in intervals if iv.chraccn == q.chraccn and iv.start <= pos <= iv.end)
+        assert ident(index.stab(q.chraccn, pos, q.strand)) == ident(
+            iv for iv in intervals if iv.chraccn == q.chraccn and iv.strand == q.strand and iv.start <= pos <= iv.end)
+
+
+@pytest.mark.parametrize('sign', [None, 1, -1])
+def test_nearest(data, sign):
+    intervals, queries = data
+    index = ChrIntervalIndex(intervals)
+    for q in queries:
+        candidates = [iv for iv in intervals if iv.chraccn == q.chraccn and
+                      (sign is None or (iv.strand == q.strand) == (sign == 1))]
+        found = index.nearest(q, sign)
+        if not candidates:
+            assert found is None
+        else:
+            iv, distance = found
+            assert distance == q.distance_to(iv) == min(q.distance_to(other) for other in candidates)
+
+
+def test_container(data):
+    intervals, _ = data
+    index = ChrIntervalIndex(intervals)
+    assert len(index) == len(intervals)
+    assert ident(index) == ident(intervals)
+    assert sorted(index.chraccns) == CHRACCNS[:2]
+    assert 'chr1' in index and 'chr3' not in index
+    with pytest.raises(ValueError):
+        index.overlapping(intervals[0], sign=0)
@@ -0,0 +1,117 @@
+"""
+Tests of Stockholm i/o: the streaming reader agrees with the whole-file reader, written files
+read back unchanged, and malformed files are rejected.
+"""
+
+import pytest
+
+from jps.util.iosto import StockholmError, StoFeature, StoSequence, StoWriter, sto_iter, sto_read, sto_write
+
+from conftest import STO
+
+
+def split(items):
+    """ Split sto_iter's output into sequences keyed by esltag and a list of features. """
+    sequences = {item.esltag: item for item in items if isinstance(item, StoSequence)}
+    features = [item for item in items if isinstance(item, StoFeature)]
+    return sequences, features
+
+
+def key(feat: StoFeature):
+    return feat.fmt, feat.esltag, feat.field, feat.text
+
+
+def test_sto_read():
+    sequences, features = sto_read(STO)
+    assert list(sequences) == [
+        'JAAYCJ010000321.1/2831-2779',
+        'NZ_JACHZX010000001.1/978422-978477',
+        'CAIUPP010000023.1/192046-192099',
+        'NZ_JAGL01000002.1/232447-232393',
+    ]
+    seq = sequences['JAAYCJ010000321.1/2831-2779']
+    assert (seq.chraccn, seq.start, seq.end, seq.strand) == ('JAAYCJ010000321.1', 2779, 2831, '-')
+    assert seq.alnseq == 'GGGU..G.CAG-CGGCUUCA-A'
+    assert {len(seq.alnseq) for seq in sequences.values()} == {22}
+
+    assert sorted(feat.fmt for feat in features) == ['GC', 'GC', 'GF', 'GR', 'GR', 'GS', 'GS', 'GS', 'GS']
+    gc = {feat.field: feat.text for feat in features if feat.fmt == 'GC'}
+    assert gc == {'SS_cons': '<<<<..._____.>>>:::::.', 'RF': 'gggu..g.cag.cggcuuca.a'}
+
+
+def test_sto_iter_interleaved():
+    # Rows of an interleaved alignment are joined across blocks
+    sequences, features = split(list(sto_iter(STO)))
+    expected_sequences, expected_features = sto_read(STO)
+    assert sequences == expected_sequences
+    assert sorted(map(key, features)) == sorted(map(key, expected_features))
+
+
+def test_sto_iter_single_block(tmp_path):
+    sequences, features = sto_read(STO)
+    path = str(tmp_path / 'single.sto')
+    sto_write(sequences, features, path)
+
+    # Single-block rows are yielded in file order as they are read
+    items = list(sto_iter(path))
+    assert [item.esltag for item in items if isinstance(item, StoSequence)] == list(sequences)
+    assert [item.fmt for item in items if isinstance(item, StoFeature)][0] == 'GF'
+    assert split(items)[0] == sequences
+
+
+def test_sto_write_roundtrip(tmp_path):
+    sequences, features = sto_read(STO)
+    path = str(tmp_path / 'out.sto')
+    sto_write(sequences, features, path)
+
+    sequences2, features2 = sto_read(path)
+    assert sequences2 == sequences
+    assert sorted(map(key, features2)) == sorted(map(key, features))
+
+
+def test_sto_writer_streaming(tmp_path):
+    sequences, features = sto_read(STO)
+    gf = [feat for feat in features if feat.fmt == 'GF']
+    gc = [feat for feat in features if feat.fmt == 'GC']
+    path = str(tmp_path / 'out.sto')
+
+    with StoWriter(path, gf=gf, gc=gc) as writer:
+        for esltag, seq in sequences.items():
+            writer.write(esltag, seq.alnseq, [feat for feat in features if feat.esltag == esltag])
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == '# STOCKHOLM 1.0'
+    assert lines[-1] == '//'
+    # GS lines are laid out above the alignment even though they were written with it
+    assert max(i for i, line in enumerate(lines) if line.startswith('#=GS')) < \
+        min(i for i, line in enumerate(lines) if line.startswith('JAAYCJ'))
+
+    sequences2, features2 = sto_read(path)
+    assert sequences2 == sequences
+    assert sorted(map(key, features2)) == sorted(map(key, features))
+
+
+@pytest.mark.parametrize('text, error', [
+    ('# STOCKHOLM 2.0\na/1-4 ACGU\n//\n', 'Invalid Stockholm header'),
+    ('# STOCKHOLM 1.0\na/1-4 ACGU\nb/1-3 ACG\n//\n', 'Unexpected seqlen'),
+    ('# STOCKHOLM 1.0\na/1-4 AC\nb/1-4 AC\n\nb/1-4 GU\na/1-4 GU\n//\n', 'Unexpected block order'),
+    ('# STOCKHOLM 1.0\na/1-4 AC\nb/1-4 AC\n\na/1-4 GU\n//\n', 'Unexpected end of block'),
+    ('# STOCKHOLM 1.0\na/1-4 ACGU\na/1-4 ACGU\n//\n', 'Duplicate row'),
+    ('# STOCKHOLM 1.0\n#=GS c/1-4 DE missing\na/1-4 ACGU\n//\n', 'not in alignment'),
+    ('# STOCKHOLM 1.0\n#=GX a/1-4 DE unknown\na/1-4 ACGU\n//\n', 'Unknown markup'),
+    ('# STOCKHOLM 1.0\na/1-4\n//\n', 'Malformed line'),
+    ('# STOCKHOLM 1.0\na/1-4 ACGU\n', 'Unexpected end of file'),
+])
+def test_sto_read_invalid(tmp_path, text, error):
+    path = tmp_path / 'invalid.sto'
+    path.write_text(text)
+    with pytest.raises(StockholmError, match=error):
+        sto_read(str(path))
+
+
+def test_sto_iter_truncated(tmp_path):
+    path = tmp_path / 'truncated.sto'
+    path.write_text('# STOCKHOLM 1.0\na/1-4 ACGU\n')
+    with pytest.raises(StockholmError, match='Unexpected end of file'):
+        list(sto_iter(str(path)))
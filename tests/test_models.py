@@ -0,0 +1,55 @@
+"""
+Tests of the models: Alnseqs are stored once under their content key and read back intact, and
+hits keep the sequence features of their own alignment row.
+"""
+
+from sqlalchemy import insert, select, func
+
+from jps.models import Alnseq, Stockholm
+from jps.util.sketch import aln_key, degap, seq_digest
+
+ALNSEQ = 'GGGUa.G.CAG-CGGAUUCAgA'
+
+
+def test_alnseq_roundtrip(session):
+    session.execute(insert(Alnseq).prefix_with('OR IGNORE'), [Alnseq.pack(ALNSEQ), Alnseq.pack(ALNSEQ)])
+    session.commit()
+
+    alnseq = session.get(Alnseq, aln_key(ALNSEQ))
+    assert alnseq.alnseq == ALNSEQ
+    assert alnseq.digest == seq_digest(degap(ALNSEQ))
+    assert session.scalar(select(func.count()).select_from(Alnseq)) == 1
+
+
+def test_alnseq_negative_digest(session):
+    # Digests are signed 64-bit, so that they fit an SQLite INTEGER
+    texts = (f"ACGU-{'ACGU'[i % 4] * i}" for i in range(1, 100))
+    text = next(text for text in texts if seq_digest(degap(text)) < 0)
+    session.execute(insert(Alnseq), [Alnseq.pack(text)])
+    session.commit()
+    assert session.get(Alnseq, aln_key(text)).digest == seq_digest(degap(text))
+
+
+def test_aln_key_distinguishes_gaps():
+    assert aln_key('ACG-U') != aln_key('AC-GU')
+    assert seq_digest(degap('ACG-U')) == seq_digest(degap('AC-GU'))
+
+
+def test_hit_features(search, session):
+    # Ranks 1 and 2 share their alnseq, but each has the features of its own row
+    hits = search.iter_hits(session, features=True)
+    features = {hit.rank: sorted((feat.fmt, feat.field, feat.text) for feat in hit.features) for hit in hits}
+    assert features[1] == [('GR', 'PP', '9999*.8.999-999899997*'), ('GS', 'DE', 'Sphingomonas sp. BK345')]
+    assert features[2] == [('GS', 'DE', 'uncultured planctomycete')]
+    assert features[4] == []
+
+    stockholm = session.scalars(select(Stockholm)).one()
+    assert sorted(feat.fmt for feat in stockholm.features if feat.alnrow is None) == ['GC', 'GC', 'GF']
+
+
+def test_prune_alnseqs(search, session):
+    from jps.db import prune_alnseqs
+    session.execute(insert(Alnseq), [Alnseq.pack(ALNSEQ[::-1])])
+    session.commit()
+    assert prune_alnseqs() == 1
+    assert session.scalar(select(func.count()).select_from(Alnseq)) == 3
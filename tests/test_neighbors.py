@@ -0,0 +1,74 @@
+"""
+Tests of neighbor detection: the sweep line finds the same pairs as a brute-force scan.
+"""
+
+import random
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from cgk.interval import ChrInterval
+from jps.models import Hit, Neighbor, Search
+from jps.neighbors import find_neighbors, neighbor_pairs, store_neighbors
+from jps.util.intervalarray import ChrIntervalArray
+
+
+def random_intervals(rng: random.Random, n: int) -> list[ChrInterval]:
+    intervals = []
+    for _ in range(n):
+        start = rng.randint(1, 5000)
+        intervals.append(ChrInterval(rng.choice(['chr1', 'chr2']), start, start + rng.randint(0, 100), rng.choice('+-')))
+    return intervals
+
+
+def brute_pairs(intervals, max_distance, sign=None, groups=None) -> list[tuple]:
+    pairs = []
+    for i, p in enumerate(intervals):
+        for j, q in enumerate(intervals[:i]):
+            if p.chraccn != q.chraccn or p.distance_to(q) > max_distance:
+                continue
+            s = 1 if p.strand == q.strand else -1
+            if (sign is not None and s != sign) or (groups is not None and groups[i] == groups[j]):
+                continue
+            pairs.append((min(i, j), max(i, j), p.distance_to(q), s))
+    return sorted(pairs)
+
+
+@pytest.mark.parametrize('max_distance, sign, across', [
+    (0, None, False), (50, None, False), (200, 1, False), (200, -1, False), (100, None, True)])
+def test_neighbor_pairs(max_distance, sign, across):
+    rng = random.Random(max_distance)
+    intervals = random_intervals(rng, 400)
+    groups = np.array([rng.randint(0, 2) for _ in intervals]) if across else None
+
+    i, j, distances, signs = neighbor_pairs(ChrIntervalArray.from_intervals(intervals), max_distance, sign, groups)
+    # The first interval of each pair is the one with the lower start
+    assert all(intervals[a].start <= intervals[b].start for a, b in zip(i.tolist(), j.tolist()))
+    found = sorted((min(a, b), max(a, b), d, s) for a, b, d, s in
+                   zip(i.tolist(), j.tolist(), distances.tolist(), signs.tolist()))
+    assert found == brute_pairs(intervals, max_distance, sign, groups)
+
+
+def test_find_neighbors(search, session):
+    # A second search with a hit 19 nts from rank 0 of the fixture search, on the other strand
+    other = Search(cm='other.cm')
+    session.add(other)
+    session.flush()
+    session.add_all([
+        Hit(search_id=other.id, rank=0, chraccn='JAAYCJ010000321.1', start=2850, end=2900, strand='+'),
+        Hit(search_id=other.id, rank=1, chraccn='JAAYCJ010000321.1', start=9000, end=9050, strand='-'),
+    ])
+    session.commit()
+
+    table = find_neighbors(session, [search, other], max_distance=100, across=True)
+    assert table.tolist() == [(search.id, 0, other.id, 0, 19, -1)]
+    assert len(find_neighbors(session, [search, other], max_distance=18)) == 0
+    assert len(find_neighbors(session, [search, other], max_distance=100, sign=1)) == 0
+
+    store_neighbors(session, [search, other], table)
+    neighbor = session.scalars(select(Neighbor)).one()
+    assert (neighbor.hit1.chraccn, neighbor.hit1.rank, neighbor.hit2.start) == ('JAAYCJ010000321.1', 0, 2850)
+
+    # Stored neighbors are replaced
+    store_neighbors(session, [search, other], table[:0])
+    assert session.scalars(select(Neighbor)).all() == []
@@ -0,0 +1,97 @@
+"""
+Tests of the hit R*Tree: window, nearest-hit and overlap queries agree with brute force, and
+build_rtree backfills the boxes of hits that lack them.
+"""
+
+import random
+import pytest
+from sqlalchemy import delete, select, func
+
+from jps.db import build_rtree
+from jps.ingest import BulkWriter
+from jps.models import Contig, Hit, Search, hit_rtree, hits_in_window
+
+CHRACCNS = ['chr1', 'chr2', 'chr3']
+
+
+@pytest.fixture
+def searches(session) -> list[Search]:
+    """ Two searches of random hits, written with BulkWriter as at ingestion. """
+    rng = random.Random(0)
+    searches = [Search(cm='a.cm'), Search(cm='b.cm')]
+    session.add_all(searches)
+    session.flush()
+    writer = BulkWriter(session, batch_size=50)
+    for search in searches:
+        rows = []
+        for rank in range(150):
+            start = rng.randint(1, 20000)
+            rows.append(dict(rank=rank, chraccn=rng.choice(CHRACCNS), start=start, end=start + rng.randint(0, 300),
+                             strand=rng.choice('+-'), evalue=rng.random()))
+        writer.write('hits', rows, search.id, None)
+    writer.commit()
+    return searches
+
+
+def all_hits(session) -> list[Hit]:
+    return session.scalars(select(Hit)).all()
+
+
+def keys(hits) -> list[tuple[int, int]]:
+    return sorted((hit.search_id, hit.rank) for hit in hits)
+
+
+def test_hits_in_window(session, searches):
+    hits = all_hits(session)
+    rng = random.Random(1)
+    for _ in range(50):
+        chraccn, start = rng.choice(CHRACCNS), rng.randint(1, 20000)
+        end = start + rng.randint(0, 1000)
+        expected = [hit for hit in hits if hit.chraccn == chraccn and hit.start <= end and hit.end >= start]
+        assert keys(session.scalars(hits_in_window(chraccn, start, end))) == keys(expected)
+        assert keys(session.scalars(searches[0].hits_in_window(chraccn, start, end))) == \
+            keys(hit for hit in expected if hit.search_id == searches[0].id)
+    assert session.scalars(hits_in_window('missing', 1, 10 ** 9)).all() == []
+
+
+def test_window_nearest(session, searches):
+    hits = all_hits(session)
+    for hit in hits[::10]:
+        others = [other for other in hits if other.chraccn == hit.chraccn and other is not hit]
+        assert keys(session.scalars(hit.window(100))) == keys(
+            other for other in others if hit.distance_to(other) <= 100)
+
+        nearest = hit.nearest(k=3, search_ids=[searches[1].id], distance=10)
+        distances = sorted(hit.distance_to(other) for other in others if other.search_id == searches[1].id)
+        assert [distance for _, distance in nearest] == distances[:3]
+        assert all(hit.distance_to(other) == distance for other, distance in nearest)
+
+
+def test_overlapping_hits(session, searches):
+    hits = all_hits(session)
+    for distance in (0, 50):
+        pairs = session.execute(searches[0].overlapping_hits(searches[1], distance)).all()
+        expected = [(h1.rank, h2.rank) for h1 in hits for h2 in hits
+                    if h1.search_id == searches[0].id and h2.search_id == searches[1].id
+                    and h1.chraccn == h2.chraccn and h1.distance_to(h2) <= distance]
+        assert sorted((h1.rank, h2.rank) for h1, h2 in pairs) == sorted(expected)
+
+
+def test_build_rtree(session, searches):
+    expected = keys(session.scalars(hits_in_window('chr1', 5000, 8000)))
+
+    # Hits ingested before the R*Tree existed have no boxes, and their chraccns no Contigs
+    session.execute(delete(hit_rtree).where(hit_rtree.c.id.in_(select(Hit.rtree_id).where(Hit.search_id == searches[1].id))))
+    session.execute(delete(hit_rtree).where(hit_rtree.c.chr0 == select(Contig.id).where(Contig.chraccn == 'chr3').scalar_subquery()))
+    session.execute(delete(Contig).where(Contig.chraccn == 'chr3'))
+    session.commit()
+    assert session.scalar(select(func.count()).select_from(hit_rtree)) < 300
+
+    build_rtree()
+    build_rtree()  # Only missing boxes are added
+    session.expire_all()
+    assert session.scalar(select(func.count()).select_from(hit_rtree)) == 300
+    assert session.scalar(select(func.count()).select_from(Contig)) == 3
+    assert keys(session.scalars(hits_in_window('chr1', 5000, 8000))) == expected
+    hits = all_hits(session)
+    assert keys(session.scalars(hits_in_window('chr3', 1, 10 ** 9))) == keys(hit for hit in hits if hit.chraccn == 'chr3')
@@ -0,0 +1,51 @@
+"""
+Tests of the single-pass hit sinks: route_hits sends each hit to every sink whose filter accepts it.
+"""
+
+from types import SimpleNamespace
+import math
+import numpy as np
+
+from jps.sinks import (CountSink, HistogramSink, StoSink, TblSink, all_of, evalue_le, everything,
+                       route_hits, unique)
+import jps.util.iosto as iosto
+import jps.util.tblio as tblio
+
+
+def test_route_hits(search, tmp_path):
+    counts = {
+        'all': CountSink(),
+        'unique': CountSink(unique),
+        'strict': CountSink(evalue_le(3.1e-06)),
+        'unique_strict': CountSink(all_of(unique, evalue_le(3.1e-06))),
+    }
+    sto = StoSink(str(tmp_path / 'unique.sto'), unique)
+    tbl = TblSink(str(tmp_path / 'all.tbl'), everything)
+    hist = HistogramSink()
+    route_hits(search.iter_hits(alnseqs=True, features=True), [*counts.values(), sto, tbl, hist])
+
+    # Ranks 1 and 2 have the same sequence, so rank 2 is not unique
+    assert {name: sink.count for name, sink in counts.items()} == {
+        'all': 5, 'unique': 4, 'strict': 2, 'unique_strict': 2}
+    assert sum(hist.counts) == 5
+
+    # Rank 2 is a duplicate and rank 4 is missing from the alignment, so only ranks 0, 1 and 3 are written
+    sequences, features = iosto.sto_read(sto.path)
+    assert [seq.chraccn for seq in sequences.values()] == ['JAAYCJ010000321.1', 'NZ_JACHZX010000001.1', 'NZ_JAGL01000002.1']
+    assert sorted(feat.fmt for feat in features) == ['GR', 'GR', 'GS', 'GS', 'GS']
+
+    rows = list(tblio.tbl_read(tbl.path, tbl.headers))
+    assert [row[0] for row in rows] == ['JAAYCJ010000321.1', 'NZ_JACHZX010000001.1', 'CAIUPP010000023.1',
+                                        'NZ_JAGL01000002.1', 'NZ_JACHOS010000005.1']
+
+
+def test_histogram_zero_evalue():
+    # An E-value of 0 is binned as the smallest positive float instead of failing on log10(0)
+    hist = HistogramSink()
+    for evalue in (0.0, 1e-10, 1e-10):
+        hist.write(SimpleNamespace(evalue=evalue))
+    assert sorted(hist.counts) == [1, 2]
+    assert all(math.isfinite(center) for center in hist.centers)
+
+    from_evalues = HistogramSink.from_evalues(np.array([0.0, 1e-10, 1e-10]))
+    assert from_evalues.bins == hist.bins
@@ -0,0 +1,97 @@
+"""
+Tests of duplicate detection: sequence digests, MinHash identity estimates, and greedy clustering,
+including of the hits routed by route_hits.
+"""
+
+from types import SimpleNamespace
+import random
+import numpy as np
+import pytest
+
+from jps.sinks import CountSink, route_hits, unique
+from jps.util.sketch import MinHasher, SketchClusterer, cluster, degap, kmer_hashes, seq_digest
+
+
+def random_seq(rng: random.Random, n: int) -> str:
+    return ''.join(rng.choice('ACGT') for _ in range(n))
+
+
+def mutate(rng: random.Random, seq: str, rate: float) -> str:
+    return ''.join(rng.choice('ACGT'.replace(c, '')) if rng.random() < rate else c for c in seq)
+
+
+def test_degap():
+    assert degap('GGGUa.G.CAG-CGGA~') == 'GGGTAGCAGCGGA'
+    assert seq_digest(degap('ac-gu')) == seq_digest('ACGT')
+    assert seq_digest('ACGT') != seq_digest('ACGA')
+
+
+def test_kmer_hashes():
+    seq = 'ACGTNACGTACGUU'
+    kmers = {seq[i:i + 4].replace('U', 'T') for i in range(len(seq) - 3)}
+    assert len(kmer_hashes(seq, 4)) == len({kmer for kmer in kmers if 'N' not in kmer})
+    assert len(kmer_hashes('ACG', 4)) == 0
+    # U and T are the same base, and case is ignored
+    assert np.array_equal(kmer_hashes('acguacgu', 4), kmer_hashes('ACGTACGT', 4))
+
+
+def test_minhash_identity():
+    rng = random.Random(0)
+    minhash = MinHasher(k=9, num_perm=256)
+    seq = random_seq(rng, 400)
+    assert minhash.identity(minhash.sketch(seq), minhash.sketch(seq)[None, :]).tolist() == [1]
+    assert minhash.sketch('ACGT') is None
+
+    # Identity estimates fall as sequences diverge, and unrelated sequences are far apart
+    estimates = [float(minhash.identity(minhash.sketch(seq), minhash.sketch(mutate(rng, seq, rate)))) for rate in (0.01, 0.05)]
+    assert 0.97 <= estimates[0] <= 1
+    assert 0.9 <= estimates[1] < estimates[0]
+    assert float(minhash.identity(minhash.sketch(seq), minhash.sketch(random_seq(rng, 400)))) < 0.8
+
+    with pytest.raises(ValueError):
+        MinHasher(k=33)
+
+
+def test_cluster():
+    rng = random.Random(1)
+    families = [random_seq(rng, 300) for _ in range(10)]
+    seqs, labels = [], []
+    for _ in range(100):
+        i = rng.randrange(len(families))
+        seqs.append(mutate(rng, families[i], 0.01))
+        labels.append(i)
+
+    # Sequences of the same family, and only those, share a cluster
+    clusters = cluster(seqs, identity=0.9)
+    assert len(set(clusters)) == len(set(labels))
+    assert {(c, l) for c, l in zip(clusters, labels)} == {(clusters[labels.index(l)], l) for l in set(labels)}
+
+
+def test_clusterer():
+    rng = random.Random(2)
+    seq = random_seq(rng, 200)
+    clusterer = SketchClusterer(identity=0.95)
+    assert clusterer.add(seq) == (0, True)
+    assert clusterer.add(seq) == (0, False)  # Exact duplicate, by digest
+    assert clusterer.add(mutate(rng, seq, 0.005)) == (0, False)
+    assert clusterer.add(random_seq(rng, 200)) == (1, True)
+    # Sequences too short to sketch are only matched exactly
+    assert clusterer.add('ACG') == (2, True)
+    assert clusterer.add('ACG') == (2, False)
+    assert clusterer.nclusters == 3
+
+    with pytest.raises(ValueError):
+        SketchClusterer(num_perm=128, rows=3)
+
+
+def test_route_hits_identity():
+    rng = random.Random(3)
+    seq = random_seq(rng, 200)
+    hits = [SimpleNamespace(esltag=f'chr/{i}-{i + 199}', evalue=1e-5, alnseq=SimpleNamespace(alnseq=alnseq, digest=None))
+            for i, alnseq in enumerate([seq, mutate(rng, seq, 0.005), random_seq(rng, 200)])]
+
+    # With identity, the near duplicate of the first hit is not unique
+    for identity, expected in ((None, 3), (0.95, 2)):
+        sink = CountSink(unique)
+        route_hits(hits, [sink], identity=identity)
+        assert sink.count == expected
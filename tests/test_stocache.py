@@ -0,0 +1,62 @@
+"""
+Tests of the alignment cache: an alignment loaded from its cache entry equals the parsed file.
+"""
+
+import os
+import shutil
+import time
+import numpy as np
+
+from jps.util.alignment import StoAlignment
+from jps.util.stocache import cache_key, evict, load_alignment
+
+from conftest import STO
+
+
+def assert_equal(aln: StoAlignment, expected: StoAlignment):
+    np.testing.assert_array_equal(aln.residues, expected.residues)
+    assert aln.esltags == expected.esltags
+    assert [(iv.chraccn, iv.start, iv.end, iv.strand) for iv in aln.intervals] == \
+        [(iv.chraccn, iv.start, iv.end, iv.strand) for iv in expected.intervals]
+    assert aln.gc.keys() == expected.gc.keys()
+    assert all(np.array_equal(aln.gc[f], expected.gc[f]) for f in aln.gc)
+    assert aln.gr.keys() == expected.gr.keys()
+    assert all(np.array_equal(aln.gr[k], expected.gr[k]) for k in aln.gr)
+    assert aln.features == expected.features
+
+
+def test_load_alignment(tmp_path):
+    cachedir = str(tmp_path / 'cache')
+    expected = StoAlignment.from_file(STO)
+
+    miss = load_alignment(STO, cachedir=cachedir)
+    assert os.listdir(cachedir) == [f"{cache_key(STO)}.npz"]
+    hit = load_alignment(STO, cachedir=cachedir)
+
+    assert_equal(miss, expected)
+    assert_equal(hit, expected)
+    assert hit.to_sto() == expected.to_sto()
+
+
+def test_cache_key(tmp_path):
+    sto = shutil.copy(STO, str(tmp_path / 'copy.sto'))
+    # Path keys change with the file's path or mtime; digest keys only with its content
+    assert cache_key(sto) != cache_key(STO)
+    assert cache_key(sto, digest=True) == cache_key(STO, digest=True)
+
+    key = cache_key(sto)
+    os.utime(sto, ns=(0, 0))
+    assert cache_key(sto) != key
+
+
+def test_evict(tmp_path):
+    cachedir = str(tmp_path / 'cache')
+    stos = [shutil.copy(STO, str(tmp_path / f'{i}.sto')) for i in range(3)]
+    for i, sto in enumerate(stos):
+        load_alignment(sto, cachedir=cachedir)
+        os.utime(os.path.join(cachedir, f"{cache_key(sto)}.npz"), (time.time() + i, time.time() + i))
+    size = os.path.getsize(os.path.join(cachedir, f"{cache_key(stos[0])}.npz"))
+
+    # The least recently used entries are removed first
+    evict(cachedir, maxbytes=2 * size)
+    assert sorted(os.listdir(cachedir)) == sorted(f"{cache_key(sto)}.npz" for sto in stos[1:])
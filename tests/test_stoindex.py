@@ -0,0 +1,77 @@
+"""
+Tests of the Stockholm byte-offset index: rows and column windows read through it match
+the parsed file.
+"""
+
+import os
+import shutil
+import pytest
+
+from jps.util.iosto import StoSequence, sto_read
+from jps.util.stoindex import StoIndex, StoReader, stoindex
+
+from conftest import STO
+
+
+@pytest.fixture
+def sto(tmp_path) -> str:
+    """ A copy of the fixture alignment, so that its sidecar index is written to tmp_path. """
+    return shutil.copy(STO, str(tmp_path / 'search.out.sto'))
+
+
+def test_stoindex(sto):
+    index = stoindex(sto)
+    assert index.ncols == 22
+    assert index.blocks == [0, 16]
+    assert len(index.rows) == 4 + 2 + 2  # Sequences, GC, and GR rows
+    assert os.path.exists(f"{sto}.idx")
+    assert StoIndex.load(f"{sto}.idx") == index
+
+
+def test_stoindex_stale(sto):
+    stoindex(sto)
+    sequences, features = sto_read(sto)
+    del sequences['CAIUPP010000023.1/192046-192099']
+    with open(sto, 'w') as f:
+        f.write('# STOCKHOLM 1.0\n\n')
+        f.writelines(f'{esltag} {seq.alnseq}\n' for esltag, seq in sequences.items())
+        f.write('//\n')
+
+    # The rewritten file no longer matches the saved index, which is rebuilt
+    with StoReader(sto) as reader:
+        assert reader.esltags == list(sequences)
+        assert reader.index.blocks == [0]
+
+
+def test_fetch(sto):
+    sequences, features = sto_read(sto)
+    with StoReader(sto) as reader:
+        assert len(reader) == 4
+        assert reader.esltags == list(sequences)
+        for esltag, seq in sequences.items():
+            assert reader.fetch(esltag) == seq.alnseq
+        with pytest.raises(KeyError):
+            reader.fetch('missing/1-2')
+
+
+@pytest.mark.parametrize('start, stop', [(0, 16), (3, 9), (10, 20), (16, 22), (15, 17), (20, 100)])
+def test_fetch_window(sto, start, stop):
+    # Windows within, and across, the two blocks of the alignment
+    sequences, features = sto_read(sto)
+    with StoReader(sto) as reader:
+        assert reader.sequences(list(sequences), start, stop) == {
+            esltag: StoSequence.from_esltag(esltag, seq.alnseq[start:stop])
+            for esltag, seq in sequences.items()
+        }
+
+
+def test_gc_gr(sto):
+    sequences, features = sto_read(sto)
+    with StoReader(sto) as reader:
+        assert reader.gc_fields == ['SS_cons', 'RF']
+        for feat in features:
+            if feat.fmt == 'GC':
+                assert reader.gc(feat.field) == feat.text
+                assert reader.gc(feat.field, 14, 18) == feat.text[14:18]
+            elif feat.fmt == 'GR':
+                assert reader.gr(feat.esltag, feat.field) == feat.text
@@ -0,0 +1,72 @@
+"""
+Tests of search summaries: counts agree with routing the hits, score arrays are deferred, and
+get_summary builds the summary of a search that has none.
+"""
+
+import pytest
+from sqlalchemy import delete, inspect, select
+
+from jps.models import Hit, SearchSummary
+from jps.sinks import CountSink, all_of, evalue_le, everything, route_hits, unique
+from jps.summary import get_summary, summarize
+
+THRESHOLDS = [None, 4.5e-07, 3.1e-06, 3.7e-06, 1.0]
+
+
+def routed_counts(search) -> dict:
+    sinks = {}
+    for evalue_max in THRESHOLDS:
+        for first in (False, True):
+            where = unique if first else everything
+            if evalue_max is not None:
+                where = all_of(where, evalue_le(evalue_max))
+            sinks[evalue_max, first] = CountSink(where)
+    route_hits(search.iter_hits(alnseqs=True), list(sinks.values()))
+    return {key: sink.count for key, sink in sinks.items()}
+
+
+def test_summary_counts(search, session):
+    summary = search.summary
+    assert (summary.total, summary.unique) == (5, 4)
+    assert (summary.count(3.1e-06), summary.count(3.1e-06, unique=True)) == (2, 2)
+    for (evalue_max, first), count in routed_counts(search).items():
+        assert summary.count(evalue_max, unique=first) == count, (evalue_max, first)
+
+    bitscores = sorted(search.iter_columns(Hit.bitscore))
+    assert summary.array('bitscores').tolist() == [bitscore for bitscore, in bitscores]
+    assert summary.count_bitscore(bitscores[2][0]) == 3
+    assert sum(summary.chr_counts.values()) == 5
+
+
+def test_summary_deferred(search, session):
+    session.expire_all()
+    summary = session.scalars(select(SearchSummary)).one()
+    # Total and unique are loaded without the score arrays
+    assert summary.count() == 5
+    assert {'evalues', 'unique_evalues', 'bitscores'} <= inspect(summary).unloaded
+    assert summary.count(1.0) == 5
+    assert 'evalues' not in inspect(summary).unloaded
+
+
+def test_get_summary(search, session):
+    expected = {evalue_max: search.summary.count(evalue_max, unique=True) for evalue_max in THRESHOLDS}
+
+    # A search ingested before summaries existed has its summary built when first asked for
+    session.execute(delete(SearchSummary))
+    session.commit()
+    session.expire_all()
+    assert search.summary is None
+    summary = get_summary(session, search)
+    assert {evalue_max: summary.count(evalue_max, unique=True) for evalue_max in THRESHOLDS} == expected
+    assert get_summary(session, search) is summary
+
+    # Summarizing again replaces the summary
+    summarize(session, search)
+    session.commit()
+    assert session.scalars(select(SearchSummary)).one().total == 5
+
+
+@pytest.mark.parametrize('evalue_max', [0.0, 1e-9])
+def test_summary_none(search, evalue_max):
+    assert search.summary.count(evalue_max) == 0
+    assert search.summary.count(evalue_max, unique=True) == 0
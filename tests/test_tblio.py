@@ -0,0 +1,114 @@
+"""
+Tests of table i/o: typed reading of cmsearch tables, with predicates pushed into the scan,
+and streaming table writing.
+"""
+
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+import jps.util.tblio as tblio
+
+from conftest import TBL
+
+
+def test_tbl_read():
+    rows = list(tblio.tbl_read(TBL, tblio.CMSEARCH_TBLHEADERS))
+    assert len(rows) == 5
+    assert rows[0][:4] == ['JAAYCJ010000321.1', '-', 'nhaA-I', 'RF03057']
+    # The description, the last column, keeps its spaces
+    assert rows[0][-1] == 'Phycisphaerae bacterium isolate AS06rmzACSIP_418 543678_AS06, whole genome shotgun sequence'
+
+
+def test_tbl_read_typed():
+    table = tblio.tbl_read_typed(TBL)
+    rows = list(tblio.tbl_read(TBL, tblio.CMSEARCH_TBLHEADERS))
+    assert table.dtype.names == tuple(tblio.CMSEARCH_TBLHEADERS)
+    assert table['seq_from'].dtype == np.int64
+    assert table['seq_from'].tolist() == [2831, 978422, 192046, 232447, 205852]
+    np.testing.assert_allclose(table['E_value'], [4.5e-07, 3e-06, 3.2e-06, 3.7e-06, 4.7e-06])
+    assert table['target_name'].tolist() == [row[0] for row in rows]
+    assert table['description_of_target'].tolist() == [row[-1] for row in rows]
+
+
+def test_tbl_read_typed_chunks():
+    chunks = list(tblio.tbl_iter_typed(TBL, chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert np.array_equal(np.concatenate(chunks), tblio.tbl_read_typed(TBL))
+
+
+def test_tbl_read_typed_frame():
+    frame = tblio.tbl_read_typed(TBL, frame=True)
+    assert list(frame.columns) == tblio.CMSEARCH_TBLHEADERS
+    assert frame['score'].tolist() == [62.7, 59.3, 59.2, 58.9, 58.5]
+
+
+def test_tbl_read_invalid(tmp_path):
+    path = tmp_path / 'invalid.tbl'
+    path.write_text('seq 1 2\nseq x 2\n')
+    schema = [('name', object), ('start', np.int64), ('end', np.int64)]
+    with pytest.raises(tblio.TableError):
+        tblio.tbl_read_typed(str(path), schema)
+
+    path.write_text('seq 1\n')
+    with pytest.raises(tblio.TableError):
+        tblio.tbl_read_typed(str(path), schema)
+
+
+@pytest.mark.parametrize('where, ranks', [
+    (tblio.TblFilter(), [0, 1, 2, 3, 4]),
+    (tblio.TblFilter(evalue_max=3.2e-06), [0, 1, 2]),
+    (tblio.TblFilter(score_min=59.25), [0, 1]),
+    (tblio.TblFilter(strand='-'), [0, 3]),
+    (tblio.TblFilter(targets={'CAIUPP010000023.1', 'NZ_JAGL01000002.1', 'missing'}), [2, 3]),
+    (tblio.TblFilter(evalue_max=3.5e-06, strand='+'), [1, 2]),
+])
+def test_tbl_filter(where, ranks):
+    rows = list(tblio.tbl_read(TBL, tblio.CMSEARCH_TBLHEADERS))
+    assert list(tblio.tbl_read(TBL, tblio.CMSEARCH_TBLHEADERS, where)) == [rows[i] for i in ranks]
+    assert tblio.tbl_read_typed(TBL, where=where)['target_name'].tolist() == [rows[i][0] for i in ranks]
+
+
+def test_tbl_filter_malformed(tmp_path):
+    # Lines too short for the predicates are not rejected by them, but reported by the full split
+    path = tmp_path / 'invalid.tbl'
+    path.write_text('seq 1\n')
+    schema = [('name', object), ('score', np.float64), ('E_value', np.float64)]
+    with pytest.raises(tblio.TableError):
+        tblio.tbl_read_typed(str(path), schema, where=tblio.TblFilter(evalue_max=1))
+
+
+def test_tbl_writer_roundtrip(tmp_path):
+    table = tblio.tbl_read_typed(TBL)
+    path = str(tmp_path / 'out.tbl')
+    with tblio.TblWriter(path, tblio.cmsearch_tblout_columns(), pad_last=False, rule=True,
+                         footer='#\n# [ok]\n') as writer:
+        for row in table.tolist():
+            writer.write(row)
+
+    assert np.array_equal(tblio.tbl_read_typed(path), table)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('#target name ') and lines[1].startswith('#---')
+    assert lines[-2:] == ['#', '# [ok]']
+    # Columns are aligned, and grow to fit the longest value
+    assert len({line.index(' nhaA-I ') for line in lines[2:-2]}) == 1
+
+
+def test_tbl_writer_fixed(tmp_path):
+    # Columns of fixed width are written straight to the file, and long values overflow
+    path = str(tmp_path / 'out.tbl')
+    columns = [tblio.TblColumn('name', width=4, grow=False), tblio.TblColumn('score', width=6, align='>', spec='.1f', grow=False)]
+    with tblio.TblWriter(path, columns) as writer:
+        assert writer._spool is None
+        writer.write(['a', 1.25])
+        writer.write(['abcdef', 10])
+    with open(path) as f:
+        assert f.read().splitlines() == ['#name  score', 'a        1.2', 'abcdef   10.0']
+
+
+def test_tbl_write(tmp_path):
+    path = str(tmp_path / 'out.tbl')
+    rows = [SimpleNamespace(name='a', score=1), SimpleNamespace(name='longer', score=10)]
+    tblio.tbl_write(['name', 'score'], rows, path)
+    assert list(tblio.tbl_read(path, ['name', 'score'])) == [['a', '1'], ['longer', '10']]
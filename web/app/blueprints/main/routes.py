@@ -38,7 +38,10 @@ def index():
                            next_url=next_url, prev_url=prev_url)
 
 
-from models import Stockholm
+from jps.util.stoindex import StoReader
+
+
+VIEW_PER_PAGE = 200  # Sequences per page of the alignment viewer
 
 # class Sto:
 #     def __init__(self, data):
@@ -89,6 +92,16 @@ from models import Stockholm
 def view(id_):
     upload = Upload.query.filter(Upload.user_id == current_user.id, Upload.id == id_).first_or_404()
     path = os.path.join(current_app.config["UPLOAD_FOLDER"], upload.filename)
-    sto = Stockholm.from_file(path)
+
+    # Only fetch the sequences and columns on display
+    page = request.args.get('page', 1, type=int)
+    start = request.args.get('start', 0, type=int)
+    stop = request.args.get('stop', None, type=int)
+    with StoReader(path) as reader:
+        esltags = reader.esltags[(page - 1) * VIEW_PER_PAGE:page * VIEW_PER_PAGE]
+        sto = {
+            'msa': {esltag: {'name': esltag, 'seq': reader.fetch(esltag, start, stop)} for esltag in esltags},
+            'SS_cons': reader.gc('SS_cons', start, stop) if 'SS_cons' in reader.gc_fields else '',
+        }
     return render_template('main/view.jinja', upload=upload, sto=sto)
 